@@ -14,10 +14,205 @@
    Scurry requirements: Write a program that prints the numbers from 1 to 100. But for multiples of three print “Three”
                         instead of the number and for the multiples of five print “Five”.
                         For numbers which are multiples of both three and five print “ThreeFive”.
+
+   The rules are a list of divisors and labels, 3 -> Three and 5 -> Five by default: the labels repeat with a period,
+   the lcm of the divisors, and are computed once over a period by PeriodTable. write_numbers copies precomputed
+   chunks of lines rather than labelling each number, in blocks of BLOCK_SIZE numbers, so the memory stays flat and
+   the output is written in large writes.
 """
+import argparse
+import io
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+# The labels of longer periods are not tabulated, they are computed from the rules
+MAX_PERIOD = 1 << 20
+
+# Chunks of lines precomputed at most by PeriodTable.chunk_pieces, 10 ** CHUNK_DIGITS lines each
+MAX_CHUNKS = 128
+
+
+class PeriodTable(object):
+    """ Class PeriodTable labels the numbers with a set of divisor rules, from a table over one period
+        The label of a number is the concatenation of the labels of the rules whose divisor divides it, in the order
+        of the rules, or the number itself when there are none. It only depends on the number modulo the lcm of the
+        divisors, the period: the labels of a period are computed once and a number is a lookup.
+        A period longer than max_period is not tabulated: a number is labelled with a modulo for each rule,
+        a range with a sieve over the multiples of each divisor.
+        Attributes:
+            source: the rules as given
+            rules: tuple of (divisor, label)
+            period: lcm of the divisors
+            labels: the label of each residue modulo period, None for the numbers printed as is;
+                    None when the period is not tabulated
+    """
+
+    def __init__(self, rules, max_period: int = MAX_PERIOD):
+        """PeriodTable Constructor"""
+        self.source = rules
+        self.rules = tuple((divisor, label) for divisor, label in rules)
+        for divisor, label in self.rules:
+            if not isinstance(divisor, int) or divisor < 1 or not isinstance(label, str) or not label:
+                raise ValueError(f'Invalid rule: {divisor!r} {label!r}')
+
+        self.period = 1
+        for divisor, _ in self.rules:
+            self.period = self.period * divisor // math.gcd(self.period, divisor)
+
+        # A divisor multiple of another one adds nothing to the numbers with a label
+        divisors = sorted({divisor for divisor, _ in self.rules})
+        self._divisors = [d for d in divisors if not any(d % other == 0 for other in divisors if other < d)]
+        self._counts = None
+        self._pieces = {}
+        self.labels = None
+        if self.period <= max_period:
+            labels = [""] * self.period
+            for divisor, label in self.rules:
+                for residue in range(0, self.period, divisor):
+                    labels[residue] += label
+            self.labels = [label or None for label in labels]
+
+    def label(self, n: int) -> str:
+        """Return the label of n, the numbers that are not int (e.g. 3.0) are labelled with a modulo for each rule"""
+        if self.labels is not None and isinstance(n, int):
+            label = self.labels[n % self.period]
+        else:
+            label = "".join(label for divisor, label in self.rules if n % divisor == 0)
+        return label or str(n)
+
+    def labels_range(self, start: int, stop: int) -> list:
+        """Return the labels of the numbers from start to stop excluded"""
+        count = stop - start
+        if count <= 0:
+            return []
+
+        if self.labels is not None:
+            # The labels of the period copied cyclically over the range, from the residue of start
+            labels = self.labels
+            head = labels[start % self.period:start % self.period + count]
+            rest = count - len(head)
+            row = head + labels * (rest // self.period) + labels[:rest % self.period]
+        else:
+            row = [""] * count
+            for divisor, label in self.rules:
+                for i in range(-start % divisor, count, divisor):
+                    row[i] += label
+        return [label or str(n) for label, n in zip(row, range(start, stop))]
+
+    def count_labelled(self, n: int) -> int:
+        """Return how many numbers from 1 to n have a label
+
+           When the period is tabulated, from the counts of the numbers with a label over one period. Otherwise by
+           inclusion-exclusion over the divisors: the sets of divisors with an lcm over n divide no number up to n,
+           they are left out with all the sets containing them.
+        """
+        if n <= 0:
+            return 0
+        if self.labels is not None:
+            if self._counts is None:
+                # Counts of the numbers with a label from 1 to i, for i from 0 to period
+                self._counts = [0]
+                self._counts.extend(accumulate(label is not None for label in self.labels[1:] + self.labels[:1]))
+            return n // self.period * self._counts[-1] + self._counts[n % self.period]
+        return _count_multiples(self._divisors, n)
+
+    def text_length(self, n: int) -> int:
+        """Return the size in bytes of the lines of the numbers from 1 to n, computed without the lines
+
+           Each line ends with a newline. The labels of a number are concatenated, so the bytes of the labels add up
+           rule by rule; the numbers printed as is are counted by number of digits.
+        """
+        if n <= 0:
+            return 0
+        length = n + sum(len(label.encode('utf-8')) * (n // divisor) for divisor, label in self.rules)
+        low = 1
+        digits = 1
+        while low <= n:
+            high = min(low * 10 - 1, n)
+            printed = high - low + 1 - (self.count_labelled(high) - self.count_labelled(low - 1))
+            length += printed * digits
+            low *= 10
+            digits += 1
+        return length
+
+    def chunks(self, digits: int):
+        """Return the number of chunks of 10 ** digits numbers after which the lines repeat, see chunk_pieces,
+           None if there are more than MAX_CHUNKS or if the period is not tabulated
+        """
+        chunks = self.period // math.gcd(self.period, 10 ** digits)
+        return chunks if self.labels is not None and chunks <= MAX_CHUNKS else None
+
+    def chunk_pieces(self, digits: int, chunk: int) -> list:
+        """Return the lines of a chunk of numbers sharing all but their low digits, split where the high digits go
+
+           Within a run of numbers sharing the high digits, the lines only depend on the low digits and on the number
+           modulo the period: they repeat every lcm(period, 10 ** digits) numbers, a few chunks of 10 ** digits.
+           The lines of a chunk are the join of its pieces with the high digits.
+
+           The pieces are kept on the table, the writers of the ranges and of the shards share them.
+
+           Keywords arguments:
+           digits: number of low digits
+           chunk: the high digits of the chunk modulo chunks(digits)
+        """
+        pieces = self._pieces.get((digits, chunk))
+        if pieces is None:
+            pieces = self._pieces[digits, chunk] = self._chunk_pieces(digits, chunk)
+        return pieces
+
+    def _chunk_pieces(self, digits: int, chunk: int) -> list:
+        size = 10 ** digits
+        period = self.period
+        labels = self.labels
+        pieces, current = [], []
+        for low in range(size):
+            label = labels[(chunk * size + low) % period]
+            if label is None:
+                pieces.append("".join(current))
+                current = ["%0*d\n" % (digits, low)]
+            else:
+                current.append(label + "\n")
+        pieces.append("".join(current))
+        return pieces
+
+
+def _count_multiples(divisors: list, n: int) -> int:
+    """Return how many numbers from 1 to n are a multiple of at least one of the divisors, by inclusion-exclusion:
+       the sets of divisors are added for an odd size, subtracted for an even one. Only the sets with an lcm up to n
+       are visited, the number of terms is bounded by n whatever the number of divisors.
+    """
+    total = 0
+
+    def extend(index: int, lcm: int, sign: int):
+        nonlocal total
+        for i in range(index, len(divisors)):
+            combined = lcm * divisors[i] // math.gcd(lcm, divisors[i])
+            if combined <= n:
+                total += sign * (n // combined)
+                extend(i + 1, combined, -sign)
+
+    extend(0, 1, 1)
+    return total
+
+
+# Period tables by class, see Multiple.table
+_tables = {}
+
 
 class Multiple(object):
 
+    # Divisors and their labels, in the order the labels are concatenated. A tuple: assign a new one to change them
+    RULES = ((3, "Three"), (5, "Five"))
+
+    # Low digits of the numbers of a chunk of write_numbers, the chunks have 10 ** CHUNK_DIGITS numbers
+    CHUNK_DIGITS = 4
+
+    # Numbers written at once by write_numbers
+    BLOCK_SIZE = 100000
+
     @classmethod
     def is_multiple_of(cls, n: int, x: int) -> bool:
         """Check if n is multiple of x."""
@@ -28,14 +223,16 @@ class Multiple(object):
         if n in (None, 0):
             raise Exception(f'Invalid parameter value: {n}')
 
-        result = ""
-        # check if is multiple of 3
-        if Multiple.is_multiple_of(n, 3):
-            result += "Three"
-        if Multiple.is_multiple_of(n, 5):
-            result += "Five"
+        # the labels of the divisors of n, looked up in the table of the period
+        return cls.table().label(n)
 
-        return str(n) if result == "" else result
+    @classmethod
+    def table(cls) -> PeriodTable:
+        """Return the PeriodTable of the RULES of the class, built again when they are replaced"""
+        table = _tables.get(cls)
+        if table is None or table.source is not cls.RULES:
+            table = _tables[cls] = PeriodTable(cls.RULES)
+        return table
 
     @classmethod
     def print_numbers(cls, max: int):
@@ -51,13 +248,235 @@ class Multiple(object):
            Return:
            an iterator which cares about the range
         """
-        nums = [Multiple.check_number(n) for n in range(1, max + 1)]
+        cls.write_numbers(max, sys.stdout)
+
+    @classmethod
+    def iter_numbers(cls, max: int, start: int = 1):
+        """Yield the label of each number from start to max, one at a time
+
+           Keywords arguments:
+           max: Integer threshold
+           start: first number
+        """
+        for n in range(start, max + 1):
+            yield cls.check_number(n)
+
+    @classmethod
+    def iter_blocks(cls, max: int, block_size: int = None, start: int = 1):
+        """Yield the lines of the numbers from start to max, a block of lines at a time as a single string,
+           see iter_lines
+
+           Keywords arguments:
+           max: Integer threshold
+           block_size: numbers in a block, rounded down to a multiple of 10 ** CHUNK_DIGITS
+           start: first number
+        """
+        return iter_lines(cls.table(), start, max + 1, cls.CHUNK_DIGITS, block_size or cls.BLOCK_SIZE)
+
+    @classmethod
+    def write_numbers(cls, max: int, file=None, block_size: int = None) -> int:
+        """Write the lines of the numbers from 1 to max to a file, a block at a time
+
+           Keywords arguments:
+           max: Integer threshold
+           file: a text or binary file object, the standard output by default
+           block_size: numbers written at once, see iter_blocks
+
+           Return:
+           the number of characters written
+        """
+        file = sys.stdout if file is None else file
+        binary = _is_binary(file)
+        written = 0
+        for block in cls.iter_blocks(max, block_size):
+            file.write(block.encode('utf-8') if binary else block)
+            written += len(block)
+        return written
+
+    @classmethod
+    def write_sharded(cls, max: int, path: str, workers: int = None, shards: int = None,
+                      block_size: int = None) -> int:
+        """Write the lines of the numbers from 1 to max to a file, the shards of the range on a pool of processes
+
+           The offset of each line is known in advance, see line_offset: the file is created with its final size
+           and each shard is written straight to its offset, in any order.
+
+           Keywords arguments:
+           max: Integer threshold
+           path: the file to write
+           workers: number of processes, the number of CPUs by default
+           shards: number of shards, 4 for each process by default
+           block_size: numbers written at once, see iter_blocks
+
+           Return:
+           the size of the file in bytes
+        """
+        workers = workers or os.cpu_count() or 1
+        shards = shards or workers * 4
+        table = cls.table()
+        size = table.text_length(max)
+        with open(path, 'wb') as fp:
+            fp.truncate(size)
+
+        # The shards are bounded by multiples of a chunk, so they are written by chunks too: only the first one
+        # starts at 1
+        chunk = 10 ** cls.CHUNK_DIGITS
+        shard_size = -(-max // shards // chunk) * chunk or chunk
+        bounds = [1] + list(range(shard_size, max + 1, shard_size)) + [max + 1]
+        tasks = [(cls.RULES, cls.CHUNK_DIGITS, block_size or cls.BLOCK_SIZE, path, start, stop,
+                  table.text_length(start - 1))
+                 for start, stop in zip(bounds, bounds[1:]) if start < stop]
+        if workers < 2 or len(tasks) < 2:
+            for task in tasks:
+                _write_shard(*task)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(_write_shard, *zip(*tasks)):
+                    pass
+        return size
+
+    @classmethod
+    def line_offset(cls, n: int) -> int:
+        """Return the offset in bytes of the line of n in the output of write_numbers, computed without the lines
+           before it
+        """
+        return cls.table().text_length(n - 1)
+
+    @classmethod
+    def get_lines(cls, first: int, last: int) -> list:
+        """Return the lines of the numbers from first to last, without the ones before them
+
+           Keywords arguments:
+           first: first number
+           last: last number, included
+        """
+        return cls.table().labels_range(first, last + 1)
+
+    @classmethod
+    def read_lines(cls, file, first: int, last: int) -> list:
+        """Return the lines of the numbers from first to last read from the output of write_numbers, a seek to
+           the first one and a read of exactly the lines
+
+           Keywords arguments:
+           file: a binary file object open on the output of write_numbers
+           first: first number
+           last: last number, included
+        """
+        if last < first:
+            return []
+        start = cls.line_offset(first)
+        file.seek(start)
+        return file.read(cls.line_offset(last + 1) - start).decode('utf-8').splitlines()
+
+
+def iter_lines(table: PeriodTable, start: int, stop: int, digits: int, block_size: int):
+    """Yield the lines of the numbers from start to stop excluded, a block of lines at a time as a single string
+
+       The numbers are written by chunks of 10 ** digits, see PeriodTable.chunk_pieces: a chunk is a join of
+       precomputed pieces with its high digits, a copy of memory rather than a label for each number.
+       The numbers before the first whole chunk and after the last one are labelled from the table, like all
+       the numbers when the chunks of the period are too many to be precomputed.
+
+       Keywords arguments:
+       table: the PeriodTable of the rules
+       start, stop: the range of the numbers
+       digits: low digits of the numbers of a chunk
+       block_size: numbers in a block, rounded down to a multiple of 10 ** digits
+    """
+    size = 10 ** digits
+    chunks = table.chunks(digits)
+    if chunks is None:
+        for first in range(start, stop, block_size):
+            yield _lines(table, first, min(first + block_size, stop))
+        return
+    block_chunks = block_size // size or 1
+
+    # The first chunk has fewer digits, the range may start in the middle of a chunk
+    first_chunk = -(-start // size) * size if start > size else size
+    if start < min(first_chunk, stop):
+        yield _lines(table, start, min(first_chunk, stop))
+
+    current = first_chunk
+    block = []
+    while current + size <= stop:
+        high = current // size
+        block.append(str(high).join(table.chunk_pieces(digits, high % chunks)))
+        current += size
+        if len(block) >= block_chunks:
+            yield "".join(block)
+            block = []
+    if block:
+        yield "".join(block)
+
+    if current < stop:
+        yield _lines(table, current, stop)
+
+
+# Period tables of the processes writing the shards, by rules
+_shard_tables = {}
+
+
+def _write_shard(rules: tuple, digits: int, block_size: int, path: str, start: int, stop: int, offset: int):
+    """Write the lines of the numbers from start to stop excluded at offset in a file, in a worker process"""
+    table = _shard_tables.get(rules)
+    if table is None:
+        table = _shard_tables[rules] = PeriodTable(rules)
+    with open(path, 'r+b', buffering=0) as fp:
+        for block in iter_lines(table, start, stop, digits, block_size):
+            data = block.encode('utf-8')
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fp.fileno(), data, offset)
+            else:
+                fp.seek(offset)
+                fp.write(data)
+            offset += len(data)
+
+
+def _is_binary(file) -> bool:
+    """Return True if file is written bytes: a binary io object, or a file object open in a binary mode.
+       The other file objects, text files or any object with a write method, are written strings.
+    """
+    if isinstance(file, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    mode = getattr(file, 'mode', '')
+    return isinstance(mode, str) and 'b' in mode
+
+
+def _lines(table: PeriodTable, start: int, stop: int) -> str:
+    """Return the lines of the numbers from start to stop excluded"""
+    labels = table.labels_range(start, stop)
+    return "\n".join(labels) + "\n" if labels else ""
+
+
+def parse_rule(value: str) -> tuple:
+    """Parse a DIVISOR=LABEL rule of the command line"""
+    divisor, _, label = value.partition('=')
+    try:
+        return int(divisor), label
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid rule: {value}, DIVISOR=LABEL expected')
+
 
-        for num in nums:
-            print(num)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Print the numbers from 1 to max, Three and Five for the multiples')
+    parser.add_argument('max', type=int, nargs='?', default=100, help='last number')
+    parser.add_argument('-o', '--output', help='file to write to, the standard output by default')
+    parser.add_argument('-r', '--rule', type=parse_rule, action='append', metavar='DIVISOR=LABEL',
+                        help='replace the rules, in the order the labels are concatenated, e.g. -r 3=Fizz -r 5=Buzz')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='processes writing the output file by shards, 0 for a single process')
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    Multiple.print_numbers(100)
+    args = parse_args()
+    multiple = type('Multiple', (Multiple,), {'RULES': tuple(args.rule)}) if args.rule else Multiple
+    if args.output and args.workers:
+        multiple.write_sharded(args.max, args.output, workers=args.workers)
+    elif args.output:
+        with open(args.output, 'wb') as fp:
+            multiple.write_numbers(args.max, fp)
+    else:
+        multiple.print_numbers(args.max)
 
 
@@ -16,9 +16,13 @@
                         For numbers which are multiples of both three and five print “ThreeFive”.
 """
 
+import io
+import os
+import tempfile
 import unittest
+from contextlib import redirect_stdout
 
-from run_multiple import Multiple
+from run_multiple import Multiple, PeriodTable
 
 
 class TestMultiple(unittest.TestCase):
@@ -65,5 +69,140 @@ class TestMultiple(unittest.TestCase):
             x = Multiple.check_number(n)
             self.assertEqual(x, "ThreeFive")
 
+    def test_iter_numbers(self):
+        """Test the labels yielded by iter_numbers"""
+        self.assertEqual(list(Multiple.iter_numbers(self.max)),
+                         [Multiple.check_number(n) for n in range(1, self.max + 1)])
+        self.assertEqual(list(Multiple.iter_numbers(16, start=14)), ["14", "ThreeFive", "16"])
+
+    def test_write_numbers(self):
+        """Test write_numbers around the first and the last chunk, with several block sizes"""
+        size = 10 ** Multiple.CHUNK_DIGITS
+        for max in (0, 1, 15, size - 1, size, size + 1, 3 * size + 7, 5 * size):
+            expected = "".join(Multiple.check_number(n) + "\n" for n in range(1, max + 1))
+            for block_size in (None, 1, 2 * size):
+                output = io.StringIO()
+                written = Multiple.write_numbers(max, output, block_size)
+                self.assertEqual(output.getvalue(), expected)
+                self.assertEqual(written, len(expected))
+
+    def test_write_numbers_binary(self):
+        """Test write_numbers to a binary file"""
+        output = io.BytesIO()
+        Multiple.write_numbers(15, output)
+        self.assertEqual(output.getvalue().split(), [Multiple.check_number(n).encode() for n in range(1, 16)])
+
+    def test_write_numbers_to_other_files(self):
+        """Test write_numbers writes strings to the text files that are not TextIOBase, bytes to the binary ones"""
+        expected = "".join(n + "\n" for n in Multiple.iter_numbers(100))
+        with tempfile.SpooledTemporaryFile(mode='w+') as fp:
+            Multiple.write_numbers(100, fp)
+            fp.seek(0)
+            self.assertEqual(fp.read(), expected)
+        with tempfile.SpooledTemporaryFile(mode='w+b') as fp:
+            Multiple.write_numbers(100, fp)
+            fp.seek(0)
+            self.assertEqual(fp.read(), expected.encode())
+
+        class Writer(object):
+            def __init__(self):
+                self.parts = []
+
+            def write(self, text):
+                self.parts.append(text)
+
+        writer = Writer()
+        Multiple.write_numbers(100, writer)
+        self.assertEqual("".join(writer.parts), expected)
+
+    def test_print_numbers(self):
+        """Test that print_numbers prints a label on each line"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            Multiple.print_numbers(self.max)
+        self.assertEqual(output.getvalue().splitlines(), [Multiple.check_number(n) for n in range(1, self.max + 1)])
+
+    def test_period_table(self):
+        """Test the labels of a set of rules, tabulated and computed from the rules"""
+        rules = ((2, "Two"), (7, "Seven"), (3, "Three"))
+        expected = ["".join(label for divisor, label in rules if n % divisor == 0) or str(n) for n in range(1, 200)]
+        for max_period in (1 << 20, 1):
+            table = PeriodTable(rules, max_period)
+            self.assertEqual(table.period, 42)
+            self.assertEqual([table.label(n) for n in range(1, 200)], expected)
+            self.assertEqual(table.labels_range(1, 200), expected)
+            self.assertEqual(table.labels_range(40, 130), expected[39:129])
+            self.assertEqual(table.labels_range(5, 5), [])
+        self.assertIsNone(PeriodTable(rules, 1).labels)
+
+        with self.assertRaises(ValueError):
+            PeriodTable([(0, "Zero")])
+        with self.assertRaises(ValueError):
+            PeriodTable([(3, "")])
+
+    def test_multiple_with_float(self):
+        """Test check_number with numbers that are not int, as before the period table"""
+        self.assertEqual(Multiple.check_number(7.0), "7.0")
+        self.assertEqual(Multiple.check_number(3.0), "Three")
+        self.assertEqual(Multiple.check_number(15.0), "ThreeFive")
+
+    def test_custom_rules(self):
+        """Test check_number and write_numbers with other rules, with a period not tabulated in chunks"""
+        class Fizz(Multiple):
+            RULES = ((3, "Fizz"), (5, "Buzz"), (7, "Bazz"))
+
+        self.assertEqual(Fizz.check_number(105), "FizzBuzzBazz")
+        self.assertEqual(Fizz.check_number(14), "Bazz")
+        self.assertEqual(Multiple.check_number(105), "ThreeFive")
+
+        max = 3 * 10 ** Multiple.CHUNK_DIGITS + 11
+        output = io.StringIO()
+        Fizz.write_numbers(max, output)
+        self.assertEqual(output.getvalue().splitlines(), [Fizz.check_number(n) for n in range(1, max + 1)])
+
+    def test_line_offset(self):
+        """Test line_offset and get_lines against the output of write_numbers, with a label not in ASCII"""
+        class Fizz(Multiple):
+            RULES = ((4, "Fé"), (6, "Six"), (13, "Treize"))
+
+        for multiple in (Multiple, Fizz):
+            output = io.BytesIO()
+            multiple.write_numbers(12345, output)
+            data = output.getvalue()
+            self.assertEqual(multiple.line_offset(12346), len(data))
+            lines = data.decode('utf-8').splitlines()
+            for n in (1, 2, 9, 10, 99, 100, 9999, 10000, 10001, 12345):
+                self.assertEqual(multiple.line_offset(n), len("".join(line + "\n" for line in lines[:n - 1]).encode()))
+            self.assertEqual(multiple.get_lines(9990, 10010), lines[9989:10010])
+            self.assertEqual(multiple.get_lines(10, 9), [])
+
+    def test_line_offset_with_many_rules(self):
+        """Test line_offset with a period too long to be tabulated, counted by inclusion-exclusion"""
+        primes = [n for n in range(2, 100) if all(n % d for d in range(2, n))][:24]
+
+        class Primes(Multiple):
+            RULES = tuple((prime, f"P{prime}") for prime in primes)
+
+        self.assertIsNone(Primes.table().labels)
+        output = io.BytesIO()
+        Primes.write_numbers(2000, output)
+        self.assertEqual(Primes.line_offset(2001), len(output.getvalue()))
+        self.assertGreater(Primes.line_offset(10 ** 6), 0)
+
+    def test_write_sharded(self):
+        """Test write_sharded writes the same file as write_numbers, in a single process and on a pool"""
+        max = 3 * 10 ** Multiple.CHUNK_DIGITS + 11
+        output = io.BytesIO()
+        Multiple.write_numbers(max, output)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'numbers.txt')
+            for workers, shards in ((1, 3), (2, None)):
+                self.assertEqual(Multiple.write_sharded(max, path, workers=workers, shards=shards),
+                                 len(output.getvalue()))
+                with open(path, 'rb') as fp:
+                    self.assertEqual(fp.read(), output.getvalue())
+            with open(path, 'rb') as fp:
+                self.assertEqual(Multiple.read_lines(fp, 19995, 20005), Multiple.get_lines(19995, 20005))
+
 if __name__ == "__main__":
      unittest.main()
\ No newline at end of file
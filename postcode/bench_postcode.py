@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the postcode library and REST API
+
+   Usage: python bench_postcode.py -o results.json
+          python bench_postcode.py --compare baseline.json
+
+   The corpora are synthetic and reproducible: a fixed seed mixes valid, invalid, lowercase and unspaced postcodes.
+   The startup benchmarks time the import of the library and the first validation in a new interpreter, as a
+   script or a short lived job pays them on each run.
+   Each benchmark reports the best time of --repeat runs. In compare mode the results are checked against a
+   baseline file and the exit code is 1 if any benchmark is slower than --tolerance allows.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+from webapp import Postcode, parse_postcode
+from webapp.suggest import PostcodeSuggester
+
+# Sizes of the corpora for the library benchmarks
+LIBRARY_SIZES = (1000, 10000, 100000)
+
+# Times each postcode appears in the repeated corpora
+REPEATS = 10
+
+# The batch functions and the benchmarks of split_validate on each postcode they are compared with
+SPEEDUP_BASELINES = {
+    'library.validate_many': 'library.split_validate',
+    'library.validate_array': 'library.split_validate',
+    'library.validate_many_repeated': 'library.split_validate_repeated',
+}
+
+# Batch sizes for /postcodes
+BATCH_SIZES = (10, 1000, 10000)
+
+# Number of /postcode/<id> requests
+SINGLE_REQUESTS = 1000
+
+# Timed in a new interpreter: the import of a module, then the first validation.
+# Prints the two times in seconds as JSON
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from webapp import parse_postcode
+parse_postcode('KT10 8BD')
+print(json.dumps([imported - start, time.perf_counter() - imported]))
+"""
+
+VALID_OUTWARD = ('KT10', 'W1A', 'M1', 'B33', 'CR2', 'DN55', 'EC1A', 'SW1W', 'SE1P', 'AB10', 'BS10', 'L1')
+INWARD_LETTERS = 'ABDEFGHJLNPQRSTUWXYZ'
+
+
+def make_corpus(size: int, seed: int = 42) -> list:
+    """Return size postcodes: 60% valid, 25% invalid, 15% malformed, with mixed case and spacing"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        kind = rnd.random()
+        if kind < 0.60:
+            postcode = rnd.choice(VALID_OUTWARD) + " " + rnd.choice(string.digits) + \
+                       "".join(rnd.choices(INWARD_LETTERS, k=2))
+        elif kind < 0.85:
+            postcode = "".join(rnd.choices(string.ascii_uppercase, k=rnd.randint(1, 2))) + \
+                       str(rnd.randint(0, 99)) + " " + rnd.choice(string.digits) + \
+                       "".join(rnd.choices(string.ascii_uppercase, k=2))
+        else:
+            postcode = "".join(rnd.choices(string.ascii_uppercase + string.digits + "$#- ", k=rnd.randint(0, 10)))
+
+        variant = rnd.random()
+        if variant < 0.25:
+            postcode = postcode.lower()
+        elif variant < 0.50:
+            postcode = postcode.replace(" ", "")
+        corpus.append(postcode)
+    return corpus
+
+
+def best_time(func, repeat: int) -> float:
+    """Return the best wall time of repeat calls of func"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_library(sizes, repeat: int) -> dict:
+    """Time the library functions on corpora of the given sizes"""
+    def each(method):
+        def run(corpus):
+            for code in corpus:
+                getattr(Postcode(), method)(code)
+        return run
+
+    def each_parse(corpus):
+        for code in corpus:
+            parse_postcode(code)
+
+    def suggest(corpus):
+        batch = Postcode.validate_many(corpus)
+        batch.suggest(PostcodeSuggester())
+
+    functions = {
+        'format': each('format'),
+        'validate': each('validate'),
+        'split_validate': each('split_validate'),
+        'parse_postcode': each_parse,
+        'validate_many': Postcode.validate_many,
+        'validate_many_suggest': suggest,
+    }
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        functions['validate_array'] = Postcode.validate_array
+
+    results = {}
+    for size in sizes:
+        corpus = make_corpus(size)
+        for name, func in functions.items():
+            seconds = best_time(lambda: func(corpus), repeat)
+            results[f'library.{name}.{size}'] = result(size, seconds)
+
+        # A batch of the same postcodes repeated, as in the label printing jobs: validate_many validates each once
+        repeated = make_corpus(size // REPEATS) * REPEATS
+        for name in ('split_validate', 'validate_many'):
+            seconds = best_time(lambda: functions[name](repeated), repeat)
+            results[f'library.{name}_repeated.{size}'] = result(len(repeated), seconds)
+    return results
+
+
+def bench_startup(modules, repeat: int) -> dict:
+    """Time the import of each module and the first validation, in a new interpreter for each run"""
+    results = {}
+    for module in modules:
+        best_import = best_first = float('inf')
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(module=module)], check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE).stdout
+            seconds_import, seconds_first = json.loads(output)
+            best_import = min(best_import, seconds_import)
+            best_first = min(best_first, seconds_first)
+        results[f'startup.import.{module}'] = result(1, best_import)
+        results[f'startup.first_validation.{module}'] = result(1, best_first)
+    return results
+
+
+def bench_api(batch_sizes, single_requests: int, repeat: int) -> dict:
+    """Time the REST API through the Flask test client"""
+    from webapp.api import app
+
+    client = app.test_client()
+    results = {}
+
+    corpus = make_corpus(single_requests)
+
+    def get_each():
+        for code in corpus:
+            client.get('/postcode/' + quote(code, safe=''))
+
+    results[f'api.get_postcode.{single_requests}'] = result(single_requests, best_time(get_each, repeat))
+
+    for size in batch_sizes:
+        payload = {'postcodes': make_corpus(size)}
+        seconds = best_time(lambda: client.post('/postcodes', json=payload), repeat)
+        results[f'api.post_postcodes.{size}'] = result(size, seconds)
+    return results
+
+
+def result(items: int, seconds: float) -> dict:
+    return {
+        'items': items,
+        'seconds': seconds,
+        'us_per_item': seconds / items * 1e6,
+        'items_per_second': items / seconds if seconds else 0.0,
+    }
+
+
+def speedups(results: dict) -> dict:
+    """Return the speedup of the batch functions over split_validate on each postcode, by benchmark name"""
+    ratios = {}
+    for name, current in results.items():
+        function, size = name.rsplit('.', 1)
+        if function not in SPEEDUP_BASELINES:
+            continue
+        each = results.get(f'{SPEEDUP_BASELINES[function]}.{size}')
+        if each is not None and current['seconds']:
+            ratios[name] = each['seconds'] / current['seconds']
+    return ratios
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return the benchmarks slower than the baseline by more than tolerance, as (name, baseline, current)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['us_per_item'] > previous['us_per_item'] * (1 + tolerance):
+            regressions.append((name, previous['us_per_item'], current['us_per_item']))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the postcode library and REST API')
+    parser.add_argument('-o', '--output', help='file to write the results to, as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='slowdown allowed before flagging a regression, 0.10 is 10%%')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the best one is kept')
+    parser.add_argument('--quick', action='store_true', help='run only the smallest sizes')
+    parser.add_argument('--no-api', action='store_true', help='skip the REST API benchmarks')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    library_sizes = LIBRARY_SIZES[:1] if args.quick else LIBRARY_SIZES
+    batch_sizes = BATCH_SIZES[:2] if args.quick else BATCH_SIZES
+
+    results = bench_startup(('webapp',) if args.no_api else ('webapp', 'webapp.api'), max(args.repeat, 5))
+    results.update(bench_library(library_sizes, args.repeat))
+    if not args.no_api:
+        results.update(bench_api(batch_sizes, SINGLE_REQUESTS // 10 if args.quick else SINGLE_REQUESTS,
+                                 args.repeat))
+
+    for name, values in results.items():
+        print(f"{name:40} {values['us_per_item']:10.2f} us/item {values['items_per_second']:12.0f} items/s")
+    ratios = speedups(results)
+    for name, ratio in ratios.items():
+        print(f"{name:40} {ratio:10.2f} x split_validate")
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'speedups': ratios,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, previous, current in regressions:
+            print(f"REGRESSION {name}: {previous:.2f} -> {current:.2f} us/item", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Validate the postcodes of a CSV or NDJSON file
+
+   Usage: python bulk_postcode.py addresses.csv -o addresses_checked.csv --column postcode
+"""
+import argparse
+import io
+import sys
+
+from webapp.bulk import run, FORMATS
+from webapp.cache import PostcodeCache
+from webapp.index import PostcodeIndex
+from webapp.parallel import ParallelValidator
+from webapp.suggest import PostcodeSuggester
+
+# Size of the read and write buffers
+BUFFER_SIZE = 1 << 20
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Validate, format and split the postcodes of a CSV or NDJSON file')
+    parser.add_argument('input', help='file to read, - for the standard input')
+    parser.add_argument('-o', '--output', default='-', help='file to write, - for the standard output')
+    parser.add_argument('-f', '--format', choices=FORMATS,
+                        help='file format, guessed from the input file extension if not given')
+    parser.add_argument('-c', '--column', default='postcode', help='column with the postcode')
+    parser.add_argument('--invalid-only', action='store_true', help='write only the rows with an invalid postcode')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows read, validated and written at once')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes validating the rows')
+    parser.add_argument('--cache-size', type=int, default=0, help='size of the validation results cache')
+    parser.add_argument('--index', help='postcode index built by index_postcode.py, adds the exists column')
+    parser.add_argument('--suggest', type=int, default=0, metavar='N',
+                        help='add up to N suggested corrections of the invalid postcodes, known ones with --index')
+    return parser.parse_args(argv)
+
+
+def open_text(path: str, mode: str):
+    """Open a file with a large buffer, - is the standard input or output"""
+    if path == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        return io.TextIOWrapper(open(stream.fileno(), mode + 'b', buffering=BUFFER_SIZE, closefd=False),
+                                encoding='utf-8', newline='')
+    return open(path, mode, buffering=BUFFER_SIZE, encoding='utf-8', newline='')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fmt = args.format or ('ndjson' if args.input.endswith(('.ndjson', '.jsonl')) else 'csv')
+    cache = PostcodeCache(args.cache_size) if args.cache_size else None
+    index = PostcodeIndex(args.index) if args.index else None
+    suggester = PostcodeSuggester(index=index, limit=args.suggest) if args.suggest else None
+    parallel = None
+    if args.workers > 1:
+        parallel = ParallelValidator(workers=args.workers, chunk_size=args.chunk_size, threshold=args.chunk_size)
+
+    try:
+        with open_text(args.input, 'r') as in_fp, open_text(args.output, 'w') as out_fp:
+            stats = run(in_fp, out_fp, fmt=fmt, column=args.column, chunk_size=args.chunk_size, cache=cache,
+                        invalid_only=args.invalid_only, parallel=parallel, index=index,
+                        suggester=suggester)
+    finally:
+        if parallel is not None:
+            parallel.close()
+        if index is not None:
+            index.close()
+
+    print(f"{stats.rows} rows, {stats.invalid} invalid in {stats.seconds:.2f}s: "
+          f"{stats.rows_per_second:.0f} rows/s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
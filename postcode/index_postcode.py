@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Build the index of the known postcodes from a postcode CSV file (ONS Postcode Directory, Code-Point Open...)
+
+   Usage: python index_postcode.py ONSPD.csv -o postcodes.idx --column pcds
+          python index_postcode.py ONSPD.csv -o postcodes.idx --spatial postcodes.grid
+          python index_postcode.py changes.csv -o postcodes.idx --update
+"""
+import argparse
+import csv
+import sys
+import time
+
+from webapp.index import build_index, update_index
+from webapp.spatial import build_spatial
+
+# Size of the read buffer
+BUFFER_SIZE = 1 << 20
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build the index of the known postcodes from a CSV file')
+    parser.add_argument('input', help='CSV file with a postcode column')
+    parser.add_argument('-o', '--output', default='postcodes.idx', help='index file to write')
+    parser.add_argument('-c', '--column', default='pcds', help='column with the postcode')
+    parser.add_argument('--no-header', action='store_true',
+                        help='the file has no header, the columns are given by position from 0')
+    parser.add_argument('--terminated-column', default='doterm',
+                        help='column with the date of termination, the terminated postcodes are skipped')
+    parser.add_argument('--spatial', metavar='FILE', help='spatial index file to write, for the nearest and '
+                                                          'radius queries')
+    parser.add_argument('--lat-column', default='lat', help='column with the latitude, for --spatial')
+    parser.add_argument('--lon-column', default='long', help='column with the longitude, for --spatial')
+    parser.add_argument('--update', action='store_true',
+                        help='update the index: the postcodes of the file are added, the terminated ones removed')
+    return parser.parse_args(argv)
+
+
+def read_rows(fp, columns: tuple, no_header: bool = False, terminated_column: str = None):
+    """Yield the values of some columns of each row of a CSV file, skipping the terminated postcodes
+
+       Arguments
+       fp: text file object
+       columns: names of the columns, or their positions if the file has no header
+       no_header: the file has no header
+       terminated_column: name of the column with the date of termination, ignored if it's not in the file
+    """
+    if no_header:
+        positions = [int(column) for column in columns]
+        width = max(positions) + 1
+        for row in csv.reader(fp):
+            if len(row) >= width:
+                yield tuple(row[position] for position in positions)
+        return
+
+    reader = csv.DictReader(fp)
+    for column in columns:
+        if column not in (reader.fieldnames or []):
+            raise ValueError(f"Column not found: {column}")
+    if terminated_column not in reader.fieldnames:
+        terminated_column = None
+
+    for row in reader:
+        if terminated_column is None or not row[terminated_column]:
+            yield tuple(row[column] for column in columns)
+
+
+def read_changes(fp, column: str, no_header: bool = False, terminated_column: str = None) -> tuple:
+    """Return the postcodes to add and to remove of a CSV file, the terminated postcodes are removed
+
+       Arguments
+       fp: text file object
+       column: name of the column with the postcode, or its position if the file has no header
+       no_header: the file has no header
+       terminated_column: name of the column with the date of termination, ignored if it's not in the file
+
+       Return:
+       a tuple (added, removed) of lists of postcodes
+    """
+    added, removed = [], []
+    if no_header:
+        rows = ((postcode, '') for postcode, in read_rows(fp, (column,), no_header))
+    else:
+        reader = csv.DictReader(fp)
+        if column not in (reader.fieldnames or []):
+            raise ValueError(f"Column not found: {column}")
+        has_terminated = terminated_column in reader.fieldnames
+        rows = ((row[column], row[terminated_column] if has_terminated else '') for row in reader)
+    for postcode, terminated in rows:
+        (removed if terminated else added).append(postcode)
+    return added, removed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    if args.update:
+        with open(args.input, buffering=BUFFER_SIZE, encoding='utf-8', newline='') as fp:
+            added, removed = read_changes(fp, args.column, args.no_header, args.terminated_column)
+        count = update_index(args.output, added, removed)
+        print(f"{len(added)} postcodes added, {len(removed)} removed, {count} postcodes indexed "
+              f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        return
+
+    columns = (args.column, args.lat_column, args.lon_column) if args.spatial else (args.column,)
+    with open(args.input, buffering=BUFFER_SIZE, encoding='utf-8', newline='') as fp:
+        rows = read_rows(fp, columns, args.no_header, args.terminated_column)
+        if args.spatial:
+            rows = list(rows)
+        count = build_index((row[0] for row in rows), args.output)
+    print(f"{count} postcodes indexed in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+    if args.spatial:
+        count = build_spatial(rows, args.spatial)
+        print(f"{count} postcodes located in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
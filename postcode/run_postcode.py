@@ -1,4 +1,4 @@
-from webapp import app
+from webapp.api import app
 
 if __name__ == '__main__':
     app.run(port=8080, debug=True)
\ No newline at end of file
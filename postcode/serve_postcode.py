@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Production launcher of the postcode REST API
+
+   Usage: python serve_postcode.py --workers 4 --port 8080
+
+   The ASGI app of webapp.asgi is served by gunicorn with uvicorn workers when both are installed
+   (pip install gunicorn uvicorn): the app is loaded and preloaded before the workers are forked, so the compiled
+   rule tables and the memory mapped indexes are shared by all of them. Without gunicorn, e.g. on Windows,
+   the workers are started by uvicorn and each of them loads the app.
+"""
+import argparse
+import os
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the postcode REST API')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--backlog', type=int, default=2048, help='maximum number of pending connections')
+    parser.add_argument('--timeout', type=int, default=60, help='seconds before a silent worker is restarted')
+    parser.add_argument('--keep-alive', type=int, default=5, help='seconds an idle connection is kept open')
+    return parser.parse_args(argv)
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class PostcodeApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{args.host}:{args.port}')
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('worker_class', 'uvicorn.workers.UvicornWorker')
+            self.cfg.set('backlog', args.backlog)
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('keepalive', args.keep_alive)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            from webapp.asgi import app, preload
+
+            preload()
+            return app
+
+    PostcodeApplication().run()
+
+
+def serve_uvicorn(args):
+    import uvicorn
+
+    uvicorn.run('webapp.asgi:app', host=args.host, port=args.port, workers=args.workers, backlog=args.backlog,
+                timeout_keep_alive=args.keep_alive, lifespan='on')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        sys.exit("uvicorn is required: pip install uvicorn gunicorn")
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        serve_uvicorn(args)
+    else:
+        serve_gunicorn(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,9 +16,38 @@
                         For numbers which are multiples of both three and five print “ThreeFive”.
 """
 
+import asyncio
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from types import SimpleNamespace
 
-from webapp import Postcode
+from webapp import Postcode, PostcodeResult, parse_postcode
+from webapp.api import app
+from webapp import bulk
+from webapp.admission import AdmissionController, Rejected
+from webapp.batch import PostcodeBatch, validate_many
+from webapp.cache import PostcodeCache
+from webapp.index import PostcodeIndex, build_index, pack_postcode, prefix_keys, unpack_postcode, update_index
+from webapp.metrics import Registry, StageTimer
+from webapp.parallel import ParallelValidator
+from webapp.reload import Reloader
+from webapp.rules import load_rules, save_rules, swap_rules
+from webapp.spatial import SpatialIndex, build_spatial
+from webapp.suggest import PostcodeSuggester
+from webapp.serializer import PostcodeSerializer, DEFAULT_FIELDS
+from webapp.postcode import _validators, make_validator, STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 VALID_POSTCODES = [
     'KT10 8BD', # already formatted - my home postcode :D
@@ -47,6 +76,22 @@ INVALID_POSTCODES = [
     'AA1 AA',  # Invalid: all letters in inward code,
 ]
 
+SPECIAL_CASE_POSTCODES = [
+    'WC1 1AA',  # Invalid: WC is always subdivided by a further letter
+    'WC1A 1AA',  # Valid: special outward code
+    'E1 1AA',  # Invalid: special invalid outward code
+    'E1W 1AA',  # Valid: special outward code
+    'AB1 1AA',  # Invalid: AB has only two digits districts
+    'AB10 1AA',  # Valid: AB has only two digits districts
+    'BR10 1AA',  # Invalid: BR has only one digit districts
+    'BS10 1AA',  # Valid: BS has both district 0 and 10
+    'EC50 1AA',  # Invalid: special invalid outward code
+]
+
+ALL_POSTCODES = VALID_POSTCODES + INVALID_POSTCODES + SPECIAL_CASE_POSTCODES + [
+    None, '', 'EC1A 1BB999', '$C1A 1BB', 'EC1A1B+',
+]
+
 class TestPostCode(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -105,6 +150,12 @@ class TestPostCode(unittest.TestCase):
         self.assertTrue(self.postcode.postcode_sector == "0")
         self.assertTrue(self.postcode.postcode_unit == "AX")
 
+    def test_split_validate_with_GIR0AA(self):
+        self.postcode.split_validate('gir0aa')
+        self.assertTrue(self.postcode.is_valid)
+        self.assertTrue(self.postcode.fmt_postcode == "GIR 0AA")
+        self.assertTrue(self.postcode.postcode_area == "")
+
     def test_validate_with_invailid_length_code(self):
         self.postcode.split_validate('EC1A 1BB999')
         self.assertFalse(self.postcode.is_valid)
@@ -152,6 +203,993 @@ class TestPostCode(unittest.TestCase):
             self.assertFalse(self.postcode.message.startswith('VALID'))
 
 
+class TestParsePostcode(unittest.TestCase):
+
+    def test_parse_postcode_matches_split_validate(self):
+        for code in ALL_POSTCODES:
+            result = parse_postcode(code)
+            postcode = Postcode()
+            postcode.split_validate(code)
+            self.assertIsInstance(result, PostcodeResult)
+            self.assertEqual(result.to_dict(), vars(postcode), code)
+
+    def test_parse_postcode_result_is_immutable(self):
+        result = parse_postcode('KT10 8BD')
+        with self.assertRaises(AttributeError):
+            result.is_valid = False
+        with self.assertRaises(AttributeError):
+            result.__dict__
+
+    def test_parse_postcode_interns_components(self):
+        first = parse_postcode('kt10 8bd')
+        second = parse_postcode('KT108BD')
+        self.assertIs(first.outward_code, second.outward_code)
+        self.assertIs(first.postcode_area, second.postcode_area)
+        self.assertIs(first.postcode_unit, second.postcode_unit)
+
+    def test_split_validate_resets_previous_state(self):
+        postcode = Postcode()
+        postcode.split_validate('KT10 8BD')
+        postcode.split_validate('$C1A 1BB')
+        self.assertFalse(postcode.is_valid)
+        self.assertEqual(postcode.fmt_postcode, '')
+
+
+class TestPostcodeBatch(unittest.TestCase):
+
+    def test_validate_many_matches_split_validate(self):
+        batch = Postcode.validate_many(ALL_POSTCODES)
+        self.assertIsInstance(batch, PostcodeBatch)
+        self.assertEqual(len(batch), len(ALL_POSTCODES))
+
+        for i, code in enumerate(ALL_POSTCODES):
+            postcode = Postcode()
+            postcode.split_validate(code)
+            self.assertEqual(batch.row(i), vars(postcode), code)
+
+    def test_validate_many_status(self):
+        batch = Postcode.validate_many(['KT10 8BD', 'QT10 8BD', 'EC1A 1BB999', '$C1A 1BB'])
+        self.assertEqual(list(batch.status), [STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS])
+        self.assertEqual(batch.is_valid, [True, False, False, False])
+        self.assertEqual(batch.fmt_postcode, ['KT10 8BD', 'QT10 8BD', '', ''])
+
+    def test_validate_many_with_GIR0AA(self):
+        batch = Postcode.validate_many(['gir0aa'])
+        self.assertEqual(batch.is_valid, [True])
+        self.assertEqual(batch.fmt_postcode, ['GIR 0AA'])
+        self.assertEqual(batch.postcode_area, [''])
+
+    def test_validate_many_results(self):
+        batch = Postcode.validate_many(ALL_POSTCODES)
+        self.assertEqual(list(batch.results()), [parse_postcode(code) for code in ALL_POSTCODES])
+
+    def test_validate_many_by_column(self):
+        # All valid, so nothing is blanked, then odd postcodes: repeated, unicode, spaces only
+        for codes in (['KT10 8BD', 'w1a0ax', 'KT10 8BD', 'gir0aa'],
+                      ['KT10 8BD', None, 'ßT10 8BD', 'kt108bd', '   ', 'KT10 8BD', 'KT10 ABD', 'E1 8BD', 'éé108bd']):
+            batch = Postcode.validate_many(codes)
+            self.assertEqual(list(batch.results()), [parse_postcode(code) for code in codes])
+            timed = validate_many(codes, timer=lambda stage, seconds: None)
+            self.assertEqual(list(batch.results()), list(timed.results()))
+
+    def test_validate_many_shares_the_codes(self):
+        batch = Postcode.validate_many(['KT10 8BD', 'kt108bd', 'KT10 8BE'])
+        row = make_validator(Postcode)('KT10 8BD')
+        self.assertIs(batch.outward_code[0], batch.outward_code[1])
+        self.assertIs(batch.outward_code[0], batch.outward_code[2])
+        self.assertIs(batch.outward_code[0], row[1])
+        self.assertIs(batch.inward_code[1], row[2])
+        self.assertIs(batch.postcode_unit[1], row[6])
+
+    def test_validate_many_with_empty_batch(self):
+        batch = Postcode.validate_many([])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.to_postcodes(), [])
+
+
+class TestLibraryImport(unittest.TestCase):
+
+    def test_import_without_the_rest_api(self):
+        script = ("import sys, webapp; webapp.parse_postcode('KT10 8BD'); "
+                  "print(sorted(name for name in ('flask', 'flask_restplus', 'webapp.api') if name in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', script], check=True, stdout=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_lazy_app(self):
+        import webapp
+        import webapp.api
+
+        self.assertIs(webapp.app, webapp.api.app)
+        with self.assertRaises(AttributeError):
+            webapp.missing
+
+
+class TestRuleTable(unittest.TestCase):
+
+    def test_split_outward(self):
+        table = Postcode.rule_table()
+        self.assertEqual(table.split_outward('KT10'), ('KT', '10', True))
+        self.assertEqual(table.split_outward('SE1P'), ('SE', '1P', True))
+        self.assertEqual(table.split_outward('SE1'), ('', '', False))
+        self.assertEqual(table.split_outward('AB1'), ('', '', False))
+        self.assertEqual(table.split_outward('GIR'), ('', '', True))
+
+    def test_rule_table_is_compiled_again_when_rules_change(self):
+        table = Postcode.rule_table()
+        self.assertIs(Postcode.rule_table(), table)
+
+        Postcode.INVALID_OUTWARD.append('KT10')
+        try:
+            self.assertIsNot(Postcode.rule_table(), table)
+            self.assertNotEqual(Postcode.rule_table().version, table.version)
+            postcode = Postcode()
+            postcode.split_validate('KT10 8BD')
+            self.assertFalse(postcode.is_valid)
+        finally:
+            Postcode.INVALID_OUTWARD.remove('KT10')
+
+        self.assertEqual(Postcode.rule_table().version, table.version)
+
+        rules = Postcode.INVALID_OUTWARD
+        table = Postcode.rule_table()
+        Postcode.INVALID_OUTWARD = rules[:]
+        try:
+            self.assertIs(Postcode.rule_table(), table)
+            Postcode.INVALID_OUTWARD = rules[:-1] + ['KT10']
+            self.assertFalse(Postcode.rule_table().split_outward('KT10')[2])
+            Postcode.INVALID_OUTWARD[-1] = rules[-1]
+            self.assertTrue(Postcode.rule_table().split_outward('KT10')[2])
+            self.assertEqual(Postcode.rule_table().version, table.version)
+        finally:
+            Postcode.INVALID_OUTWARD = rules
+
+    def test_rules_file_swap(self):
+        table = Postcode.rule_table()
+        validate = make_validator(Postcode)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'rules.json')
+            save_rules(Postcode, path, release='2026-10')
+            release, values = load_rules(path)
+            self.assertEqual(release, '2026-10')
+            self.assertEqual(values['INVALID_OUTWARD'], Postcode.INVALID_OUTWARD)
+
+            values['INVALID_OUTWARD'] = values['INVALID_OUTWARD'] + ['KT10']
+            try:
+                swapped = swap_rules(Postcode, values, release)
+                self.assertIs(Postcode.rule_table(), swapped)
+                self.assertEqual(swapped.release, '2026-10')
+                self.assertNotEqual(swapped.version, table.version)
+                self.assertFalse(parse_postcode('KT10 8BD').is_valid)
+                # A validator made before the swap keeps its rules
+                self.assertTrue(validate('KT10 8BD')[-2])
+            finally:
+                Postcode.INVALID_OUTWARD.remove('KT10')
+        self.assertEqual(Postcode.rule_table().version, table.version)
+        self.assertTrue(parse_postcode('KT10 8BD').is_valid)
+
+    def test_bad_rules_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'rules.json')
+            save_rules(Postcode, path)
+            with open(path) as fp:
+                data = json.load(fp)
+            for name, value in (('POSTCODE_REGEX', '('), ('LETTER_FOLLOW', 'EC1'), ('UNKNOWN', [])):
+                with open(path, 'w') as fp:
+                    json.dump(dict(data, **{name: value}), fp)
+                with self.assertRaises(ValueError):
+                    load_rules(path)
+
+
+class TestReloader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rules_path = os.path.join(self.tmp_dir.name, 'rules.json')
+        self.index_path = os.path.join(self.tmp_dir.name, 'postcodes.idx')
+        save_rules(Postcode, self.rules_path, release='1')
+        build_index(['KT10 8BD'], self.index_path)
+        self.indexes = []
+        self.reloader = Reloader(self.rules_path, self.index_path, interval=0, on_index=self.indexes.append)
+        self.rules = Postcode.INVALID_OUTWARD[:]
+
+    def tearDown(self) -> None:
+        Postcode.INVALID_OUTWARD = self.rules
+        for index in self.indexes:
+            index.close()
+        self.tmp_dir.cleanup()
+
+    def test_check(self):
+        self.reloader.load()
+        self.assertEqual(Postcode.rule_table().release, '1')
+        self.assertFalse(self.reloader.check())
+
+        release, values = load_rules(self.rules_path)
+        values['INVALID_OUTWARD'].append('KT10')
+        save_rules(SimpleNamespace(**values), self.rules_path, release='2')
+        update_index(self.index_path, added=['W1A 0AX'])
+        self.assertTrue(self.reloader.check())
+        self.assertEqual(self.reloader.reloads, 2)
+        self.assertEqual(Postcode.rule_table().release, '2')
+        # The validator of the new rules is compiled by the reload, not by the first request
+        self.assertIs(_validators[Postcode][0], Postcode.rule_table())
+        self.assertFalse(parse_postcode('KT10 8BD').is_valid)
+        self.assertEqual(len(self.indexes), 1)
+        self.assertTrue(self.indexes[0].exists('W1A 0AX'))
+
+    def test_bad_file_keeps_the_rules(self):
+        self.reloader.load()
+        table = Postcode.rule_table()
+        with open(self.rules_path, 'w') as fp:
+            fp.write('{')
+        self.assertFalse(self.reloader.check())
+        self.assertEqual(self.reloader.errors, 1)
+        self.assertIs(Postcode.rule_table(), table)
+        # Reported once, until the file changes again
+        self.assertFalse(self.reloader.check())
+        self.assertEqual(self.reloader.errors, 1)
+
+    def test_rules_version_header(self):
+        response = app.test_client().get('/postcode/kt108bd')
+        self.assertEqual(response.headers['X-Rules-Version'], Postcode.rule_table().version)
+
+
+class TestPostcodeCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.cache = PostcodeCache(maxsize=2)
+
+    def test_lookup_is_keyed_on_normalized_postcode(self):
+        self.assertEqual(self.cache.lookup('kt10 8bd'), self.cache.lookup('KT108BD'))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_lookup_evicts_least_recently_used(self):
+        self.cache.lookup('KT10 8BD')
+        self.cache.lookup('W1A 0AX')
+        self.cache.lookup('KT10 8BD')
+        self.cache.lookup('M1 1AE')
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.lookup('KT10 8BD')
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_validate_many_with_cache_matches_split_validate(self):
+        cache = PostcodeCache()
+        for _ in range(2):
+            batch = Postcode.validate_many(ALL_POSTCODES, cache=cache)
+            for i, code in enumerate(ALL_POSTCODES):
+                postcode = Postcode()
+                postcode.split_validate(code)
+                self.assertEqual(batch.row(i), vars(postcode), code)
+        self.assertTrue(cache.hits > 0)
+
+    def test_cache_is_cleared_when_rules_change(self):
+        self.assertTrue(self.cache.lookup('KT10 8BD')[-1] == STATUS_VALID)
+
+        Postcode.INVALID_OUTWARD.append('KT10')
+        try:
+            self.assertEqual(Postcode.validate_many(['KT10 8BD'], cache=self.cache).is_valid, [False])
+        finally:
+            Postcode.INVALID_OUTWARD.remove('KT10')
+
+        self.assertEqual(Postcode.validate_many(['KT10 8BD'], cache=self.cache).is_valid, [True])
+
+
+class TestParallelValidator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.parallel = ParallelValidator(workers=2, chunk_size=7, threshold=10)
+
+    def tearDown(self) -> None:
+        self.parallel.close()
+
+    def test_validate_many_matches_validate_many(self):
+        batch = self.parallel.validate_many(ALL_POSTCODES)
+        self.assertEqual(list(batch.results()), list(Postcode.validate_many(ALL_POSTCODES).results()))
+
+    def test_validate_many_below_threshold_does_not_start_the_pool(self):
+        batch = self.parallel.validate_many(['KT10 8BD'])
+        self.assertEqual(batch.is_valid, [True])
+        self.assertIsNone(self.parallel._executor)
+
+    def test_validate_many_uses_the_rules_of_the_parent(self):
+        self.parallel.validate_many(ALL_POSTCODES)
+
+        Postcode.INVALID_OUTWARD.append('KT10')
+        try:
+            batch = self.parallel.validate_many(['KT10 8BD'] * 20)
+        finally:
+            Postcode.INVALID_OUTWARD.remove('KT10')
+        self.assertEqual(batch.is_valid, [False] * 20)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestVectorized(unittest.TestCase):
+
+    # The postcodes validated one by one: out of ASCII, with an uppercase longer than them, with NUL inside
+    OTHER_POSTCODES = ['  kt10   8bd ', 'GIR 0AA', 'gir0aa', 'KT10 8BÉ', 'kß10 8bd', 'KT10\x008BD', 'KT10 8BD\x7f']
+
+    def assert_rows(self, arrays, postcodes):
+        # in_postcode is the input array, as it is
+        columns = {column: values.tolist() for column, values in arrays.to_dict().items() if column != 'in_postcode'}
+        for i, code in enumerate(postcodes):
+            postcode = Postcode()
+            postcode.split_validate(code)
+            row = {column: values[i] for column, values in columns.items()}
+            row['in_postcode'] = code
+            self.assertEqual(row, vars(postcode), code)
+
+    def test_validate_array_matches_split_validate(self):
+        postcodes = ALL_POSTCODES + self.OTHER_POSTCODES
+        arrays = Postcode.validate_array(numpy.array(postcodes, dtype=object))
+        self.assertEqual(len(arrays), len(postcodes))
+        self.assert_rows(arrays, postcodes)
+
+        postcodes = [code for code in postcodes if code is not None]
+        self.assert_rows(Postcode.validate_array(numpy.array(postcodes)), postcodes)
+
+    def test_validate_array_of_bytes(self):
+        postcodes = [code for code in ALL_POSTCODES if code is not None] + ['KT10 8B\xc9']
+        arrays = Postcode.validate_array(numpy.array([code.encode('latin-1') for code in postcodes]))
+        self.assertEqual(arrays.in_postcode.dtype.kind, 'S')
+        self.assert_rows(arrays, postcodes)
+
+    def test_validate_array_keeps_the_shape(self):
+        from webapp.vectorized import validate_array
+
+        arrays = validate_array(numpy.array([['kt108bd', 'QT10 8BD'], ['', 'W1A 0AX']]))
+        self.assertEqual(arrays.fmt_postcode.tolist(), [['KT10 8BD', 'QT10 8BD'], ['', 'W1A 0AX']])
+        self.assertEqual(arrays.status.tolist(), [[STATUS_VALID, STATUS_INVALID], [STATUS_BAD_LENGTH, STATUS_VALID]])
+        self.assertEqual(validate_array(numpy.array(['KT10 8BD', None, float('nan')], dtype=object)).status.tolist(),
+                         [STATUS_VALID, STATUS_BAD_LENGTH, STATUS_BAD_LENGTH])
+        self.assertEqual(len(validate_array([])), 0)
+        with self.assertRaises(TypeError):
+            validate_array([1, 2])
+
+    def test_validate_array_with_other_rules(self):
+        class Rules(Postcode):
+            POSTCODE_REGEX = r"^[A-Z]{1,2}[0-9][A-Z0-9]? ?[0-9][A-Z]{2}$"
+            INVALID_OUTWARD = Postcode.INVALID_OUTWARD + ['KT10']
+
+        postcodes = ALL_POSTCODES + self.OTHER_POSTCODES
+        arrays = Rules.validate_array(numpy.array(postcodes, dtype=object))
+        for i, code in enumerate(postcodes):
+            postcode = Rules()
+            postcode.split_validate(code)
+            self.assertEqual(arrays.is_valid[i], postcode.is_valid, code)
+            self.assertEqual(arrays.postcode_district[i], postcode.postcode_district, code)
+
+
+class TestBulk(unittest.TestCase):
+
+    def test_run_with_csv(self):
+        in_fp = io.StringIO('id,postcode\n1,kt108bd\n2,QT10 8BD\n3,w1a0ax\n')
+        out_fp = io.StringIO()
+        stats = bulk.run(in_fp, out_fp, chunk_size=2)
+        self.assertEqual((stats.rows, stats.invalid), (3, 1))
+
+        lines = out_fp.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,postcode,' + ','.join(bulk.RESULT_COLUMNS))
+        self.assertTrue(lines[1].startswith('1,kt108bd,KT10 8BD,KT10,8BD,KT,10,8,BD,True,'))
+        self.assertEqual(len(lines), 4)
+
+    def test_run_with_ndjson_invalid_only(self):
+        in_fp = io.StringIO('{"pc": "kt108bd"}\n\n{"pc": "QT10 8BD"}\n')
+        out_fp = io.StringIO()
+        stats = bulk.run(in_fp, out_fp, fmt='ndjson', column='pc', invalid_only=True)
+        self.assertEqual(stats.rows, 2)
+
+        rows = [json.loads(line) for line in out_fp.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['pc'], 'QT10 8BD')
+        self.assertFalse(rows[0]['is_valid'])
+
+    def test_run_with_missing_column(self):
+        with self.assertRaises(ValueError):
+            bulk.run(io.StringIO('id,zip\n1,KT10 8BD\n'), io.StringIO())
+
+
+class TestPostcodeIndex(unittest.TestCase):
+
+    KNOWN_POSTCODES = ['KT10 8BD', 'w1a0ax', 'M1 1AE', 'EC1A 1BB', 'kt10 8bd', 'NOT A POSTCODE', '']
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'postcodes.idx')
+        self.count = build_index(self.KNOWN_POSTCODES, self.path)
+        self.index = PostcodeIndex(self.path)
+
+    def tearDown(self) -> None:
+        self.index.close()
+        self.tmp_dir.cleanup()
+
+    def test_update_index(self):
+        count = update_index(self.path, added=['SW1A 1AA', 'kt108bd', 'AB10 1AA', 'bad'], removed=['M1 1AE', 'B1 1AA'])
+        self.assertEqual(count, self.count + 1)
+        with PostcodeIndex(self.path) as index:
+            self.assertEqual(list(index.postcodes()), ['AB10 1AA', 'EC1A 1BB', 'KT10 8BD', 'SW1A 1AA', 'W1A 0AX'])
+        build_index(['AB10 1AA', 'EC1A 1BB', 'KT10 8BD', 'SW1A 1AA', 'W1A 0AX'], self.path + '.full')
+        with open(self.path, 'rb') as fp, open(self.path + '.full', 'rb') as full:
+            self.assertEqual(fp.read(), full.read())
+
+    def test_pack_postcode(self):
+        self.assertEqual(unpack_postcode(pack_postcode('kt108bd')), 'KT10 8BD')
+        self.assertEqual(unpack_postcode(pack_postcode('M1 1AE')), 'M1 1AE')
+        self.assertEqual(len(pack_postcode('EC1A 1BB')), 5)
+        self.assertIsNone(pack_postcode('KT10 $BD'))
+        self.assertIsNone(pack_postcode('KT1'))
+        self.assertIsNone(pack_postcode(None))
+        # The keys sort like the formatted postcodes with the outward code padded
+        self.assertLess(pack_postcode('M1 1AE'), pack_postcode('M11 1AE'))
+
+    def test_exists(self):
+        self.assertEqual(self.count, 4)
+        self.assertEqual(len(self.index), 4)
+        self.assertIn('kt108bd', self.index)
+        self.assertIn('W1A 0AX', self.index)
+        self.assertNotIn('KT10 8BE', self.index)
+        self.assertNotIn('ZZ99 9ZZ', self.index)
+        self.assertNotIn('AA1 1AA', self.index)
+        self.assertEqual(list(self.index.postcodes()), ['EC1A 1BB', 'KT10 8BD', 'M1 1AE', 'W1A 0AX'])
+
+    def test_prefix_keys(self):
+        self.assertEqual(prefix_keys('kt10 8'), ['KT108'])
+        self.assertEqual(prefix_keys('KT108'), ['KT108'])
+        self.assertEqual(prefix_keys('m1 1'), ['M1  1'])
+        self.assertEqual(prefix_keys('KT10'), ['KT10', 'KT1 0'])
+        self.assertEqual(prefix_keys('KT10 8BDX'), [])
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete('kt'), ['KT10 8BD'])
+        self.assertEqual(self.index.complete('M1 '), ['M1 1AE'])
+        self.assertEqual(self.index.complete('m11a'), ['M1 1AE'])
+        self.assertEqual(self.index.complete('E'), ['EC1A 1BB'])
+        self.assertEqual(self.index.complete('EC1A1BB'), ['EC1A 1BB'])
+        self.assertEqual(self.index.complete('M2'), [])
+        self.assertEqual(len(self.index.complete('', limit=2)), 2)
+
+    def test_invalid_file(self):
+        path = os.path.join(self.tmp_dir.name, 'bad.idx')
+        with open(path, 'wb') as fp:
+            fp.write(b'not an index file')
+        with self.assertRaises(ValueError):
+            PostcodeIndex(path)
+
+    def test_batch_check_exists(self):
+        batch = Postcode.validate_many(['kt108bd', 'KT10 8BE', 'QT10 8BD', 'kt108bd'])
+        batch.check_exists(self.index)
+        self.assertEqual(batch.exists, [True, False, False, True])
+        self.assertEqual([result.exists for result in batch.results()], [True, False, False, True])
+        self.assertTrue(batch.row(0)['exists'])
+        self.assertNotIn('exists', parse_postcode('kt108bd').to_dict())
+
+    def test_run_with_index(self):
+        out_fp = io.StringIO()
+        bulk.run(io.StringIO('{"pc": "kt108bd"}\n{"pc": "KT10 8BE"}\n'), out_fp, fmt='ndjson', column='pc',
+                 index=self.index)
+        rows = [json.loads(line) for line in out_fp.getvalue().splitlines()]
+        self.assertEqual([row['exists'] for row in rows], [True, False])
+
+    def test_endpoints_with_index(self):
+        import webapp.api
+
+        client = app.test_client()
+        previous = webapp.api.index, webapp.api.default_fields
+        webapp.api.index, webapp.api.default_fields = self.index, DEFAULT_FIELDS + ('exists',)
+        try:
+            self.assertTrue(client.get('/postcode/kt108bd').get_json()['exists'])
+            self.assertFalse(client.get('/postcode/KT108BE').get_json()['exists'])
+            rows = client.post('/postcodes?fields=fmt_postcode,exists',
+                               json={'postcodes': ['KT10 8BD', 'QT10 8BD']}).get_json()
+        finally:
+            webapp.api.index, webapp.api.default_fields = previous
+        self.assertEqual(rows, [{'fmt_postcode': 'KT10 8BD', 'exists': True},
+                                {'fmt_postcode': 'QT10 8BD', 'exists': False}])
+        self.assertNotIn('exists', client.get('/postcode/kt108bd').get_json())
+
+    def test_complete_endpoint(self):
+        import webapp.api
+
+        client = app.test_client()
+        self.assertEqual(client.get('/postcodes/complete?prefix=kt').status_code, 503)
+
+        previous = webapp.api.index
+        webapp.api.index = self.index
+        try:
+            response = client.get('/postcodes/complete?prefix=m1%201')
+            limited = client.get('/postcodes/complete?prefix=%20&limit=1').get_json()
+        finally:
+            webapp.api.index = previous
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'prefix': 'm1 1', 'postcodes': ['M1 1AE']})
+        self.assertEqual(limited['postcodes'], [])
+
+
+class TestPostcodeSuggester(unittest.TestCase):
+
+    def test_suggest(self):
+        suggester = PostcodeSuggester()
+        self.assertEqual(suggester.suggest('KT1O 8BD'), ['KT10 8BD'])
+        self.assertEqual(suggester.suggest('KTIO 8BD'), ['KT10 8BD'])
+        self.assertEqual(suggester.suggest('KT10 88D'), ['KT10 8BD'])
+        self.assertEqual(suggester.suggest('KT10-8BD'), ['KT10 8BD'])
+        self.assertIn('KT10 8BD', suggester.suggest('KT10 8BDD'))
+        self.assertEqual(suggester.suggest(''), [])
+        self.assertEqual(suggester.suggest(None), [])
+
+    def test_suggest_with_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'postcodes.idx')
+            build_index(['KT10 8BD', 'W1A 0AX'], path)
+            with PostcodeIndex(path) as index:
+                suggester = PostcodeSuggester(index=index)
+                self.assertEqual(suggester.suggest('TK10 8BD'), ['KT10 8BD'])
+                self.assertEqual(suggester.suggest('QT10 8BD'), ['KT10 8BD'])
+                self.assertEqual(suggester.suggest('W1A OAX'), ['W1A 0AX'])
+                self.assertEqual(suggester.suggest('ZZ99 9ZZ'), [])
+
+    def test_batch_suggest(self):
+        batch = Postcode.validate_many(['KT10 8BD', 'KT1O 8BD', 'KT1O 8BD'])
+        batch.suggest(PostcodeSuggester(limit=1))
+        self.assertEqual(batch.suggestions, [[], ['KT10 8BD'], ['KT10 8BD']])
+        self.assertEqual(list(batch.results())[1].to_dict()['suggestions'], ('KT10 8BD',))
+
+    def test_endpoints_with_suggestions(self):
+        client = app.test_client()
+        result = client.get('/postcode/KT1O%208BD?fields=is_valid,suggestions').get_json()
+        self.assertEqual(result, {'is_valid': False, 'suggestions': ['KT10 8BD']})
+        self.assertNotIn('suggestions', client.get('/postcode/KT1O%208BD').get_json())
+
+        rows = client.post('/postcodes?fields=suggestions', json={'postcodes': ['KT10 8BD', 'W1A OAX']}).get_json()
+        self.assertEqual(rows, [{'suggestions': []}, {'suggestions': ['W1A 0AX']}])
+
+    def test_run_with_suggestions(self):
+        out_fp = io.StringIO()
+        bulk.run(io.StringIO('postcode\nKT1O 8BD\n'), out_fp, suggester=PostcodeSuggester(limit=2))
+        lines = out_fp.getvalue().splitlines()
+        self.assertTrue(lines[0].endswith(',suggestions'))
+        self.assertTrue(lines[1].endswith(',KT10 8BD'))
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    LOCATIONS = [
+        ('KT10 8BD', 51.3687, -0.3632),
+        ('kt108be', '51.3690', '-0.3640'),
+        ('KT10 9AA', 51.3800, -0.3700),
+        ('W1A 0AX', 51.5186, -0.1438),
+        ('M1 1AE', 53.4808, -2.2426),
+        ('ZE1 0AA', 99.999999, 0.0),
+    ]
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'postcodes.grid')
+        self.count = build_spatial(self.LOCATIONS, self.path)
+        self.spatial = SpatialIndex(self.path)
+
+    def tearDown(self) -> None:
+        self.spatial.close()
+        self.tmp_dir.cleanup()
+
+    def postcodes(self, found):
+        return [self.spatial.postcode(position) for position, distance in found]
+
+    def test_locate(self):
+        self.assertEqual(self.count, 5)
+        position = self.spatial.locate('w1a0ax')
+        self.assertEqual(self.spatial.postcode(position), 'W1A 0AX')
+        self.assertEqual(self.spatial.location(position), (51.5186, -0.1438))
+        self.assertIsNone(self.spatial.locate('ZE1 0AA'))
+
+    def test_nearest(self):
+        found = self.spatial.nearest(51.3688, -0.3635, limit=2)
+        self.assertEqual(self.postcodes(found), ['KT10 8BD', 'KT10 8BE'])
+        self.assertLess(found[0][1], 30)
+        # Far from the other postcodes the search widens until it finds one
+        self.assertEqual(self.postcodes(self.spatial.nearest(53.0, -2.0)), ['M1 1AE'])
+        self.assertEqual(self.spatial.nearest(51.3688, -0.3635, limit=0), [])
+
+    def test_within(self):
+        found = self.spatial.within(51.3687, -0.3632, 2000)
+        self.assertEqual(self.postcodes(found), ['KT10 8BD', 'KT10 8BE', 'KT10 9AA'])
+        self.assertEqual(found[0][1], 0.0)
+        self.assertAlmostEqual(found[2][1], 1350, delta=20)
+        self.assertEqual(self.postcodes(self.spatial.within(51.3687, -0.3632, 100)), ['KT10 8BD', 'KT10 8BE'])
+        self.assertEqual(len(self.spatial.within(51.3687, -0.3632, 2000, limit=1)), 1)
+
+    def test_endpoints(self):
+        import webapp.api
+
+        client = app.test_client()
+        self.assertEqual(client.get('/postcodes/nearest?lat=51.3&lon=-0.3').status_code, 503)
+
+        previous = webapp.api.spatial
+        webapp.api.spatial = self.spatial
+        try:
+            nearest = client.get('/postcodes/nearest?lat=51.3688&lon=-0.3635').get_json()
+            within = client.get('/postcodes/within?postcode=kt108bd&radius=100').get_json()
+            invalid = client.get('/postcodes/within?postcode=QT10%208BD')
+            unknown = client.get('/postcodes/nearest?postcode=KT10%208BX')
+            missing = client.get('/postcodes/nearest?lat=51.3688')
+        finally:
+            webapp.api.spatial = previous
+
+        self.assertEqual(nearest['postcodes'][0]['postcode'], 'KT10 8BD')
+        self.assertEqual(len(nearest['postcodes']), 1)
+        self.assertEqual((within['latitude'], within['longitude']), (51.3687, -0.3632))
+        self.assertEqual([row['postcode'] for row in within['postcodes']], ['KT10 8BD', 'KT10 8BE'])
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(missing.status_code, 400)
+
+
+class TestPostcodeSerializer(unittest.TestCase):
+
+    def test_dumps_batch(self):
+        batch = Postcode.validate_many(ALL_POSTCODES)
+        rows = json.loads(PostcodeSerializer().dumps_batch(batch))
+        self.assertEqual(rows, [parse_postcode(code).to_dict() for code in ALL_POSTCODES])
+
+    def test_dumps_result_with_fields(self):
+        serializer = PostcodeSerializer.from_query('fmt_postcode, is_valid')
+        self.assertEqual(json.loads(serializer.dumps_result(parse_postcode('kt108bd'))),
+                         {'fmt_postcode': 'KT10 8BD', 'is_valid': True})
+
+    def test_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            PostcodeSerializer(['fmt_postcode', 'country'])
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.client = app.test_client()
+
+    def test_get_postcode(self):
+        response = self.client.get('/postcode/kt10%208bd')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), parse_postcode('kt10 8bd').to_dict())
+
+    def test_get_postcode_with_etag(self):
+        response = self.client.get('/postcode/kt10%208bd')
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('max-age=', response.headers['Cache-Control'])
+
+        response = self.client.get('/postcode/kt10%208bd', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.client.get('/postcode/kt10%208bd?fields=is_valid', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_postcode_etag_changes_with_rules(self):
+        etag = self.client.get('/postcode/kt10%208bd').headers['ETag']
+
+        Postcode.INVALID_OUTWARD.append('KT10')
+        try:
+            response = self.client.get('/postcode/kt10%208bd', headers={'If-None-Match': etag})
+        finally:
+            Postcode.INVALID_OUTWARD.remove('KT10')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['is_valid'])
+
+    def test_get_postcode_etag_changes_with_rules_edited_in_place(self):
+        etag = self.client.get('/postcode/kt10%208bd').headers['ETag']
+
+        outward_code = Postcode.INVALID_OUTWARD[0]
+        Postcode.INVALID_OUTWARD[0] = 'KT10'
+        try:
+            response = self.client.get('/postcode/kt10%208bd', headers={'If-None-Match': etag})
+            self.assertEqual(Postcode.validate_many(['KT10 8BD']).is_valid, [False])
+        finally:
+            Postcode.INVALID_OUTWARD[0] = outward_code
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['is_valid'])
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_post_postcodes_with_fields(self):
+        response = self.client.post('/postcodes?fields=fmt_postcode,message', json={'postcodes': ['kt108bd', '']})
+        self.assertEqual(response.get_json(), [
+            {'fmt_postcode': 'KT10 8BD', 'message': 'VALID: the post code is valid'},
+            {'fmt_postcode': '', 'message': 'ERROR: length must be minimum 5 and maximum 8'},
+        ])
+
+    def test_post_postcodes_validates_each_distinct_postcode_once(self):
+        table = Postcode.rule_table()
+        regex = table.regex
+        matched = []
+
+        def match(postcode):
+            matched.append(postcode)
+            return regex.match(postcode)
+
+        table.regex = SimpleNamespace(match=match)
+        try:
+            response = self.client.post('/postcodes?fields=fmt_postcode,is_valid', json={
+                'postcodes': ['KT10 8BD', 'W1A 0AX', 'KT10 8BD', 'QT10 8BD', 'KT10 8BD', 'W1A 0AX']})
+        finally:
+            table.regex = regex
+        self.assertEqual(sorted(matched), ['KT10 8BD', 'QT10 8BD', 'W1A 0AX'])
+        self.assertEqual([row['is_valid'] for row in response.get_json()], [True, True, True, False, True, True])
+
+    def test_unknown_fields(self):
+        for response in (self.client.get('/postcode/kt108bd?fields=is_valid,colour'),
+                         self.client.post('/postcodes?fields=colour', json={'postcodes': ['kt108bd']}),
+                         self.client.post('/postcodes/stream?fields=colour', data='kt108bd\n',
+                                          content_type='text/plain')):
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['message'], 'Unknown fields: colour')
+
+    def test_post_postcodes_with_gzip(self):
+        response = self.client.post('/postcodes', json={'postcodes': ['kt108bd'] * 100},
+                                    headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        rows = json.loads(gzip.decompress(response.data))
+        self.assertEqual(len(rows), 100)
+
+
+class TestStreamEndpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.client = app.test_client()
+
+    def test_post_ndjson(self):
+        response = self.client.post('/postcodes/stream', data='"kt108bd"\n\nnull\n123\n',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row['in_postcode'] for row in rows], ['kt108bd', None, '123'])
+        self.assertEqual(rows[0], parse_postcode('kt108bd').to_dict())
+
+    def test_post_plain_text(self):
+        response = self.client.post('/postcodes/stream', data='KT10 8BD\r\nQT10 8BD', content_type='text/plain')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row['is_valid'] for row in rows], [True, False])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests', ('route',))
+        latency = registry.histogram('latency_seconds', 'Latency', (0.1, 1))
+        requests.inc('/postcodes')
+        requests.inc('/postcodes', amount=2)
+        latency.observe(0.05)
+        latency.observe(5)
+
+        lines = registry.render().splitlines()
+        self.assertIn('requests_total{route="/postcodes"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('latency_seconds_count 2', lines)
+
+    def test_stage_timer(self):
+        registry = Registry()
+        timer = StageTimer(registry.counter('seconds', 'Seconds', ('stage',)),
+                           registry.counter('items', 'Items', ('stage',)), rate=1)
+        self.assertTrue(timer.sample())
+
+        batch = Postcode.validate_many(['kt108bd', 'x', 'kt108bd'])
+        timed = validate_many(['kt108bd', 'x', 'kt108bd'], timer=timer)
+        self.assertEqual(list(timed.rows()), list(batch.rows()))
+        self.assertEqual(timer.items.value('format'), 2)
+        self.assertEqual(timer.items.value('regex'), 1)
+
+    def test_metrics_endpoint(self):
+        client = app.test_client()
+        client.post('/postcodes', json={'postcodes': ['kt108bd', 'x']})
+
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.data.decode()
+        self.assertIn('postcode_http_requests_total{route="/postcodes",method="POST",status="200"}', body)
+        self.assertIn('postcode_batch_size_count{route="/postcodes"}', body)
+        self.assertIn('postcode_results_total{result="bad_length"}', body)
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_slices(self):
+        admission = AdmissionController(capacity=10, slice_size=4)
+        sizes = []
+        for chunk in admission.slices(list(range(10))):
+            sizes.append(len(chunk))
+            self.assertEqual(admission.in_flight, len(chunk))
+        self.assertEqual(sizes, [4, 4, 2])
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_check_size(self):
+        admission = AdmissionController(max_batch_size=3)
+        admission.check_size(3)
+        with self.assertRaises(Rejected) as raised:
+            admission.check_size(4)
+        self.assertEqual(raised.exception.status, 413)
+
+    def test_queue_full_and_timeout(self):
+        admission = AdmissionController(capacity=10, max_queued=1, timeout=0.05)
+        cost = admission.acquire(10)
+
+        waiter = threading.Thread(target=lambda: self.assertRaises(Rejected, admission.acquire, 1))
+        waiter.start()
+        while not admission.queued:
+            pass
+        with self.assertRaises(Rejected) as raised:
+            admission.acquire(1)
+        self.assertEqual(raised.exception.status, 429)
+        waiter.join()
+        self.assertEqual(admission.queued, 0)
+
+        with self.assertRaises(Rejected) as raised:
+            admission.acquire(1)
+        self.assertEqual(raised.exception.status, 503)
+        admission.release(cost)
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_waiters_are_admitted_in_order(self):
+        admission = AdmissionController(capacity=10, timeout=5)
+        cost = admission.acquire(8)
+        admitted = []
+
+        def acquire(name, size):
+            admission.release(admission.acquire(size))
+            admitted.append(name)
+
+        first = threading.Thread(target=acquire, args=('first', 5))
+        first.start()
+        while admission.waiting < 1:
+            pass
+        # The second one fits in the capacity left but waits for its turn
+        second = threading.Thread(target=acquire, args=('second', 1))
+        second.start()
+        while admission.waiting < 2:
+            pass
+        self.assertEqual(admitted, [])
+
+        admission.release(cost)
+        first.join()
+        second.join()
+        self.assertEqual(sorted(admitted), ['first', 'second'])
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_post_postcodes_rejected(self):
+        import webapp.api
+
+        client = app.test_client()
+        previous = webapp.api.admission
+        webapp.api.admission = AdmissionController(capacity=10, max_batch_size=5, max_queued=0)
+        try:
+            response = client.post('/postcodes', json={'postcodes': ['kt108bd'] * 6})
+            self.assertEqual(response.status_code, 413)
+            self.assertNotIn('Retry-After', response.headers)
+
+            cost = webapp.api.admission.acquire(10)
+            response = client.post('/postcodes', json={'postcodes': ['kt108bd']})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.get_json()['success'], False)
+            self.assertEqual(response.headers['Retry-After'], str(app.config['POSTCODE_RETRY_AFTER']))
+            webapp.api.admission.release(cost)
+
+            response = client.post('/postcodes', json={'postcodes': ['kt108bd'] * 5})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()), 5)
+        finally:
+            webapp.api.admission = previous
+
+        body = client.get('/metrics').data.decode()
+        self.assertIn('postcode_admission_rejections_total{reason="too_large"}', body)
+        self.assertIn('postcode_admission_rejections_total{reason="queue_full"}', body)
+        self.assertIn('postcode_admission_in_flight', body)
+
+
+class TestAsgiApp(unittest.TestCase):
+
+    def call(self, method, path, body_chunks=(b'',), headers=(), query_string=b''):
+        """Run a request through the ASGI app, return the status, the headers and the body"""
+        from webapp.asgi import app as asgi_app
+
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(body_chunks) - 1}
+                    for i, chunk in enumerate(body_chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+                 'headers': list(headers), 'root_path': ''}
+        asyncio.run(asgi_app(scope, receive, send))
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertFalse(sent[-1]['more_body'])
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(message['body'] for message in sent[1:])
+
+    def test_get_postcode(self):
+        status, headers, body = self.call('GET', '/postcode/kt10 8bd')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(json.loads(body), parse_postcode('kt10 8bd').to_dict())
+
+    def test_post_postcodes_in_chunks(self):
+        status, headers, body = self.call('POST', '/postcodes', body_chunks=(b'{"postcodes": ["kt1', b'08bd"]}'),
+                                          headers=[(b'content-type', b'application/json')],
+                                          query_string=b'fields=fmt_postcode')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [{'fmt_postcode': 'KT10 8BD'}])
+
+    def test_stream(self):
+        status, headers, body = self.call('POST', '/postcodes/stream', body_chunks=(b'KT10 8BD\n', b'QT10 8BD\n'),
+                                          headers=[(b'content-type', b'text/plain')])
+        self.assertEqual([json.loads(line)['is_valid'] for line in body.splitlines()], [True, False])
+
+    def run_app(self, wsgi_app, send):
+        """Run a GET request through an ASGI app of wsgi_app with one thread"""
+        from webapp.asgi import AsgiApp
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': [], 'root_path': ''}
+        asyncio.run(asyncio.wait_for(AsgiApp(wsgi_app, threads=1)(scope, receive, send), 5))
+
+    def test_app_error(self):
+        def wsgi_app(environ, start_response):
+            raise KeyError('app')
+
+        async def send(message):
+            pass
+
+        with self.assertRaises(KeyError):
+            self.run_app(wsgi_app, send)
+
+    def test_client_disconnected(self):
+        closed = []
+
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [])
+            try:
+                while True:
+                    yield b'chunk'
+            finally:
+                closed.append(True)
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                raise OSError('disconnected')
+
+        with self.assertRaises(OSError):
+            self.run_app(wsgi_app, send)
+        self.assertEqual(closed, [True])
+
+    def test_lifespan(self):
+        from webapp.asgi import AsgiApp
+
+        started = []
+        asgi_app = AsgiApp(app, threads=1, on_startup=[lambda: started.append(True)])
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+        self.assertEqual(started, [True])
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
 
 if __name__ == "__main__":
      unittest.main()
\ No newline at end of file
@@ -1,65 +1,21 @@
-import urllib
+# -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, abort
-from flask_restplus import fields, Api, Resource, reqparse
-from webapp.postcode import Postcode
+"""Postcode package
 
-app = Flask(__name__)
-api = Api(app, default='Postcode',
-          version='1.0',
-          title='Postcode REST API',
-          description='Postcode REST API fro Scurri')
+   Requirements: No dependencies needed for the library, flask and flask-restplus for the REST API.
+   Compatibility = python3
 
-post_parser = reqparse.RequestParser()
-post_parser.add_argument('poscodes',  type=list, help='poscode list', location='json')
+   The library is imported without the REST API, so the scripts and the short lived jobs only load the standard
+   library and the validation modules: the rule tables and the regex are compiled on the first validation.
+   The Flask app is in webapp.api, imported on the first access to webapp.app.
+"""
+from webapp.postcode import Postcode, PostcodeResult, parse_postcode, STATUS_VALID, STATUS_INVALID, \
+    STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS
 
-postcode_model = api.model('Postcode', {
-    'in_postcode': fields.String(description='input postcode'),
-    'fmt_postcode': fields.String(description='formatted postcode'),
-    'outward_code': fields.String(description='outward code'),
-    'inward_code': fields.String(description='inward code'),
-    'postcode_area': fields.String(description='postcode area'),
-    'postcode_district': fields.String(description='postcode district'),
-    'postcode_sector': fields.String(description='postcode sector'),
-    'postcode_unit': fields.String(description='postcode unit'),
-    'is_valid': fields.Boolean(description='is_valid'),
-    'message': fields.String(description='message'),
-})
 
-multiple_postcode_request = api.model('Multiple Postcode request', {
-    'postcodes': fields.List(fields.String(), description='List of postcodes')
-})
-
-@api.route('/postcode/<id>')
-@api.response(500, 'Invalid re')
-class PostcodeResource(Resource):
-    @api.marshal_with(postcode_model)
-    @api.expect(id)
-    def get(self, id):
-        id = urllib.parse.unquote(id)
-        p = Postcode()
-        p.split_validate(id)
-        return p
-
-@api.route('/postcodes')
-class MultiplePostcodeResource(Resource):
-    @api.expect(multiple_postcode_request)
-    @api.marshal_with(postcode_model)
-    def post(self):
-        ids = request.json['postcodes']
-
-        result = []
-        for id in ids:
-            p = Postcode()
-            p.split_validate(id)
-            result.append(p)
-
-        return result
-
-@api.errorhandler(Exception)
-@app.errorhandler(Exception)
-def error_handler(e):
-    response = jsonify(status = 401,
-                       message = f"DecodeError {str(e)}",
-                       success = False), 401
-    return response
\ No newline at end of file
+def __getattr__(name):
+    # The REST API is imported on first use
+    if name == 'app':
+        from webapp.api import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
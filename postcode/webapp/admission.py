@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode admission module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Admission control of the batches: the postcodes validated at once in a process are bounded by a capacity.
+   A batch is validated in slices, each slice takes its share of the capacity and gives it back when it's done,
+   so the large batches take turns with the others instead of holding a worker for seconds.
+   The batches waiting for capacity are queued in order of arrival; when the queue is full, or a batch has waited
+   too long, the batch is rejected at once and the client is told when to retry.
+   The single lookups are not admitted: they are cheap and never wait behind the batches.
+"""
+import threading
+from collections import deque
+
+# Reasons of the rejections, and their HTTP status
+REJECT_TOO_LARGE = 'too_large'
+REJECT_QUEUE_FULL = 'queue_full'
+REJECT_TIMEOUT = 'timeout'
+REJECT_STATUS = {
+    REJECT_TOO_LARGE: 413,
+    REJECT_QUEUE_FULL: 429,
+    REJECT_TIMEOUT: 503,
+}
+
+
+class Rejected(Exception):
+    """ Class Rejected is raised when a batch is not admitted
+        Attributes:
+            reason: one of REJECT_STATUS
+            status: the HTTP status of the response
+            message: description of the rejection
+    """
+
+    def __init__(self, reason: str, message: str):
+        """Rejected Constructor"""
+        super().__init__(message)
+        self.reason = reason
+        self.status = REJECT_STATUS[reason]
+        self.message = message
+
+
+class AdmissionController(object):
+    """ Class AdmissionController bounds the postcodes validated at once in the process
+        Attributes:
+            capacity: postcodes validated at once by all the batches, 0 disables the admission control
+            max_batch_size: postcodes in a batch, the larger ones are rejected, 0 for no limit
+            max_queued: batches waiting for capacity, more are rejected
+            timeout: seconds a batch waits for capacity before it's rejected
+            slice_size: postcodes of a batch validated at once
+            in_flight: postcodes being validated
+    """
+
+    def __init__(self, capacity: int = 0, max_batch_size: int = 0, max_queued: int = 64, timeout: float = 5,
+                 slice_size: int = 10000):
+        """AdmissionController Constructor"""
+        self.capacity = capacity
+        self.max_batch_size = max_batch_size
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.slice_size = slice_size
+        self.in_flight = 0
+        # Batches waiting for their first slice, counted under the lock: the metrics read it from other threads
+        self._queued = 0
+        self._lock = threading.Lock()
+        # Waiting slices in order of arrival: [cost, event, queued], queued is False for the admitted batches
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        """Number of batches waiting for their first slice"""
+        return self._queued
+
+    @property
+    def waiting(self) -> int:
+        """Number of slices waiting for capacity, of new and of admitted batches"""
+        return len(self._waiters)
+
+    def check_size(self, size: int):
+        """Raise Rejected if a batch of size postcodes is too large"""
+        if self.max_batch_size and size > self.max_batch_size:
+            raise Rejected(REJECT_TOO_LARGE, f"Too many postcodes: {size}, at most {self.max_batch_size} in a batch")
+
+    def acquire(self, cost: int, queued: bool = True):
+        """Wait for cost postcodes of capacity, in order of arrival. A slice larger than the capacity is
+           admitted alone.
+
+           Arguments
+           cost: number of postcodes
+           queued: the batch is new, it's rejected if the queue is full or if it waits more than timeout;
+                   the slices of an admitted batch wait without limit, the work is never dropped half done
+
+           Return:
+           the cost taken from the capacity, to give to release
+        """
+        if not self.capacity:
+            return 0
+        cost = min(cost, self.capacity)
+        with self._lock:
+            if not self._waiters and self.in_flight + cost <= self.capacity:
+                self.in_flight += cost
+                return cost
+            if queued and self._queued >= self.max_queued:
+                raise Rejected(REJECT_QUEUE_FULL, "Too many batches waiting, retry later")
+            waiter = [cost, threading.Event(), queued]
+            self._waiters.append(waiter)
+            self._queued += queued
+
+        if waiter[1].wait(self.timeout if queued else None):
+            return cost
+        with self._lock:
+            # The capacity may have been granted between the timeout and the lock
+            if waiter[1].is_set():
+                return cost
+            self._waiters.remove(waiter)
+            self._queued -= queued
+            self._wake()
+            raise Rejected(REJECT_TIMEOUT, "The server is busy, retry later")
+
+    def release(self, cost: int):
+        """Give back capacity taken by acquire, the waiting slices that fit are woken up in order"""
+        if not cost:
+            return
+        with self._lock:
+            self.in_flight -= cost
+            self._wake()
+
+    def slices(self, items: list, slice_size: int = None, queued: bool = True):
+        """Yield the slices of a batch, each one holding its share of the capacity until the next one is asked.
+           The first slice is admitted like a new batch: it may raise Rejected.
+
+           Arguments
+           items: list of postcodes
+           slice_size: postcodes in a slice, the slice_size of the controller by default
+           queued: see acquire, False to wait for the first slice without limit
+        """
+        slice_size = slice_size or self.slice_size or len(items) or 1
+        for start in range(0, len(items), slice_size):
+            chunk = items[start:start + slice_size]
+            cost = self.acquire(len(chunk), queued=queued and start == 0)
+            try:
+                yield chunk
+            finally:
+                self.release(cost)
+
+    def _wake(self):
+        # Called with the lock held
+        waiters = self._waiters
+        while waiters and (self.in_flight == 0 or self.in_flight + waiters[0][0] <= self.capacity):
+            cost, event, queued = waiters.popleft()
+            self._queued -= queued
+            self.in_flight += cost
+            event.set()
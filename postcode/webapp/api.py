@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode REST API module
+
+   Requirements: flask, flask-restplus
+   Compatibility = python3
+
+   The Flask app and the routes of the REST API, with the caches, indexes, pools and metrics they use.
+   Only the servers import this module, through webapp.app or webapp.asgi: the library doesn't need Flask.
+"""
+import gzip
+import hashlib
+import os
+import urllib
+from time import perf_counter
+
+from flask import Flask, Response, g, request, jsonify, abort, stream_with_context
+from flask_restplus import fields, Api, Resource, reqparse
+from webapp.admission import AdmissionController, Rejected
+from webapp.batch import PostcodeBatch, validate_many
+from webapp.bulk import read_lines, validate_stream
+from webapp.cache import PostcodeCache
+from webapp.index import PostcodeIndex
+from webapp.metrics import CONTENT_TYPE, Registry, StageTimer
+from webapp.parallel import ParallelValidator
+from webapp.postcode import Postcode, PostcodeResult, parse_postcode, STATUS_VALID, STATUS_INVALID, \
+    STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS
+from webapp.reload import Reloader
+from webapp.rules import get_rule_table
+from webapp.spatial import SpatialIndex
+from webapp.serializer import PostcodeSerializer, DEFAULT_FIELDS, dumps
+from webapp.suggest import PostcodeSuggester
+
+app = Flask(__name__)
+
+# Size of the cache of the validation results, 0 disables the cache
+app.config['POSTCODE_CACHE_SIZE'] = int(os.environ.get('POSTCODE_CACHE_SIZE', 0))
+
+# Batches of /postcodes with at least POSTCODE_PARALLEL_THRESHOLD postcodes are split in chunks of
+# POSTCODE_CHUNK_SIZE and validated by POSTCODE_WORKERS processes, 0 workers is the number of CPUs
+app.config['POSTCODE_WORKERS'] = int(os.environ.get('POSTCODE_WORKERS', 0))
+app.config['POSTCODE_CHUNK_SIZE'] = int(os.environ.get('POSTCODE_CHUNK_SIZE', 10000))
+app.config['POSTCODE_PARALLEL_THRESHOLD'] = int(os.environ.get('POSTCODE_PARALLEL_THRESHOLD', 50000))
+
+# Number of postcodes read, validated and written at once by /postcodes/stream
+app.config['POSTCODE_STREAM_CHUNK_SIZE'] = int(os.environ.get('POSTCODE_STREAM_CHUNK_SIZE', 1000))
+
+# Responses of at least POSTCODE_GZIP_MIN_SIZE bytes are compressed for the clients accepting gzip
+app.config['POSTCODE_GZIP_MIN_SIZE'] = int(os.environ.get('POSTCODE_GZIP_MIN_SIZE', 4096))
+
+# Max age in seconds of the /postcode/<id> responses in the HTTP caches
+app.config['POSTCODE_MAX_AGE'] = int(os.environ.get('POSTCODE_MAX_AGE', 86400))
+
+# Fraction of the requests whose validation stages are timed
+app.config['POSTCODE_METRICS_SAMPLE_RATE'] = float(os.environ.get('POSTCODE_METRICS_SAMPLE_RATE', 0.01))
+
+# Index of the known postcodes built by index_postcode.py, the results get the exists flag when it's set
+app.config['POSTCODE_INDEX'] = os.environ.get('POSTCODE_INDEX', '')
+
+# Rules file written by webapp.rules.save_rules, the rules in the code when it's not set. The rules file and the
+# index are reloaded when they change, checked every POSTCODE_RELOAD_INTERVAL seconds, 0 disables the reload
+app.config['POSTCODE_RULES'] = os.environ.get('POSTCODE_RULES', '')
+app.config['POSTCODE_RELOAD_INTERVAL'] = float(os.environ.get('POSTCODE_RELOAD_INTERVAL', 5))
+
+# Maximum number of postcodes returned by /postcodes/complete
+app.config['POSTCODE_COMPLETE_MAX_LIMIT'] = int(os.environ.get('POSTCODE_COMPLETE_MAX_LIMIT', 100))
+
+# Spatial index of the coordinates of the postcodes built by index_postcode.py --spatial, for /postcodes/nearest
+# and /postcodes/within. The radius (metres) and the number of postcodes returned are capped
+app.config['POSTCODE_SPATIAL_INDEX'] = os.environ.get('POSTCODE_SPATIAL_INDEX', '')
+app.config['POSTCODE_SPATIAL_MAX_RADIUS'] = float(os.environ.get('POSTCODE_SPATIAL_MAX_RADIUS', 10000))
+app.config['POSTCODE_SPATIAL_MAX_LIMIT'] = int(os.environ.get('POSTCODE_SPATIAL_MAX_LIMIT', 1000))
+
+# Maximum number of corrections suggested for an invalid postcode, 0 disables the suggestions.
+# They are returned when the suggestions field is requested, or by default with POSTCODE_SUGGEST_DEFAULT=1
+app.config['POSTCODE_SUGGESTIONS'] = int(os.environ.get('POSTCODE_SUGGESTIONS', 3))
+app.config['POSTCODE_SUGGEST_DEFAULT'] = bool(int(os.environ.get('POSTCODE_SUGGEST_DEFAULT', 0)))
+
+# Threads running the app under an ASGI server, see webapp.asgi
+app.config['POSTCODE_ASGI_THREADS'] = int(os.environ.get('POSTCODE_ASGI_THREADS', 32))
+
+# Admission control of the batches, see webapp.admission: batches larger than POSTCODE_MAX_BATCH_SIZE are rejected
+# (413), at most POSTCODE_MAX_IN_FLIGHT postcodes are validated at once in a process, in slices of
+# POSTCODE_SLICE_SIZE. A batch waits for its turn up to POSTCODE_QUEUE_TIMEOUT seconds (503) behind at most
+# POSTCODE_MAX_QUEUED other batches (429). The rejected clients are told to retry after POSTCODE_RETRY_AFTER seconds.
+# 0 disables the limits
+app.config['POSTCODE_MAX_BATCH_SIZE'] = int(os.environ.get('POSTCODE_MAX_BATCH_SIZE', 100000))
+app.config['POSTCODE_MAX_IN_FLIGHT'] = int(os.environ.get('POSTCODE_MAX_IN_FLIGHT', 100000))
+app.config['POSTCODE_SLICE_SIZE'] = int(os.environ.get('POSTCODE_SLICE_SIZE', 10000))
+app.config['POSTCODE_MAX_QUEUED'] = int(os.environ.get('POSTCODE_MAX_QUEUED', 64))
+app.config['POSTCODE_QUEUE_TIMEOUT'] = float(os.environ.get('POSTCODE_QUEUE_TIMEOUT', 5))
+app.config['POSTCODE_RETRY_AFTER'] = int(os.environ.get('POSTCODE_RETRY_AFTER', 1))
+
+cache = PostcodeCache(app.config['POSTCODE_CACHE_SIZE']) if app.config['POSTCODE_CACHE_SIZE'] else None
+index = PostcodeIndex(app.config['POSTCODE_INDEX']) if app.config['POSTCODE_INDEX'] else None
+spatial = SpatialIndex(app.config['POSTCODE_SPATIAL_INDEX']) if app.config['POSTCODE_SPATIAL_INDEX'] else None
+suggester = PostcodeSuggester(index=index, limit=app.config['POSTCODE_SUGGESTIONS']) \
+    if app.config['POSTCODE_SUGGESTIONS'] else None
+
+
+def set_index(new_index: PostcodeIndex):
+    """Swap in a new index of the known postcodes, the requests in progress keep the one they started with"""
+    global index
+    index = new_index
+    if suggester is not None:
+        suggester.index = new_index
+
+
+reloader = Reloader(rules_path=app.config['POSTCODE_RULES'], index_path=app.config['POSTCODE_INDEX'],
+                    interval=app.config['POSTCODE_RELOAD_INTERVAL'], on_index=set_index)
+reloader.load()
+
+default_fields = DEFAULT_FIELDS
+if index is not None:
+    default_fields += ('exists',)
+if suggester is not None and app.config['POSTCODE_SUGGEST_DEFAULT']:
+    default_fields += ('suggestions',)
+parallel = ParallelValidator(workers=app.config['POSTCODE_WORKERS'], chunk_size=app.config['POSTCODE_CHUNK_SIZE'],
+                             threshold=app.config['POSTCODE_PARALLEL_THRESHOLD'])
+admission = AdmissionController(capacity=app.config['POSTCODE_MAX_IN_FLIGHT'],
+                                max_batch_size=app.config['POSTCODE_MAX_BATCH_SIZE'],
+                                max_queued=app.config['POSTCODE_MAX_QUEUED'],
+                                timeout=app.config['POSTCODE_QUEUE_TIMEOUT'],
+                                slice_size=app.config['POSTCODE_SLICE_SIZE'])
+
+# Metrics, rendered by /metrics
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+RESULT_LABELS = {
+    STATUS_VALID: 'valid',
+    STATUS_INVALID: 'invalid',
+    STATUS_BAD_LENGTH: 'bad_length',
+    STATUS_SPECIAL_CHARS: 'special_characters',
+}
+
+registry = Registry()
+http_requests = registry.counter('postcode_http_requests_total', 'HTTP requests', ('route', 'method', 'status'))
+http_latency = registry.histogram('postcode_http_request_duration_seconds', 'HTTP request latency',
+                                  LATENCY_BUCKETS, ('route',))
+http_errors = registry.counter('postcode_http_errors_total', 'Exceptions raised handling the requests', ('exception',))
+batch_sizes = registry.histogram('postcode_batch_size', 'Postcodes in each batch', BATCH_SIZE_BUCKETS, ('route',))
+results_total = registry.counter('postcode_results_total', 'Validated postcodes, by result', ('result',))
+rejections = registry.counter('postcode_admission_rejections_total', 'Batches not admitted, by reason', ('reason',))
+stage_timer = StageTimer(
+    registry.counter('postcode_stage_seconds_total', 'Time spent in each stage of the validation', ('stage',)),
+    registry.counter('postcode_stage_items_total', 'Postcodes gone through each timed stage', ('stage',)),
+    rate=app.config['POSTCODE_METRICS_SAMPLE_RATE'])
+
+if cache is not None:
+    registry.collectors.append(lambda: [
+        ('postcode_cache_hits_total', 'counter', 'Validation cache hits', cache.hits),
+        ('postcode_cache_misses_total', 'counter', 'Validation cache misses', cache.misses),
+        ('postcode_cache_evictions_total', 'counter', 'Validation cache evictions', cache.evictions),
+        ('postcode_cache_size', 'gauge', 'Results in the validation cache', len(cache)),
+    ])
+
+registry.collectors.append(lambda: [
+    ('postcode_reloads_total', 'counter', 'Rules and index files swapped in', reloader.reloads),
+    ('postcode_reload_errors_total', 'counter', 'Rules and index files that failed to load', reloader.errors),
+])
+
+registry.collectors.append(lambda: [
+    ('postcode_admission_in_flight', 'gauge', 'Postcodes of the batches being validated', admission.in_flight),
+    ('postcode_admission_queued', 'gauge', 'Batches waiting for their first slice', admission.queued),
+    ('postcode_admission_waiting', 'gauge', 'Slices of the batches waiting for capacity', admission.waiting),
+])
+
+api = Api(app, default='Postcode',
+          version='1.0',
+          title='Postcode REST API',
+          description='Postcode REST API fro Scurri')
+
+post_parser = reqparse.RequestParser()
+post_parser.add_argument('poscodes',  type=list, help='poscode list', location='json')
+
+postcode_model = api.model('Postcode', {
+    'in_postcode': fields.String(description='input postcode'),
+    'fmt_postcode': fields.String(description='formatted postcode'),
+    'outward_code': fields.String(description='outward code'),
+    'inward_code': fields.String(description='inward code'),
+    'postcode_area': fields.String(description='postcode area'),
+    'postcode_district': fields.String(description='postcode district'),
+    'postcode_sector': fields.String(description='postcode sector'),
+    'postcode_unit': fields.String(description='postcode unit'),
+    'is_valid': fields.Boolean(description='is_valid'),
+    'message': fields.String(description='message'),
+    'exists': fields.Boolean(description='the postcode is in the index of the known postcodes, '
+                                         'only when POSTCODE_INDEX is set'),
+    'suggestions': fields.List(fields.String(), description='corrections of an invalid postcode'),
+})
+
+complete_parser = reqparse.RequestParser()
+complete_parser.add_argument('prefix', type=str, location='args', required=True, help='the beginning of a postcode')
+complete_parser.add_argument('limit', type=int, location='args', default=10,
+                             help='maximum number of postcodes to return')
+
+complete_model = api.model('Postcode completion', {
+    'prefix': fields.String(description='the prefix'),
+    'postcodes': fields.List(fields.String(), description='the first known postcodes starting with the prefix'),
+})
+
+spatial_parser = reqparse.RequestParser()
+spatial_parser.add_argument('lat', type=float, location='args', help='latitude of the point, in degrees')
+spatial_parser.add_argument('lon', type=float, location='args', help='longitude of the point, in degrees')
+spatial_parser.add_argument('postcode', type=str, location='args', help='a postcode as the point, in place of lat and lon')
+spatial_parser.add_argument('limit', type=int, location='args', help='maximum number of postcodes to return')
+
+within_parser = spatial_parser.copy()
+within_parser.add_argument('radius', type=float, location='args', default=1000, help='radius in metres')
+
+located_postcode_model = api.model('Located postcode', {
+    'postcode': fields.String(description='formatted postcode'),
+    'latitude': fields.Float(description='latitude in degrees'),
+    'longitude': fields.Float(description='longitude in degrees'),
+    'distance': fields.Float(description='distance from the point in metres'),
+})
+
+spatial_model = api.model('Postcodes near a point', {
+    'latitude': fields.Float(description='latitude of the point'),
+    'longitude': fields.Float(description='longitude of the point'),
+    'postcodes': fields.List(fields.Nested(located_postcode_model), description='the postcodes, the nearest first'),
+})
+
+multiple_postcode_request = api.model('Multiple Postcode request', {
+    'postcodes': fields.List(fields.String(), description='List of postcodes')
+})
+
+@app.before_first_request
+def start_reloader():
+    # In each process, the threads don't survive the fork of the workers
+    reloader.start()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(route, request.method, response.status_code)
+    start = g.get('request_start')
+    if start is not None:
+        http_latency.observe(perf_counter() - start, route)
+    return response
+
+
+@app.after_request
+def add_rules_version(response):
+    # The answers depend on the version of the rules: the clients and the caches can key on it
+    response.headers['X-Rules-Version'] = get_rule_table(Postcode).version
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype=CONTENT_TYPE)
+
+
+def validate_batch(ids: list, route: str, fields: tuple = DEFAULT_FIELDS, queued: bool = True):
+    """Validate a batch, recording its size and results: a sample of the batches is validated with stage timers.
+       The optional fields are filled only when they are requested.
+       The batch is validated in slices admitted by the admission controller, it raises Rejected when the batch
+       is not admitted; with queued False the batch waits for its turn without limit.
+    """
+    batch_sizes.observe(len(ids), route)
+    admission.check_size(len(ids))
+    slice_size = admission.slice_size
+    if len(ids) >= parallel.threshold:
+        # The slices of the large batches are kept large enough for the pool
+        slice_size = max(slice_size, parallel.threshold)
+
+    batches = [validate_slice(chunk, fields) for chunk in admission.slices(ids, slice_size, queued)]
+    if len(batches) == 1:
+        batch = batches[0]
+    else:
+        batch = PostcodeBatch()
+        for other in batches:
+            batch.extend(other)
+
+    for status, label in RESULT_LABELS.items():
+        count = batch.status.count(status)
+        if count:
+            results_total.inc(label, amount=count)
+    return batch
+
+
+def validate_slice(ids: list, fields: tuple) -> PostcodeBatch:
+    """Validate a slice of a batch and fill the optional fields requested"""
+    if len(ids) < parallel.threshold and stage_timer.sample():
+        batch = validate_many(ids, timer=stage_timer)
+    else:
+        batch = parallel.validate_many(ids, cache=cache)
+    if index is not None and 'exists' in fields:
+        batch.check_exists(index)
+    if suggester is not None and 'suggestions' in fields:
+        batch.suggest(suggester)
+    return batch
+
+
+def serialize(dumps, value, items: int = 1) -> bytes:
+    """Encode value with dumps, timing the serialization stage"""
+    start = perf_counter()
+    body = dumps(value)
+    stage_timer('serialization', perf_counter() - start, items)
+    return body
+
+
+fields_parser = reqparse.RequestParser()
+fields_parser.add_argument('fields', type=str, location='args',
+                           help='comma separated list of the fields to return, all the fields by default')
+
+
+def json_response(body: bytes, mimetype: str = 'application/json', etag: str = None) -> Response:
+    """Return a response with an encoded JSON body, compressed if it's large and the client accepts gzip
+
+       Arguments
+       body: the encoded JSON
+       mimetype: the content type of the response
+       etag: an optional strong ETag of the body, a suffix is added to it when the body is compressed
+    """
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if len(body) >= app.config['POSTCODE_GZIP_MIN_SIZE'] and request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+        if etag is not None:
+            etag += '-gzip'
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def error_response(status: int, message: str) -> Response:
+    """Return a JSON error response, in the format of error_handler"""
+    response = jsonify(status=status, message=message, success=False)
+    response.status_code = status
+    return response
+
+
+def rejected_response(e: Rejected) -> Response:
+    """Return the error response of a batch not admitted, the client may retry when the server is busy"""
+    rejections.inc(e.reason)
+    response = error_response(e.status, e.message)
+    if e.status != 413:
+        response.headers['Retry-After'] = str(app.config['POSTCODE_RETRY_AFTER'])
+    return response
+
+
+def postcode_etag(id: str, fields: str = None) -> str:
+    """Return the strong ETag of the /postcode/<id> response: the answer changes only with the postcode,
+       the projected fields, the rules version and the index version (the suggestions depend on the last two)
+    """
+    index_version = index.version if index is not None else ''
+    key = '\0'.join((get_rule_table(Postcode).version, index_version, fields or '', id))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def set_cache_headers(response: Response) -> Response:
+    """Let the HTTP caches keep the response for POSTCODE_MAX_AGE seconds"""
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['POSTCODE_MAX_AGE']
+    return response
+
+
+@api.route('/postcode/<id>')
+@api.response(500, 'Invalid re')
+class PostcodeResource(Resource):
+    @api.response(200, 'Success', postcode_model)
+    @api.expect(fields_parser)
+    @api.response(304, 'Not Modified')
+    @api.response(400, 'Unknown field')
+    def get(self, id):
+        fields = request.args.get('fields')
+        try:
+            serializer = PostcodeSerializer.from_query(fields, default_fields)
+        except ValueError as e:
+            return error_response(400, str(e))
+        id = urllib.parse.unquote(id)
+
+        # Answer the conditional requests without validating the postcode
+        etag = postcode_etag(id, fields)
+        for candidate in (etag, etag + '-gzip'):
+            if request.if_none_match.contains(candidate):
+                response = Response(status=304)
+                response.set_etag(candidate)
+                response.vary.add('Accept-Encoding')
+                return set_cache_headers(response)
+
+        if stage_timer.sample():
+            result = next(validate_many([id], timer=stage_timer).results())
+        elif cache is None:
+            result = parse_postcode(id)
+        else:
+            result = PostcodeResult(id, *cache.lookup(id))
+        if index is not None and 'exists' in serializer.fields:
+            result = result._replace(exists=result.is_valid and index.exists(result.fmt_postcode))
+        if suggester is not None and 'suggestions' in serializer.fields:
+            result = result._replace(suggestions=() if result.is_valid else tuple(suggester.suggest(id)))
+        results_total.inc(RESULT_LABELS[result.status])
+
+        body = serialize(serializer.dumps_result, result)
+        return set_cache_headers(json_response(body, etag=etag))
+
+@api.route('/postcodes')
+class MultiplePostcodeResource(Resource):
+    @api.expect(multiple_postcode_request, fields_parser)
+    @api.response(200, 'Success', [postcode_model])
+    @api.response(400, 'Unknown field')
+    @api.response(413, 'Too many postcodes in the batch')
+    @api.response(429, 'Too many batches waiting, retry after Retry-After seconds')
+    @api.response(503, 'The server is busy, retry after Retry-After seconds')
+    def post(self):
+        try:
+            serializer = PostcodeSerializer.from_query(request.args.get('fields'), default_fields)
+        except ValueError as e:
+            return error_response(400, str(e))
+        ids = request.json['postcodes']
+
+        try:
+            batch = validate_batch(ids, '/postcodes', serializer.fields)
+        except Rejected as e:
+            return rejected_response(e)
+
+        return json_response(serialize(serializer.dumps_batch, batch, len(batch)))
+
+@api.route('/postcodes/stream')
+class StreamPostcodeResource(Resource):
+    @api.doc(description='Validate a stream of postcodes, one for each line: JSON strings with content type '
+                         'application/x-ndjson, plain text otherwise. One JSON result for each line is streamed back.')
+    @api.expect(fields_parser)
+    @api.response(200, 'One JSON result for each line', postcode_model)
+    @api.response(400, 'Unknown field')
+    def post(self):
+        try:
+            serializer = PostcodeSerializer.from_query(request.args.get('fields'), default_fields)
+        except ValueError as e:
+            return error_response(400, str(e))
+        json_lines = request.mimetype in ('application/x-ndjson', 'application/json')
+        postcodes = read_lines(request.stream, json_lines=json_lines)
+        results = validate_stream(postcodes, chunk_size=app.config['POSTCODE_STREAM_CHUNK_SIZE'], serializer=serializer,
+                                  validate=lambda chunk: validate_batch(chunk, '/postcodes/stream', serializer.fields,
+                                                                        queued=False))
+
+        return Response(stream_with_context(results), mimetype='application/x-ndjson')
+
+@api.route('/postcodes/complete')
+class CompletePostcodeResource(Resource):
+    @api.doc(description='Return the first known postcodes starting with a prefix, the postcode index must be set '
+                         'by POSTCODE_INDEX')
+    @api.expect(complete_parser)
+    @api.response(200, 'Success', complete_model)
+    @api.response(503, 'No postcode index')
+    def get(self):
+        if index is None:
+            return error_response(503, "No postcode index, set POSTCODE_INDEX")
+
+        prefix = request.args.get('prefix', '')
+        limit = max(0, min(request.args.get('limit', 10, type=int), app.config['POSTCODE_COMPLETE_MAX_LIMIT']))
+        postcodes = index.complete(prefix, limit) if prefix.strip() else []
+
+        body = serialize(dumps, {'prefix': prefix, 'postcodes': postcodes}, len(postcodes))
+        return set_cache_headers(json_response(body))
+
+def spatial_query(query, default_limit: int):
+    """Answer a spatial query around the point of the request: lat and lon, or the location of a postcode
+
+       Arguments
+       query: function (latitude, longitude, limit) -> list of (position, distance) of the spatial index
+       default_limit: number of postcodes returned when the request has no limit
+    """
+    if spatial is None:
+        return error_response(503, "No spatial index, set POSTCODE_SPATIAL_INDEX")
+
+    postcode = request.args.get('postcode')
+    if postcode:
+        result = parse_postcode(postcode)
+        if not result.is_valid:
+            return error_response(400, result.message)
+        position = spatial.locate(result.fmt_postcode)
+        if position is None:
+            return error_response(404, f"No location for {result.fmt_postcode}")
+        latitude, longitude = spatial.location(position)
+    else:
+        latitude = request.args.get('lat', type=float)
+        longitude = request.args.get('lon', type=float)
+        if latitude is None or longitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            return error_response(400, "lat and lon in degrees, or postcode, are required")
+
+    limit = max(0, min(request.args.get('limit', default_limit, type=int), app.config['POSTCODE_SPATIAL_MAX_LIMIT']))
+    postcodes = []
+    for position, distance in query(latitude, longitude, limit):
+        point_lat, point_lon = spatial.location(position)
+        postcodes.append({'postcode': spatial.postcode(position), 'latitude': point_lat, 'longitude': point_lon,
+                          'distance': round(distance, 1)})
+
+    body = serialize(dumps, {'latitude': latitude, 'longitude': longitude, 'postcodes': postcodes}, len(postcodes))
+    return json_response(body)
+
+@api.route('/postcodes/nearest')
+class NearestPostcodeResource(Resource):
+    @api.doc(description='Return the postcodes nearest to a point, 1 by default. The spatial index must be set by '
+                         'POSTCODE_SPATIAL_INDEX')
+    @api.expect(spatial_parser)
+    @api.response(200, 'Success', spatial_model)
+    @api.response(503, 'No spatial index')
+    def get(self):
+        return spatial_query(lambda latitude, longitude, limit: spatial.nearest(latitude, longitude, limit), 1)
+
+@api.route('/postcodes/within')
+class WithinPostcodeResource(Resource):
+    @api.doc(description='Return the postcodes within a radius in metres of a point, the nearest first. '
+                         'The spatial index must be set by POSTCODE_SPATIAL_INDEX')
+    @api.expect(within_parser)
+    @api.response(200, 'Success', spatial_model)
+    @api.response(503, 'No spatial index')
+    def get(self):
+        radius = min(max(request.args.get('radius', 1000, type=float), 0), app.config['POSTCODE_SPATIAL_MAX_RADIUS'])
+        return spatial_query(lambda latitude, longitude, limit: spatial.within(latitude, longitude, radius, limit),
+                             app.config['POSTCODE_SPATIAL_MAX_LIMIT'])
+
+@api.errorhandler(Exception)
+@app.errorhandler(Exception)
+def error_handler(e):
+    http_errors.inc(type(e).__name__)
+    response = jsonify(status = 401,
+                       message = f"DecodeError {str(e)}",
+                       success = False), 401
+    return response
\ No newline at end of file
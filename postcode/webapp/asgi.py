@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode ASGI module
+
+   Requirements: No dependencies needed, an ASGI server (uvicorn) to serve it.
+   Compatibility = python3
+
+   Serve the Flask app from an ASGI server: same routes, same responses and OpenAPI documentation.
+   The event loop does the network IO: the request body is read before the app is called, so a slow client only
+   costs a coroutine, and the response is sent while it's produced. The app itself, CPU bound, runs on a pool of
+   threads, and the large batches of /postcodes are validated on the pool of processes of ParallelValidator.
+
+   Usage: uvicorn webapp.asgi:app, or python serve_postcode.py for the production launcher
+"""
+import asyncio
+import io
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import webapp.api
+from webapp.postcode import Postcode, parse_postcode
+from webapp.rules import get_rule_table
+
+# Request bodies larger than this are spooled to a temporary file
+SPOOL_SIZE = 1 << 20
+
+# Chunks of a response produced by the app and not sent yet, the app waits when the client is slower
+RESPONSE_QUEUE_SIZE = 8
+
+# Marks the end of a response in the queue
+_END = object()
+
+
+class ClientDisconnected(Exception):
+    """Raised in the app thread when the response can't be sent anymore"""
+
+
+class AsgiApp(object):
+    """ Class AsgiApp runs a WSGI app under an ASGI server
+        Attributes:
+            wsgi_app: the WSGI app
+            executor: the pool of threads the app runs on
+            on_startup: functions called when the server starts, before the first request
+            on_shutdown: functions called when the server stops
+    """
+
+    def __init__(self, wsgi_app, threads: int = 32, on_startup=(), on_shutdown=()):
+        """AsgiApp Constructor"""
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='postcode')
+        self.on_startup = list(on_startup)
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope: {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    for function in self.on_startup:
+                        await loop.run_in_executor(self.executor, function)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for function in self.on_shutdown:
+                    function()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = await read_body(receive)
+        environ = make_environ(scope, body)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(RESPONSE_QUEUE_SIZE)
+        closed = threading.Event()
+
+        def put(item):
+            # Called from the app thread: wait for room in the queue, stop the app once the response is over
+            if closed.is_set():
+                raise ClientDisconnected("The client has gone")
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        future = loop.run_in_executor(self.executor, self.run_wsgi, environ, put)
+        try:
+            start = await queue.get()
+            if start is _END:
+                # The app failed before starting the response: raise its error
+                await future
+                raise RuntimeError("The WSGI app returned no response")
+            status, headers = start
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            # Stop the app thread if the client has gone: its next put raises, and the one blocked on the full
+            # queue, if any, gets the room it waits for
+            closed.set()
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.gather(future, return_exceptions=True)
+            body.close()
+        await future
+
+    def run_wsgi(self, environ: dict, put):
+        """Call the WSGI app in a thread of the pool and put the response start then its chunks in the queue.
+           The whole response is produced in the same thread, the request context of Flask is bound to it.
+        """
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [(int(status.split(' ', 1)[0]),
+                           [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response_headers])]
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                sent_start = False
+                for chunk in iterable:
+                    if not sent_start:
+                        put(started[0])
+                        sent_start = True
+                    if chunk:
+                        put(chunk)
+                if not sent_start:
+                    put(started[0])
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        finally:
+            put(_END)
+
+
+async def read_body(receive):
+    """Read the whole request body, in memory up to SPOOL_SIZE then in a temporary file
+
+       Return:
+       a binary file object at the start of the body
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    body.seek(0)
+    return body
+
+
+def make_environ(scope: dict, body) -> dict:
+    """Return the WSGI environ of an ASGI http scope
+
+       Arguments
+       scope: the ASGI scope
+       body: binary file object of the request body
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+
+    if 'CONTENT_LENGTH' not in environ:
+        # The body has been read whole, the chunked requests get their length
+        body.seek(0, io.SEEK_END)
+        environ['CONTENT_LENGTH'] = str(body.tell())
+        body.seek(0)
+    return environ
+
+
+def preload():
+    """Compile the rule tables and the validator and ask the OS to read the indexes, before the first request.
+       Called before the workers are forked, the compiled tables and the mapped indexes are shared by all of them.
+    """
+    get_rule_table(Postcode)
+    parse_postcode('KT10 8BD')
+    for mapped in (webapp.api.index, webapp.api.spatial):
+        if mapped is not None:
+            mapped.preload()
+
+
+def shutdown():
+    """Stop the pool of processes of the large batches"""
+    webapp.api.parallel.close()
+
+
+app = AsgiApp(webapp.api.app, threads=webapp.api.app.config['POSTCODE_ASGI_THREADS'], on_startup=[preload],
+              on_shutdown=[shutdown])
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode batch module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Validate, format and split a whole batch of postcodes in one pass. The results are stored by column
+   (one list per attribute of Postcode) and the message strings are replaced by a compact array of status codes.
+"""
+from array import array
+from itertools import compress, count, repeat
+from operator import add, and_, itemgetter, mul
+from sys import intern
+
+from webapp.postcode import Postcode, PostcodeResult, MESSAGES, STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, \
+    STATUS_SPECIAL_CHARS, make_validator
+from webapp.rules import get_rule_table
+
+# Lengths of the postcodes without spaces that are checked further
+_LENGTHS = frozenset((5, 6, 7))
+
+# Parts of a normalized postcode and of a verdict of RuleTable.split_outward, for the columns of validate_many
+_OUTWARD = itemgetter(slice(None, -3))
+_INWARD = itemgetter(slice(-3, None))
+_SECTOR = itemgetter(slice(None, 1))
+_AREA = itemgetter(0)
+_DISTRICT = itemgetter(1)
+
+# Verdict of the outward codes that are not valid, its area and district are blanked
+_NO_VERDICT = ("", "", False)
+
+# Status by number of steps passed: right length, alphanumeric, valid
+_STATUSES = (STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS, STATUS_INVALID, STATUS_VALID)
+
+
+class PostcodeBatch(object):
+    """ Class PostcodeBatch holds the results of a batch validation by column
+        Attributes:
+            in_postcode, fmt_postcode, outward_code, inward_code, postcode_area, postcode_district,
+            postcode_sector, postcode_unit, is_valid: parallel lists, one item for each input postcode,
+                                                      with the same meaning of the Postcode attributes
+            status: array of status codes (STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS)
+            exists: list of flags set by check_exists, None if the postcodes have not been looked up in an index
+            suggestions: lists of corrections set by suggest, None if no corrections have been looked for
+    """
+
+    COLUMNS = ('in_postcode', 'fmt_postcode', 'outward_code', 'inward_code', 'postcode_area', 'postcode_district',
+               'postcode_sector', 'postcode_unit', 'is_valid')
+
+    def __init__(self):
+        """PostcodeBatch Constructor"""
+        self.in_postcode = []
+        self.fmt_postcode = []
+        self.outward_code = []
+        self.inward_code = []
+        self.postcode_area = []
+        self.postcode_district = []
+        self.postcode_sector = []
+        self.postcode_unit = []
+        self.is_valid = []
+        self.status = array('B')
+        self.exists = None
+        self.suggestions = None
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    @property
+    def messages(self) -> list:
+        """The message strings, as Postcode.split_validate would set them"""
+        return [MESSAGES[status] for status in self.status]
+
+    def row(self, i: int) -> dict:
+        """Return the i-th result as a dictionary with the same keys of the Postcode attributes"""
+        result = {column: getattr(self, column)[i] for column in self.COLUMNS}
+        result['message'] = MESSAGES[self.status[i]]
+        if self.exists is not None:
+            result['exists'] = self.exists[i]
+        if self.suggestions is not None:
+            result['suggestions'] = self.suggestions[i]
+        return result
+
+    def rows(self):
+        """Iterate over the results as dictionaries"""
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def results(self):
+        """Iterate over the results as PostcodeResult"""
+        exists = self.exists if self.exists is not None else repeat(None, len(self))
+        suggestions = map(tuple, self.suggestions) if self.suggestions is not None else repeat(None, len(self))
+        return map(PostcodeResult._make,
+                   zip(*(getattr(self, column) for column in self.COLUMNS), self.status, exists, suggestions))
+
+    def to_postcodes(self) -> list:
+        """Return the results as a list of Postcode instances"""
+        result = []
+        for row in self.rows():
+            p = Postcode(**row)
+            p.message = row['message']
+            result.append(p)
+        return result
+
+    def check_exists(self, index):
+        """Look up the valid postcodes in a PostcodeIndex and set the exists flags"""
+        self.exists = index.exists_many(self.fmt_postcode, self.is_valid)
+
+    def suggest(self, suggester):
+        """Look for corrections of the invalid postcodes with a PostcodeSuggester and set the suggestions"""
+        self.suggestions = suggester.suggest_many(self.in_postcode, self.is_valid)
+
+    def extend(self, other: 'PostcodeBatch'):
+        """Append the results of another batch"""
+        for name in ('exists', 'suggestions'):
+            mine, others = getattr(self, name), getattr(other, name)
+            if mine is not None or others is not None:
+                setattr(self, name, (mine if mine is not None else [None] * len(self)) +
+                                    (others if others is not None else [None] * len(other)))
+        for column in self.COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+        self.status.extend(other.status)
+
+
+def validate_many(postcodes, rules=Postcode, cache=None, timer=None) -> PostcodeBatch:
+    """Validate, format and split a batch of postcodes
+
+       It gives the same answers of Postcode.split_validate called on each postcode. Each distinct postcode of the
+       batch is validated once, column by column: the steps of make_validator run over the whole column of the
+       distinct postcodes and the special cases once for each outward code, then the results are fanned out to the
+       repeated postcodes.
+
+       Arguments
+       postcodes: iterable of strings
+       rules: a class with the Postcode regex and special cases lists
+       cache: an optional PostcodeCache shared between the batches, it must use the same rules
+       timer: an optional function (stage, seconds) timing the stages of the validation, see make_validator.
+              The cache is not used when the batch is timed.
+
+       Return:
+       a PostcodeBatch with the results stored by column
+    """
+    batch = PostcodeBatch()
+    batch.in_postcode = list(postcodes)
+    if cache is None and timer is None:
+        _validate_distinct(batch, get_rule_table(rules))
+    elif timer is not None:
+        _validate_rows(batch, make_validator(rules, timer=timer))
+    else:
+        _validate_rows(batch, cache.validator())
+    return batch
+
+
+def _validate_distinct(batch: PostcodeBatch, table):
+    """Fill the columns of a batch from its in_postcode, validating each distinct postcode once by column"""
+    postcodes = batch.in_postcode
+    positions = dict.fromkeys(postcodes)
+    if len(positions) == len(postcodes):
+        columns = _validate_columns(postcodes, table)
+    else:
+        # The columns of the distinct postcodes, in order of first appearance, indexed by the position of each postcode
+        positions = dict(zip(positions, count()))
+        columns = _validate_columns(list(positions), table)
+        positions = list(map(positions.__getitem__, postcodes))
+        columns = [list(map(column.__getitem__, positions)) for column in columns[:-1]] + \
+                  [array('B', map(columns[-1].__getitem__, positions))]
+
+    (batch.fmt_postcode, batch.outward_code, batch.inward_code, batch.postcode_area, batch.postcode_district,
+     batch.postcode_sector, batch.postcode_unit, batch.is_valid, batch.status) = columns
+
+
+def _validate_columns(postcodes: list, table) -> list:
+    """Validate postcodes with the steps of make_validator done column by column
+
+       The rows that fail a step are blanked by multiplying their strings by the flags of the step: "x" * False is "".
+
+       Return:
+       the columns fmt, outward, inward, area, district, sector, unit and is_valid as lists, and the status as an array
+    """
+    if None in postcodes:
+        # None is rejected as too short, like an empty postcode
+        postcodes = ["" if postcode is None else postcode for postcode in postcodes]
+
+    postcodes = list(map(str.replace, postcodes, repeat(" "), repeat("")))
+    right_length = list(map(_LENGTHS.__contains__, map(len, postcodes)))
+    alnum = list(map(and_, right_length, map(str.isalnum, postcodes)))
+
+    postcodes = list(map(str.upper, postcodes))
+    outward_code = list(map(_OUTWARD, postcodes))
+    inward_code = list(map(_INWARD, postcodes))
+    fmt_postcode = list(map(" ".join, zip(outward_code, inward_code)))
+    matched = list(map(and_, alnum, map(bool, map(table.regex.match, fmt_postcode))))
+
+    # Only the codes matched by the regex are interned, as make_validator does: there is a bounded number of them
+    outward_codes = {code: intern(code) for code in set(compress(outward_code, matched))}
+    outward_code = list(map(outward_codes.get, outward_code, outward_code))
+    inward_codes = {code: intern(code) for code in set(compress(inward_code, matched))}
+    inward_code = list(map(inward_codes.get, inward_code, inward_code))
+    units = {code: intern(code[1:]) for code in inward_codes.values()}
+
+    # The special cases are checked once for each outward code matched by the regex
+    outward_codes = outward_codes.values()
+    verdicts = {code: verdict for code, verdict in zip(outward_codes, map(table.split_outward, outward_codes))
+                if verdict[2]}
+    is_valid = list(map(and_, matched, map(verdicts.__contains__, outward_code)))
+    verdicts = list(map(verdicts.get, outward_code, repeat(_NO_VERDICT)))
+
+    # The flags are nested, valid rows are alnum and alnum rows have the right length: their sum is the status
+    status = array('B', map(_STATUSES.__getitem__, map(add, map(add, right_length, alnum), is_valid)))
+
+    # The batches of well formed or valid postcodes only have nothing to blank
+    checked = None if all(alnum) else alnum
+    valid = None if all(is_valid) else is_valid
+    return [_blank(fmt_postcode, checked), _blank(outward_code, checked), _blank(inward_code, checked),
+            _blank(map(_AREA, verdicts), valid), _blank(map(_DISTRICT, verdicts), valid),
+            _blank(map(_SECTOR, inward_code), valid), _blank(map(units.get, inward_code, repeat("")), valid),
+            is_valid, status]
+
+
+def _blank(strings, flags) -> list:
+    """Return the strings as a list, blanking the ones of the rows not flagged, flags is None if all the rows are"""
+    if flags is None:
+        return strings if isinstance(strings, list) else list(strings)
+    return list(map(mul, strings, flags))
+
+
+def _validate_rows(batch: PostcodeBatch, validate):
+    """Fill the columns of a batch from its in_postcode, validating one postcode at a time with validate"""
+    # Repeated postcodes are validated only once
+    known = {}
+    rows = []
+    append = rows.append
+    for postcode in batch.in_postcode:
+        row = known.get(postcode)
+        if row is None:
+            row = known[postcode] = validate(postcode)
+        append(row)
+
+    if not rows:
+        return
+
+    # Transpose the rows into the columns
+    (fmt_postcode, outward_code, inward_code, postcode_area, postcode_district, postcode_sector, postcode_unit,
+     is_valid, status) = zip(*rows)
+    batch.fmt_postcode = list(fmt_postcode)
+    batch.outward_code = list(outward_code)
+    batch.inward_code = list(inward_code)
+    batch.postcode_area = list(postcode_area)
+    batch.postcode_district = list(postcode_district)
+    batch.postcode_sector = list(postcode_sector)
+    batch.postcode_unit = list(postcode_unit)
+    batch.is_valid = list(is_valid)
+    batch.status = array('B', status)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode bulk module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Stream a CSV or NDJSON file through the postcode validator with a generator pipeline:
+   the rows are read, validated and written in chunks, so the memory used does not depend on the size of the file.
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from webapp.batch import validate_many
+from webapp.serializer import PostcodeSerializer
+
+# Columns added to each row
+RESULT_COLUMNS = ('fmt_postcode', 'outward_code', 'inward_code', 'postcode_area', 'postcode_district',
+                  'postcode_sector', 'postcode_unit', 'is_valid', 'message')
+
+# Supported file formats
+FORMATS = ('csv', 'ndjson')
+
+
+def result_columns(index=None, suggester=None) -> tuple:
+    """Return the columns added to each row, with the optional exists and suggestions columns"""
+    columns = RESULT_COLUMNS
+    if index is not None:
+        columns += ('exists',)
+    if suggester is not None:
+        columns += ('suggestions',)
+    return columns
+
+
+def read_csv(reader: csv.DictReader, column: str):
+    """Yield (row, postcode) for each row of a CSV file
+
+       Arguments
+       reader: csv.DictReader of the file
+       column: name of the column with the postcode
+    """
+    for row in reader:
+        yield row, row[column]
+
+
+def read_ndjson(fp, column: str):
+    """Yield (row, postcode) for each line of a newline-delimited JSON file, the blank lines are skipped
+
+       Arguments
+       fp: text file object
+       column: name of the field with the postcode
+    """
+    for line in fp:
+        if line.strip():
+            row = json.loads(line)
+            yield row, row.get(column)
+
+
+def chunks(iterable, size: int):
+    """Yield lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_rows(rows, chunk_size: int = 10000, cache=None, parallel=None, index=None, suggester=None):
+    """Validate the postcodes of the rows one chunk at a time and yield the rows with the result columns added
+
+       Arguments
+       rows: iterable of (row, postcode), as returned by read_csv and read_ndjson
+       chunk_size: number of rows validated at once
+       cache: an optional PostcodeCache
+       parallel: an optional ParallelValidator, a chunk for each worker is read at once
+       index: an optional PostcodeIndex, the exists column is added to the rows
+       suggester: an optional PostcodeSuggester, the suggestions column is added to the rows
+    """
+    columns_added = result_columns(index, suggester)
+    if parallel is None:
+        validate = validate_many
+    else:
+        validate = parallel.validate_many
+        chunk_size = parallel.chunk_size * parallel.workers
+
+    for chunk in chunks(rows, chunk_size):
+        batch = validate([postcode for row, postcode in chunk], cache=cache)
+        columns = [getattr(batch, column) for column in RESULT_COLUMNS[:-1]]
+        columns.append(batch.messages)
+        if index is not None:
+            batch.check_exists(index)
+            columns.append(batch.exists)
+        if suggester is not None:
+            batch.suggest(suggester)
+            columns.append(batch.suggestions)
+
+        for (row, postcode), values in zip(chunk, zip(*columns)):
+            row.update(zip(columns_added, values))
+            yield row
+
+
+def write_csv(fp, rows, fieldnames, chunk_size: int = 10000):
+    """Write the rows to a CSV file, one chunk of rows at a time
+
+       Arguments
+       fp: text file object
+       rows: iterable of dictionaries
+       fieldnames: the columns of the file
+       chunk_size: number of rows written at once
+    """
+    writer = csv.DictWriter(fp, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    for chunk in chunks(rows, chunk_size):
+        writer.writerows(chunk)
+
+
+def write_ndjson(fp, rows, chunk_size: int = 10000):
+    """Write the rows to a newline-delimited JSON file, one chunk of rows at a time
+
+       Arguments
+       fp: text file object
+       rows: iterable of dictionaries
+       chunk_size: number of rows written at once
+    """
+    dumps = json.dumps
+    for chunk in chunks(rows, chunk_size):
+        fp.write("".join([dumps(row) + "\n" for row in chunk]))
+
+
+def read_lines(lines, json_lines: bool = True):
+    """Yield the postcodes of a stream of lines, one postcode for each line, the blank lines are skipped
+
+       Arguments
+       lines: iterable of bytes or strings
+       json_lines: the lines are JSON strings (NDJSON), the lines that are not JSON strings are taken as plain text
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        if json_lines:
+            try:
+                value = json.loads(line)
+            except ValueError:
+                value = line
+            line = value if value is None or isinstance(value, str) else line
+        yield line
+
+
+def validate_stream(postcodes, chunk_size: int = 1000, cache=None, serializer=None, validate=None):
+    """Validate a stream of postcodes one chunk at a time and yield the results of each chunk as NDJSON bytes
+
+       Arguments
+       postcodes: iterable of strings
+       chunk_size: number of postcodes validated at once
+       cache: an optional PostcodeCache
+       serializer: an optional PostcodeSerializer, to encode a subset of the fields
+       validate: an optional function list of postcodes -> PostcodeBatch, used in place of validate_many
+    """
+    serializer = serializer or PostcodeSerializer()
+    if validate is None:
+        def validate(chunk):
+            return validate_many(chunk, cache=cache)
+
+    for chunk in chunks(postcodes, chunk_size):
+        yield serializer.dumps_lines(validate(chunk))
+
+
+def join_suggestions(rows, separator: str = ';'):
+    """Join the suggestions of the rows in a string, for the CSV files"""
+    for row in rows:
+        row['suggestions'] = separator.join(row['suggestions'])
+        yield row
+
+
+class BulkStats(object):
+    """ Class BulkStats counts the rows going through the pipeline
+        Attributes:
+            rows: number of rows read
+            invalid: number of rows with an invalid postcode
+            seconds: time spent
+    """
+
+    def __init__(self):
+        """BulkStats Constructor"""
+        self.rows = 0
+        self.invalid = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def count(self, rows):
+        """Count the rows and the invalid ones while they go through"""
+        for row in rows:
+            self.rows += 1
+            if not row['is_valid']:
+                self.invalid += 1
+            yield row
+
+
+def run(in_fp, out_fp, fmt: str = 'csv', column: str = 'postcode', chunk_size: int = 10000, cache=None,
+        invalid_only: bool = False, parallel=None, index=None, suggester=None) -> BulkStats:
+    """Validate the postcodes of a CSV or NDJSON file and write the rows with the result columns added
+
+       Arguments
+       in_fp: text file object to read
+       out_fp: text file object to write
+       fmt: file format, csv or ndjson
+       column: name of the column with the postcode
+       chunk_size: number of rows read, validated and written at once
+       cache: an optional PostcodeCache
+       invalid_only: write only the rows with an invalid postcode
+       parallel: an optional ParallelValidator, to validate the rows on a pool of processes
+       index: an optional PostcodeIndex, to add the exists column
+       suggester: an optional PostcodeSuggester, to add the suggestions column, separated by ; in a CSV file
+
+       Return:
+       the BulkStats of the run
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid format: {fmt}")
+
+    stats = BulkStats()
+    start = time.perf_counter()
+
+    if fmt == 'csv':
+        reader = csv.DictReader(in_fp)
+        fieldnames = list(reader.fieldnames or [])
+        if column not in fieldnames:
+            raise ValueError(f"Column not found: {column}")
+        rows = read_csv(reader, column)
+    else:
+        rows = read_ndjson(in_fp, column)
+
+    rows = stats.count(validate_rows(rows, chunk_size=chunk_size, cache=cache, parallel=parallel, index=index,
+                                     suggester=suggester))
+    if invalid_only:
+        rows = (row for row in rows if not row['is_valid'])
+
+    if fmt == 'csv':
+        if suggester is not None:
+            rows = join_suggestions(rows)
+        columns = result_columns(index, suggester)
+        write_csv(out_fp, rows, fieldnames + [c for c in columns if c not in fieldnames], chunk_size)
+    else:
+        write_ndjson(out_fp, rows, chunk_size)
+
+    stats.seconds = time.perf_counter() - start
+    return stats
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode cache module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   A bounded LRU cache of the validation results, keyed on the normalized postcode (uppercase, spaces removed).
+   The results are immutable rows of PostcodeResult shared by all the inputs with the same normalized postcode,
+   and the cache is cleared when the rules on Postcode change.
+"""
+import threading
+from collections import OrderedDict
+
+from webapp.postcode import Postcode, make_validator
+from webapp.rules import get_rule_table
+
+
+class PostcodeCache(object):
+    """ Class PostcodeCache memoizes the validation results of the most recently used postcodes
+        Attributes:
+            maxsize: maximum number of results kept in the cache
+            rules: the rules class the postcodes are validated with
+            hits: number of lookups answered by the cache
+            misses: number of lookups that had to validate the postcode
+            evictions: number of results dropped to make room for new ones
+    """
+
+    def __init__(self, maxsize: int = 4096, rules=Postcode):
+        """PostcodeCache Constructor"""
+        self.maxsize = maxsize
+        self.rules = rules
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._validate = None
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def clear(self):
+        """Drop all the results"""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict:
+        """Return the cache statistics"""
+        return {
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'rules_version': self._version,
+        }
+
+    def validator(self):
+        """Return a function that validates a single postcode through the cache, like make_validator does
+
+           The results are dropped if the rules have changed since the last call.
+        """
+        table = get_rule_table(self.rules)
+        if table.version != self._version:
+            with self._lock:
+                self._results.clear()
+                self._validate = make_validator(self.rules)
+                self._version = table.version
+        return self.lookup
+
+    def lookup(self, postcode: str) -> tuple:
+        """Return the result of the validation of a postcode, see make_validator"""
+        if self._validate is None:
+            self.validator()
+        validate = self._validate
+
+        # Only the ascii postcodes are cached: uppercase can change the length of the others
+        if postcode is None or not postcode.isascii():
+            return validate(postcode)
+
+        key = postcode.replace(" ", "").upper()
+        results = self._results
+        with self._lock:
+            result = results.get(key)
+            if result is not None:
+                results.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        result = validate(key)
+
+        with self._lock:
+            results[key] = result
+            if len(results) > self.maxsize:
+                results.popitem(last=False)
+                self.evictions += 1
+
+        return result
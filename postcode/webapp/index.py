@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode index module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   A sorted index of the known postcodes, to check that a well formed postcode really exists.
+   Each postcode is packed in a 5 bytes key: the outward code padded to 4 characters and the inward code,
+   7 characters of the alphabet space, 0-9, A-Z read as a base 37 number. The keys are stored sorted in a binary
+   file which is memory mapped read-only: a lookup is a binary search over the mapped file, no postcode is
+   loaded as a Python object, and all the processes mapping the file share the same pages of the OS cache.
+
+   File layout: MAGIC, the number of keys as an unsigned 64 bits little endian integer, the sorted keys.
+   An index is updated without a rebuild by update_index: the runs of keys between the changes are copied from
+   the old file as they are.
+"""
+import hashlib
+import mmap
+import os
+import struct
+from bisect import bisect_right
+
+# Header of the index file
+MAGIC = b'PCINDEX1'
+HEADER = struct.Struct('<8sQ')
+HEADER_SIZE = HEADER.size
+
+# Size of a packed postcode
+KEY_SIZE = 5
+
+# Alphabet of the packed postcodes, in sort order: the space pads the outward code
+ALPHABET = ' 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_CODES = {c: i for i, c in enumerate(ALPHABET)}
+_CODES.update({c.lower(): i for c, i in _CODES.items() if c.isalpha()})
+_BASE = len(ALPHABET)
+
+# Characters of a packed postcode: outward code padded to 4 plus the inward code
+KEY_CHARS = 7
+
+# One key every FENCE_STEP is kept in memory, to narrow the binary search over the mapped file
+FENCE_STEP = 64
+
+
+def pack_postcode(postcode: str):
+    """Return the 5 bytes key of a postcode, in any case and spacing, or None if it can't be packed
+
+       Arguments
+       postcode: string
+    """
+    if postcode is None:
+        return None
+    postcode = postcode.replace(" ", "")
+    if len(postcode) < 5 or len(postcode) > 7:
+        return None
+    return _pack_chars(postcode[:-3].ljust(4) + postcode[-3:])
+
+
+def prefix_keys(prefix: str) -> list:
+    """Return the key prefixes of the postcodes starting with prefix, the likeliest first
+
+       The prefix is normalized like Postcode.format does: uppercase, and without a space the last 3 characters
+       are the inward code. While a postcode is being typed the inward code may be shorter, so the prefixes
+       without a space are also tried as an outward code alone and with a 1 or 2 characters inward code.
+
+       Arguments
+       prefix: string
+
+       Return:
+       a list of strings of the characters of ALPHABET, the outward code padded to 4 when it's complete
+    """
+    prefix = prefix.strip().upper()
+    if " " in prefix:
+        outward, inward = prefix.split(" ", 1)
+        inward = inward.replace(" ", "")
+        if len(outward) > 4 or len(inward) > 3:
+            return []
+        return [outward.ljust(4) + inward]
+
+    candidates = []
+    if len(prefix) <= 4:
+        candidates.append(prefix)
+    for inward_len in (3, 2, 1):
+        outward, inward = prefix[:-inward_len], prefix[-inward_len:]
+        if 2 <= len(outward) <= 4 and inward[0].isdigit() and (inward_len == 1 or inward[1:].isalpha()):
+            candidates.append(outward.ljust(4) + inward)
+    return candidates
+
+
+def _pack_chars(chars: str):
+    """Return the key of 7 characters of ALPHABET, or None if a character is not in ALPHABET"""
+    codes = _CODES
+    number = 0
+    try:
+        for c in chars:
+            number = number * _BASE + codes[c]
+    except KeyError:
+        return None
+    return number.to_bytes(KEY_SIZE, 'big')
+
+
+def unpack_postcode(key: bytes) -> str:
+    """Return the formatted postcode of a 5 bytes key"""
+    number = int.from_bytes(key, 'big')
+    chars = []
+    for _ in range(KEY_CHARS):
+        number, code = divmod(number, _BASE)
+        chars.append(ALPHABET[code])
+    chars.reverse()
+    return "".join(chars[:4]).rstrip() + " " + "".join(chars[4:])
+
+
+def build_index(postcodes, path: str) -> int:
+    """Write the index of the postcodes to a file, the postcodes that can't be packed are skipped
+
+       The file is written next to path and renamed over it, so the processes mapping an older index
+       are never exposed to a partial file.
+
+       Arguments
+       postcodes: iterable of strings, in any case and spacing
+       path: the index file
+
+       Return:
+       the number of postcodes in the index
+    """
+    keys = sorted({key for key in map(pack_postcode, postcodes) if key is not None})
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, len(keys)))
+        fp.write(b"".join(keys))
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+def update_index(path: str, added=(), removed=()) -> int:
+    """Add and remove postcodes of an index file, without reading the postcodes it was built from
+
+       The keys of the old file are copied by runs between the changed keys, so an update costs a copy of the file
+       and a binary search for each change. The file is replaced like build_index does.
+
+       Arguments
+       path: the index file
+       added: iterable of strings, the postcodes to add
+       removed: iterable of strings, the postcodes to remove, they win over the added ones
+
+       Return:
+       the number of postcodes in the updated index
+    """
+    removed = {key for key in map(pack_postcode, removed) if key is not None}
+    added = sorted({key for key in map(pack_postcode, added) if key is not None} - removed)
+
+    with PostcodeIndex(path) as index:
+        mm = index._mm
+        removed = sorted(key for key in removed if index.exists_key(key))
+        added = [key for key in added if not index.exists_key(key)]
+        count = index.count + len(added) - len(removed)
+
+        # Changes in key order: each one cuts the old keys at its position, the removed key is skipped
+        changes = sorted([(key, False) for key in added] + [(key, True) for key in removed])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, count))
+            position = 0
+            for key, is_removed in changes:
+                i = index.bisect(key)
+                fp.write(mm[HEADER_SIZE + position * KEY_SIZE:HEADER_SIZE + i * KEY_SIZE])
+                if is_removed:
+                    i += 1
+                else:
+                    fp.write(key)
+                position = i
+            fp.write(mm[HEADER_SIZE + position * KEY_SIZE:])
+    os.replace(tmp_path, path)
+    return count
+
+
+class PostcodeIndex(object):
+    """ Class PostcodeIndex checks the existence of postcodes in a memory mapped index file
+        Attributes:
+            path: the index file
+            count: number of postcodes in the index
+            version: digest of the index content, it changes when the index is rebuilt
+    """
+
+    def __init__(self, path: str):
+        """PostcodeIndex Constructor"""
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < HEADER_SIZE:
+            self._mm.close()
+            raise ValueError(f"Not a postcode index: {path}")
+        magic, self.count = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or len(self._mm) != HEADER_SIZE + self.count * KEY_SIZE:
+            self._mm.close()
+            raise ValueError(f"Not a postcode index: {path}")
+        self.version = hashlib.sha1(self._mm).hexdigest()[:12]
+        self._fences = [self.key(i) for i in range(0, self.count, FENCE_STEP)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, postcode: str) -> bool:
+        return self.exists(postcode)
+
+    def preload(self):
+        """Ask the OS to read the whole file in its cache, the pages are shared by all the processes mapping it"""
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self._mm.madvise(mmap.MADV_WILLNEED)
+
+    def close(self):
+        self._mm.close()
+
+    def key(self, i: int) -> bytes:
+        """Return the i-th key of the index"""
+        start = HEADER_SIZE + i * KEY_SIZE
+        return self._mm[start:start + KEY_SIZE]
+
+    def bisect(self, key: bytes) -> int:
+        """Return the position of the first key of the index not less than key"""
+        # The fences bound the block of the key, the search in the mapped file is limited to it
+        block = bisect_right(self._fences, key) - 1
+        if block < 0:
+            return 0
+        mm = self._mm
+        lo = block * FENCE_STEP
+        hi = min(lo + FENCE_STEP, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER_SIZE + mid * KEY_SIZE
+            if mm[start:start + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def exists(self, postcode: str) -> bool:
+        """Return True if the postcode, in any case and spacing, is in the index"""
+        key = pack_postcode(postcode)
+        if key is None:
+            return False
+        return self.exists_key(key)
+
+    def exists_key(self, key: bytes) -> bool:
+        """Return True if the packed postcode is in the index"""
+        i = self.bisect(key)
+        return i < self.count and self.key(i) == key
+
+    def exists_many(self, postcodes, is_valid=None) -> list:
+        """Return the existence flags of a list of postcodes, the repeated ones are looked up once
+
+           Arguments
+           postcodes: list of strings
+           is_valid: an optional list of flags, the postcodes not valid are not looked up and don't exist
+        """
+        if is_valid is None:
+            is_valid = [True] * len(postcodes)
+
+        known = {}
+        exists = self.exists
+        result = []
+        append = result.append
+        for postcode, valid in zip(postcodes, is_valid):
+            if not valid:
+                append(False)
+                continue
+            flag = known.get(postcode)
+            if flag is None:
+                flag = known[postcode] = exists(postcode)
+            append(flag)
+        return result
+
+    def complete(self, prefix: str, limit: int = 10) -> list:
+        """Return the first limit postcodes of the index starting with prefix, see prefix_keys
+
+           Each key prefix is a range of keys: it's found with a binary search and read up to limit keys,
+           so the time doesn't depend on the size of the index nor on the number of the matching postcodes.
+        """
+        result = []
+        for chars in prefix_keys(prefix):
+            if len(result) >= limit:
+                break
+            low = _pack_chars(chars.ljust(KEY_CHARS, ALPHABET[0]))
+            high = _pack_chars(chars.ljust(KEY_CHARS, ALPHABET[-1]))
+            if low is None or high is None:
+                continue
+
+            i = self.bisect(low)
+            while i < self.count and len(result) < limit:
+                key = self.key(i)
+                if key > high:
+                    break
+                postcode = unpack_postcode(key)
+                if postcode not in result:
+                    result.append(postcode)
+                i += 1
+        return result
+
+    def postcodes(self, start: int = 0, stop: int = None):
+        """Iterate over the formatted postcodes of the index from position start to stop"""
+        stop = self.count if stop is None else min(stop, self.count)
+        for i in range(start, stop):
+            yield unpack_postcode(self.key(i))
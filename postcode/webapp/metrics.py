@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode metrics module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Counters and histograms rendered in the Prometheus text format. An update is a dictionary lookup and an
+   addition under a lock, cheap enough to be left on under full load.
+"""
+import random
+import threading
+from bisect import bisect_left
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    labels = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """ Class Counter counts events, by label values
+        Attributes:
+            name: metric name
+            help: metric description
+            labels: label names
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        """Counter Constructor"""
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """Add amount to the counter of the label values"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(object):
+    """ Class Histogram counts observations in cumulative buckets, by label values
+        Attributes:
+            name: metric name
+            help: metric description
+            buckets: upper bounds of the buckets, in increasing order
+            labels: label names
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        """Histogram Constructor"""
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Add an observation to the histogram of the label values"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count for each bucket plus +Inf, then the sum of the observations
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labels) -> int:
+        counts = self._values.get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(float(counts[-1]))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry(object):
+    """ Class Registry collects the metrics and renders them in the Prometheus text format
+        Attributes:
+            metrics: the registered metrics
+            collectors: functions returning (name, type, help, value) of metrics computed at render time
+    """
+
+    def __init__(self):
+        """Registry Constructor"""
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets: tuple, labels: tuple = ()) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, type, help, value in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer(object):
+    """ Class StageTimer accumulates the time spent in each stage of the validation
+        Only a sample of the batches is timed, see sample(), the others run the validator without timers.
+        Attributes:
+            seconds: Counter of the seconds spent, by stage
+            items: Counter of the postcodes gone through, by stage
+            rate: fraction of the batches to time
+    """
+
+    def __init__(self, seconds: Counter, items: Counter, rate: float = 0.01):
+        """StageTimer Constructor"""
+        self.seconds = seconds
+        self.items = items
+        self.rate = rate
+
+    def sample(self) -> bool:
+        """Return True if the next batch should be timed"""
+        return self.rate > 0 and random.random() < self.rate
+
+    def __call__(self, stage: str, seconds: float, items: int = 1):
+        self.seconds.inc(stage, amount=seconds)
+        self.items.inc(stage, amount=items)
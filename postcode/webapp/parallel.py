@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode parallel module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Validate large batches of postcodes on a pool of processes: the batch is split in chunks, the chunks are
+   validated by the workers and the results are merged back in input order.
+   The batches smaller than a threshold are validated in the calling process, so they don't pay the pool overhead.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from webapp.batch import PostcodeBatch, validate_many
+from webapp.postcode import Postcode
+from webapp.rules import get_rule_table, set_rules
+
+
+def _validate_chunk(postcodes: list, rules, source: tuple) -> PostcodeBatch:
+    """Validate a chunk of postcodes in a worker, with the same rules of the parent process"""
+    if get_rule_table(rules).source != source:
+        set_rules(rules, source)
+    return validate_many(postcodes, rules=rules)
+
+
+class ParallelValidator(object):
+    """ Class ParallelValidator validates batches of postcodes on a pool of processes
+        Attributes:
+            workers: number of worker processes, the number of CPUs by default
+            chunk_size: number of postcodes sent to a worker at once
+            threshold: batches smaller than this are validated in the calling process
+            rules: a class with the Postcode regex and special cases lists
+    """
+
+    def __init__(self, workers: int = None, chunk_size: int = 10000, threshold: int = 50000, rules=Postcode):
+        """ParallelValidator Constructor"""
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.threshold = threshold
+        self.rules = rules
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """The pool of processes, started on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def validate_many(self, postcodes, cache=None) -> PostcodeBatch:
+        """Validate, format and split a batch of postcodes, on the pool if the batch is large enough
+
+           Arguments
+           postcodes: iterable of strings
+           cache: an optional PostcodeCache, used only when the batch is validated in the calling process
+
+           Return:
+           a PostcodeBatch with the results stored by column, in the same order of the postcodes
+        """
+        postcodes = postcodes if isinstance(postcodes, list) else list(postcodes)
+        if len(postcodes) < self.threshold or self.workers < 2:
+            return validate_many(postcodes, rules=self.rules, cache=cache)
+
+        chunk_size = self.chunk_size
+        chunks = [postcodes[i:i + chunk_size] for i in range(0, len(postcodes), chunk_size)]
+        source = get_rule_table(self.rules).source
+        count = len(chunks)
+
+        # map returns the results in the order of the chunks
+        batch = PostcodeBatch()
+        for chunk_batch in self.executor.map(_validate_chunk, chunks, [self.rules] * count, [source] * count):
+            batch.extend(chunk_batch)
+        return batch
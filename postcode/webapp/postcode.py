@@ -17,6 +17,71 @@
                         The API that this library provides is your choice.
 """
 import re
+import sys
+from time import perf_counter
+from typing import NamedTuple, Optional
+
+from webapp.rules import get_rule_table
+
+# Status codes: a compact replacement for the message strings, used by the batch API
+STATUS_VALID = 0
+STATUS_INVALID = 1
+STATUS_BAD_LENGTH = 2
+STATUS_SPECIAL_CHARS = 3
+
+# Messages indexed by status code
+MESSAGES = (
+    "VALID: the post code is valid",
+    "INVALID: the post code is invalid",
+    "ERROR: length must be minimum 5 and maximum 8",
+    "ERROR: No special characters allowed",
+)
+
+
+class _CompiledRegex(object):
+    """ Class _CompiledRegex is the compiled POSTCODE_REGEX of a rules class, compiled on first access.
+        The compiled patterns are cached by re, so it follows the changes of POSTCODE_REGEX.
+    """
+
+    def __get__(self, instance, owner):
+        return re.compile(owner.POSTCODE_REGEX)
+
+
+class PostcodeResult(NamedTuple):
+    """ Immutable result of the validation of a postcode, built by parse_postcode
+        The attributes have the same meaning of the Postcode ones, the message is derived from the status code.
+        The components shared by many postcodes (outward and inward code, area, district, sector and unit)
+        are interned, so large sets of results keep a single copy of each of them.
+        exists is None unless the postcode has been looked up in a PostcodeIndex, suggestions is None unless
+        corrections have been looked for with a PostcodeSuggester, then it's a tuple: the results may be shared.
+    """
+    in_postcode: str
+    fmt_postcode: str = ""
+    outward_code: str = ""
+    inward_code: str = ""
+    postcode_area: str = ""
+    postcode_district: str = ""
+    postcode_sector: str = ""
+    postcode_unit: str = ""
+    is_valid: bool = False
+    status: int = STATUS_BAD_LENGTH
+    exists: Optional[bool] = None
+    suggestions: Optional[tuple] = None
+
+    @property
+    def message(self) -> str:
+        return MESSAGES[self.status]
+
+    def to_dict(self) -> dict:
+        """Return the result as a dictionary with the same keys of the Postcode attributes"""
+        # The fields before status are the Postcode attributes
+        result = dict(zip(self._fields[:self._fields.index('status')], self))
+        result['message'] = MESSAGES[self.status]
+        if self.exists is not None:
+            result['exists'] = self.exists
+        if self.suggestions is not None:
+            result['suggestions'] = self.suggestions
+        return result
 
 
 class Postcode(object):
@@ -66,8 +131,8 @@ class Postcode(object):
     POSTCODE_REGEX = r"^(GIR ?0AA|[A-PR-UWYZ]([0-9]{1,2}|([A-HK-Y][0-9]([0-9ABEHMNPRV-Y])?)"\
                      r"|[0-9][A-HJKPS-UW]) ?[0-9][ABD-HJLNP-UW-Z]{2})$"
 
-    # compile the regex
-    VALID_POSTCODE_REGEX = re.compile(POSTCODE_REGEX)
+    # compile the regex, on first use
+    VALID_POSTCODE_REGEX = _CompiledRegex()
 
     # Special cases and conditions
 
@@ -114,6 +179,40 @@ class Postcode(object):
         self.is_valid = is_valid
         self.message = ""
 
+    @classmethod
+    def rule_table(cls):
+        """Return the special cases compiled into lookup tables, compiled again if they have changed"""
+        return get_rule_table(cls)
+
+    @classmethod
+    def validate_many(cls, postcodes, cache=None):
+        """Validate, format and split a whole batch of postcodes in one pass
+
+           Arguments
+           postcodes: iterable of strings
+           cache: an optional PostcodeCache shared between the batches
+
+           Return:
+           a PostcodeBatch with the results stored by column
+        """
+        from webapp.batch import validate_many
+
+        return validate_many(postcodes, rules=cls, cache=cache)
+
+    @classmethod
+    def validate_array(cls, postcodes):
+        """Validate, format and split a NumPy array of postcodes with array operations, numpy is needed
+
+           Arguments
+           postcodes: array of strings or of fixed-width bytes, see webapp.vectorized.validate_array
+
+           Return:
+           a PostcodeArrays with the results stored by column, as NumPy arrays
+        """
+        from webapp.vectorized import validate_array
+
+        return validate_array(postcodes, rules=cls)
+
     def format(self, postcode: str) -> str:
         self.in_postcode = postcode
         """Format the post code and return the formatted value with inward and outward code
@@ -177,46 +276,137 @@ class Postcode(object):
            Arguments
            postcode: string
         """
-        if self.validate(postcode):
-
-            # Split the outward code on first digit to get area and district
-            # Example outward code: NW1E; area: NW and district: 1E
-
-            # Get the position of first digit
-            district_start = re.search("\d", self.outward_code).start()
-            # if contains a digit
-            if district_start:
-                # Get the area as all the characters before the first digit
-                self.postcode_area = self.outward_code[:district_start]
-                # Get the district as all the characters following the first digit
-                self.postcode_district = self.outward_code[district_start:]
-
-                # Check for special conditions
-                if not (self.outward_code in self.SPECIAL_COND_OUTWARD):
-                    if self.outward_code.startswith(tuple(self.LETTER_FOLLOW)):
-                        if not self.postcode_district[-1:].isalpha():
-                            self.message = "INVALID: the post code is invalid"
-                            self.is_valid = False
-                    elif self.postcode_area in self.DOUBLE_DIGIT_POSTAREA:
-                        if len(self.postcode_district) != 2 or not (self.postcode_district.isdigit()):
-                            self.message = "INVALID: the post code is invalid"
-                            self.is_valid = False
-                    elif self.postcode_area in self.SINGLE_DIGIT_POSTAREA:
-                        if len(self.postcode_district) != 1 or not (self.postcode_district.isdigit()):
-                            self.message = "INVALID: the post code is invalid"
-                            self.is_valid = False
-
-                    if self.outward_code.startswith(tuple(self.INVALID_OUTWARD)):
-                        self.message = "INVALID: the post code is invalid"
-                        self.is_valid = False
-
-            if self.is_valid:
-                # Split the inward code to get sector and unit
-
-                # Get the sector from inward code as the first letter
-                self.postcode_sector = self.inward_code[:1]
-                # Get unit from inward code as the last 2 letters
-                self.postcode_unit = self.inward_code[1:]
-            else:
-                self.postcode_area = ""
-                self.postcode_district = ""
\ No newline at end of file
+        self.in_postcode = postcode
+        (self.fmt_postcode, self.outward_code, self.inward_code, self.postcode_area, self.postcode_district,
+         self.postcode_sector, self.postcode_unit, self.is_valid, status) = get_validator(type(self))(postcode)
+        self.message = MESSAGES[status]
+
+
+# Rows shared by all the postcodes rejected before the split:
+# (fmt, outward, inward, area, district, sector, unit, is_valid, status)
+_BAD_LENGTH_ROW = ("", "", "", "", "", "", "", False, STATUS_BAD_LENGTH)
+_SPECIAL_CHARS_ROW = ("", "", "", "", "", "", "", False, STATUS_SPECIAL_CHARS)
+
+
+def make_validator(rules=Postcode, timer=None):
+    """Return a function that validates, formats and splits a single postcode
+
+       The special cases are compiled from the rules class once, so the returned function does not
+       pay for them on every call.
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+       timer: an optional function (stage, seconds) called with the time spent in each stage of the validation:
+              format, regex and special_cases. The validator without timer has no overhead at all.
+
+       Return:
+       a function postcode -> (fmt, outward, inward, area, district, sector, unit, is_valid, status),
+       the fields of PostcodeResult following in_postcode
+    """
+    # The regex and the special cases of the same table, even if the rules are swapped meanwhile
+    table = get_rule_table(rules)
+    match = table.regex.match
+    split_outward = table.split_outward
+    intern = sys.intern
+
+    def validate(postcode):
+        if postcode is None:
+            return _BAD_LENGTH_ROW
+
+        postcode = postcode.replace(" ", "")
+        if len(postcode) < 5 or len(postcode) > 7:
+            return _BAD_LENGTH_ROW
+        if not postcode.isalnum():
+            return _SPECIAL_CHARS_ROW
+
+        postcode = postcode.upper()
+        outward_code = postcode[:-3]
+        inward_code = postcode[-3:]
+        fmt_postcode = outward_code + " " + inward_code
+
+        if not match(fmt_postcode):
+            return fmt_postcode, outward_code, inward_code, "", "", "", "", False, STATUS_INVALID
+
+        # Only the codes matched by the regex are interned, there is a bounded number of them
+        outward_code = intern(outward_code)
+        inward_code = intern(inward_code)
+
+        postcode_area, postcode_district, is_valid = split_outward(outward_code)
+
+        if not is_valid:
+            return fmt_postcode, outward_code, inward_code, "", "", "", "", False, STATUS_INVALID
+        return (fmt_postcode, outward_code, inward_code, postcode_area, postcode_district,
+                inward_code[:1], intern(inward_code[1:]), True, STATUS_VALID)
+
+    if timer is None:
+        return validate
+
+    def timed_validate(postcode):
+        # The same steps of validate, with a timer around each stage
+        start = perf_counter()
+        if postcode is None:
+            timer('format', perf_counter() - start)
+            return _BAD_LENGTH_ROW
+
+        postcode = postcode.replace(" ", "")
+        if len(postcode) < 5 or len(postcode) > 7:
+            timer('format', perf_counter() - start)
+            return _BAD_LENGTH_ROW
+        if not postcode.isalnum():
+            timer('format', perf_counter() - start)
+            return _SPECIAL_CHARS_ROW
+
+        postcode = postcode.upper()
+        outward_code = postcode[:-3]
+        inward_code = postcode[-3:]
+        fmt_postcode = outward_code + " " + inward_code
+        formatted = perf_counter()
+        timer('format', formatted - start)
+
+        matched = match(fmt_postcode)
+        checked = perf_counter()
+        timer('regex', checked - formatted)
+        if not matched:
+            return fmt_postcode, outward_code, inward_code, "", "", "", "", False, STATUS_INVALID
+
+        outward_code = intern(outward_code)
+        inward_code = intern(inward_code)
+        postcode_area, postcode_district, is_valid = split_outward(outward_code)
+        timer('special_cases', perf_counter() - checked)
+
+        if not is_valid:
+            return fmt_postcode, outward_code, inward_code, "", "", "", "", False, STATUS_INVALID
+        return (fmt_postcode, outward_code, inward_code, postcode_area, postcode_district,
+                inward_code[:1], intern(inward_code[1:]), True, STATUS_VALID)
+
+    return timed_validate
+
+
+# Validators by rules class, with the rule table they were built from
+_validators = {}
+
+
+def get_validator(rules=Postcode):
+    """Return the validator of make_validator for the current rules of a class, made again when the rules change
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+    """
+    table = get_rule_table(rules)
+    validator = _validators.get(rules)
+    if validator is None or validator[0] is not table:
+        validator = _validators[rules] = (table, make_validator(rules))
+    return validator[1]
+
+
+def parse_postcode(postcode: str, rules=Postcode) -> PostcodeResult:
+    """Validate, format and split the given postcode, without side effects
+
+       Arguments
+       postcode: string
+       rules: a class with the Postcode regex and special cases lists
+
+       Return:
+       a PostcodeResult
+    """
+    return PostcodeResult(postcode, *get_validator(rules)(postcode))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode reload module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Reload the rules file and the index of the known postcodes when they change, without a restart.
+   A thread checks the files every few seconds; a changed file is loaded and compiled in that thread, then swapped
+   in at once: the rules by swap_rules, the index by a callback that replaces the reference the app reads.
+   The requests in progress finish with the rules and the index they started with, the old index is unmapped when
+   the last of them drops it. A file that fails to load is reported and the current rules or index are kept.
+"""
+import logging
+import os
+import threading
+
+from webapp.index import PostcodeIndex
+from webapp.postcode import Postcode, get_validator
+from webapp.rules import load_rules, swap_rules
+
+logger = logging.getLogger(__name__)
+
+
+class Reloader(object):
+    """ Class Reloader swaps in the rules file and the index file when they change
+        Attributes:
+            rules_path: the rules file, see webapp.rules.load_rules, empty for the rules in the code
+            index_path: the index file, see webapp.index, empty for no index
+            interval: seconds between two checks of the files
+            rules: the rules class the rules file is loaded into
+            on_index: function called with the new PostcodeIndex
+            reloads: number of files swapped in
+            errors: number of files that failed to load
+    """
+
+    def __init__(self, rules_path: str = '', index_path: str = '', interval: float = 5, rules=Postcode,
+                 on_index=None):
+        """Reloader Constructor"""
+        self.rules_path = rules_path
+        self.index_path = index_path
+        self.interval = interval
+        self.rules = rules
+        self.on_index = on_index
+        self.reloads = 0
+        self.errors = 0
+        self._stamps = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the rules file now, before the first request: a bad file raises"""
+        if self.rules_path:
+            self._stamps[self.rules_path] = _stamp(self.rules_path)
+            self.reload_rules()
+        if self.index_path:
+            self._stamps[self.index_path] = _stamp(self.index_path)
+
+    def reload_rules(self):
+        release, values = load_rules(self.rules_path)
+        table = swap_rules(self.rules, values, release)
+        # Compile the validator of the new rules here rather than in the first request
+        get_validator(self.rules)
+        logger.info("Rules %s loaded from %s, version %s", release, self.rules_path, table.version)
+
+    def reload_index(self):
+        index = PostcodeIndex(self.index_path)
+        index.preload()
+        if self.on_index is not None:
+            self.on_index(index)
+        logger.info("Index loaded from %s, %d postcodes, version %s", self.index_path, index.count, index.version)
+
+    def check(self) -> bool:
+        """Swap in the files changed since the last check
+
+           Return:
+           True if a file has been swapped in
+        """
+        reloaded = False
+        with self._lock:
+            for path, reload in ((self.rules_path, self.reload_rules), (self.index_path, self.reload_index)):
+                if not path:
+                    continue
+                try:
+                    stamp = _stamp(path)
+                    if stamp == self._stamps.get(path):
+                        continue
+                    # The stamp is recorded first: a bad file is reported once, not at every check
+                    self._stamps[path] = stamp
+                    reload()
+                except Exception:
+                    self.errors += 1
+                    logger.exception("Failed to reload %s", path)
+                    continue
+                self.reloads += 1
+                reloaded = True
+        return reloaded
+
+    def start(self):
+        """Check the files every interval seconds in a daemon thread, once per process"""
+        with self._lock:
+            if self._thread is not None or not self.interval or not (self.rules_path or self.index_path):
+                return
+            self._thread = threading.Thread(target=self._run, name='postcode-reload', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+def _stamp(path: str) -> tuple:
+    # The files are replaced by a rename, a new inode, or rewritten in place, a new time or size
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode rules module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Compile the special cases lists of Postcode (SINGLE_DIGIT_POSTAREA, DOUBLE_DIGIT_POSTAREA, LETTER_FOLLOW,
+   SPECIAL_COND_OUTWARD, INVALID_OUTWARD) into lookup tables, so the split of an outward code in area and district
+   and its verdict take a constant number of lookups whatever the length of the lists.
+   The lists on Postcode stay the declarative source: the tables are compiled again when they change, replaced or
+   edited in place. A change of length is found with a few comparisons, the other changes by comparing the lists.
+   The rules can also be loaded from a versioned JSON file, see load_rules: the new table is compiled first, then
+   swapped in with the rules at once by swap_rules, the validations in progress keep the table they started with.
+"""
+import copy
+import re
+import threading
+from types import SimpleNamespace
+from operator import attrgetter
+
+# Attributes of the rules class the tables are compiled from
+RULE_ATTRIBUTES = ('POSTCODE_REGEX', 'SINGLE_DIGIT_POSTAREA', 'DOUBLE_DIGIT_POSTAREA', 'ZERO_DIGIT_POSTAREA',
+                   'LETTER_FOLLOW', 'SPECIAL_COND_OUTWARD', 'INVALID_OUTWARD')
+
+# Return the tuple of the RULE_ATTRIBUTES of a rules class
+_get_rules = attrgetter(*RULE_ATTRIBUTES)
+
+
+class PrefixSet(object):
+    """ Class PrefixSet checks if a string starts with any of a set of prefixes
+
+        The prefixes are grouped by length, so the check is a lookup for each distinct length
+        (at most 4 for an outward code) instead of a scan of the whole list.
+    """
+
+    __slots__ = ('prefixes', 'lengths')
+
+    def __init__(self, prefixes):
+        self.prefixes = frozenset(prefixes)
+        self.lengths = tuple(sorted({len(prefix) for prefix in self.prefixes}))
+
+    def match(self, value: str) -> bool:
+        """Return True if value starts with one of the prefixes"""
+        prefixes = self.prefixes
+        for length in self.lengths:
+            if value[:length] in prefixes:
+                return True
+        return False
+
+
+class RuleTable(object):
+    """ Class RuleTable holds the special cases of a rules class compiled into lookup tables
+        Attributes:
+            source: a copy of the rules the table was compiled from
+            release: the release of the rules file the rules were loaded from, empty for the rules in the code
+            version: a short hash of the rules, it changes whenever the rules change
+            regex: the compiled POSTCODE_REGEX
+            special_cond_outward: set of the outward codes that skip the special checks
+            letter_follow: prefixes of the outward codes whose district must end with a letter
+            district_length: number of digits of the district, by area
+            invalid_outward: prefixes of the invalid outward codes
+    """
+
+    def __init__(self, rules, release: str = ''):
+        """RuleTable Constructor
+
+           Arguments
+           rules: a class with the Postcode regex and special cases lists
+           release: the release of the rules file, if the rules come from one
+        """
+        # Copy of the rules, to find out when they change
+        self.source = tuple(copy.copy(getattr(rules, name)) for name in RULE_ATTRIBUTES)
+        # Their lengths, most changes resize a list and are found without comparing the lists
+        self._lengths = list(map(len, self.source))
+        self.release = release
+        self._version = None
+        self.regex = re.compile(rules.POSTCODE_REGEX)
+        self.special_cond_outward = frozenset(rules.SPECIAL_COND_OUTWARD)
+        self.letter_follow = PrefixSet(rules.LETTER_FOLLOW)
+        self.invalid_outward = PrefixSet(rules.INVALID_OUTWARD)
+
+        # Double digit areas win over single digit ones, as in Postcode.split_validate
+        self.district_length = {area: 1 for area in rules.SINGLE_DIGIT_POSTAREA}
+        self.district_length.update({area: 2 for area in rules.DOUBLE_DIGIT_POSTAREA})
+
+        # Verdicts by outward code, there are only a few thousands outward codes
+        self._verdicts = {}
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            # Only the caches need the version: hashlib is loaded on first use, not by the library alone
+            import hashlib
+            self._version = hashlib.sha1(repr(self.source).encode('utf-8')).hexdigest()[:12]
+        return self._version
+
+    def is_current(self, rules) -> bool:
+        """Return True if the rules have not changed since the table was compiled"""
+        values = _get_rules(rules)
+        # The lists compare their items by identity first: the items kept since the copy cost a pointer comparison
+        return list(map(len, values)) == self._lengths and values == self.source
+
+    def split_outward(self, outward_code: str) -> tuple:
+        """Split an outward code, already matched by the postcode regex, in area and district and check the special
+           cases
+
+           Arguments
+           outward_code: string
+
+           Return:
+           a tuple (area, district, is_valid), area and district are empty if the outward code is invalid
+        """
+        verdict = self._verdicts.get(outward_code)
+        if verdict is None:
+            verdict = self._verdicts[outward_code] = self._split_outward(outward_code)
+        return verdict
+
+    def _split_outward(self, outward_code: str) -> tuple:
+        # After the regex match the first digit can only be the 2nd or the 3rd character,
+        # the only outward code without digits is GIR
+        if "0" <= outward_code[1:2] <= "9":
+            district_start = 1
+        elif "0" <= outward_code[2:3] <= "9":
+            district_start = 2
+        else:
+            return "", "", True
+
+        postcode_area = outward_code[:district_start]
+        postcode_district = outward_code[district_start:]
+
+        if outward_code not in self.special_cond_outward:
+            if self.letter_follow.match(outward_code):
+                if not postcode_district[-1:].isalpha():
+                    return "", "", False
+            else:
+                district_length = self.district_length.get(postcode_area)
+                if district_length is not None:
+                    if len(postcode_district) != district_length or not postcode_district.isdigit():
+                        return "", "", False
+
+            if self.invalid_outward.match(outward_code):
+                return "", "", False
+
+        return postcode_area, postcode_district, True
+
+
+# Compiled tables by rules class
+_tables = {}
+
+# Held while the rules of a class are swapped, and while a table is compiled on demand
+_lock = threading.Lock()
+
+
+def get_rule_table(rules) -> RuleTable:
+    """Return the compiled table of a rules class, the table is compiled again if the rules have changed
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+    """
+    table = _tables.get(rules)
+    if table is None or not table.is_current(rules):
+        # The rules may be in the middle of a swap: wait for it, the table swapped in is current then
+        with _lock:
+            table = _tables.get(rules)
+            if table is None or not table.is_current(rules):
+                table = _tables[rules] = RuleTable(rules)
+    return table
+
+
+def swap_rules(rules, values: dict, release: str = '') -> RuleTable:
+    """Replace the rules of a class: the new table is compiled first, then the rules and the table are swapped in
+       at once. The validators made before keep the table they were made with.
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+       values: the new values of the RULE_ATTRIBUTES, by name
+       release: the release of the rules file
+
+       Return:
+       the new RuleTable
+    """
+    values = {name: copy.copy(values[name]) for name in RULE_ATTRIBUTES}
+    table = RuleTable(SimpleNamespace(**values), release)
+    with _lock:
+        for name in RULE_ATTRIBUTES:
+            setattr(rules, name, values[name])
+        _tables[rules] = table
+    return table
+
+
+def load_rules(path: str) -> tuple:
+    """Read and check a rules file: a JSON object with all the RULE_ATTRIBUTES and an optional release,
+       e.g. the date of the Royal Mail update
+
+       Arguments
+       path: the rules file
+
+       Return:
+       a tuple (release, values), values is a dictionary of the RULE_ATTRIBUTES for swap_rules
+    """
+    import json
+
+    with open(path, encoding='utf-8') as fp:
+        data = json.load(fp)
+    if not isinstance(data, dict):
+        raise ValueError(f"Not a rules file: {path}")
+    unknown = sorted(set(data) - set(RULE_ATTRIBUTES) - {'release'})
+    missing = [name for name in RULE_ATTRIBUTES if name not in data]
+    if unknown or missing:
+        raise ValueError(f"Bad rules file {path}: unknown {unknown}, missing {missing}")
+
+    release = str(data.get('release', ''))
+    values = {name: data[name] for name in RULE_ATTRIBUTES}
+    for name in RULE_ATTRIBUTES[1:]:
+        if not isinstance(values[name], list) or not all(isinstance(value, str) for value in values[name]):
+            raise ValueError(f"Bad rules file {path}: {name} must be a list of strings")
+    try:
+        re.compile(values['POSTCODE_REGEX'])
+    except (TypeError, re.error) as e:
+        raise ValueError(f"Bad rules file {path}: POSTCODE_REGEX {e}")
+    return release, values
+
+
+def save_rules(rules, path: str, release: str = ''):
+    """Write the rules of a class to a rules file, to edit them out of the code
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+       path: the rules file, written next to it and renamed over it
+       release: the release of the rules
+    """
+    import json
+    import os
+
+    data = {'release': release}
+    data.update((name, getattr(rules, name)) for name in RULE_ATTRIBUTES)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp_path, path)
+
+
+def set_rules(rules, source: tuple):
+    """Set the rules of a class from a copy, e.g. the source of the RuleTable of another process
+
+       Arguments
+       rules: a class with the Postcode regex and special cases lists
+       source: the values of the RULE_ATTRIBUTES, in the same order
+    """
+    swap_rules(rules, dict(zip(RULE_ATTRIBUTES, source)))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode serializer module
+
+   Requirements: No dependencies needed, orjson is used when installed.
+   Compatibility = python3
+
+   Turn the validation results straight into JSON bytes, without walking a model field by field.
+   The batches are serialized from their columns and the fields can be projected to a subset.
+"""
+import json
+
+from webapp.batch import PostcodeBatch
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields of a serialized result, the same of the Postcode attributes and of the REST API model
+DEFAULT_FIELDS = PostcodeBatch.COLUMNS + ('message',)
+
+# All the fields that can be serialized: exists is set only when the postcodes are looked up in an index,
+# suggestions only when corrections are looked for
+OPTIONAL_FIELDS = ('exists', 'suggestions')
+FIELDS = DEFAULT_FIELDS + OPTIONAL_FIELDS
+
+if orjson is not None:
+    dumps = orjson.dumps
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def dumps(obj) -> bytes:
+        """Encode obj as compact JSON bytes"""
+        return _encoder.encode(obj).encode('utf-8')
+
+
+class PostcodeSerializer(object):
+    """ Class PostcodeSerializer encodes validation results as JSON
+        Attributes:
+            fields: the fields of the results to encode, in order
+    """
+
+    def __init__(self, fields=DEFAULT_FIELDS):
+        """PostcodeSerializer Constructor"""
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        self.fields = tuple(fields)
+
+    @classmethod
+    def from_query(cls, value: str = None, default=DEFAULT_FIELDS) -> 'PostcodeSerializer':
+        """Return a serializer for a comma separated list of fields, the default fields if value is empty"""
+        if not value:
+            return cls(default)
+        return cls([field.strip() for field in value.split(',') if field.strip()])
+
+    def columns(self, batch: PostcodeBatch) -> list:
+        """Return the columns of the batch for the fields"""
+        columns = []
+        for field in self.fields:
+            if field == 'message':
+                columns.append(batch.messages)
+            elif field in OPTIONAL_FIELDS and getattr(batch, field) is None:
+                columns.append([None] * len(batch))
+            else:
+                columns.append(getattr(batch, field))
+        return columns
+
+    def rows(self, batch: PostcodeBatch) -> list:
+        """Return the results of the batch as dictionaries with the fields"""
+        fields = self.fields
+        return [dict(zip(fields, values)) for values in zip(*self.columns(batch))]
+
+    def dumps_batch(self, batch: PostcodeBatch) -> bytes:
+        """Encode the results of a batch as a JSON list"""
+        return dumps(self.rows(batch))
+
+    def dumps_lines(self, batch: PostcodeBatch) -> bytes:
+        """Encode the results of a batch as NDJSON, one line for each result"""
+        return b"".join([dumps(row) + b"\n" for row in self.rows(batch)])
+
+    def dumps_result(self, result) -> bytes:
+        """Encode a single result, a PostcodeResult or a Postcode, as a JSON object"""
+        return dumps({field: getattr(result, field, None) for field in self.fields})
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode spatial module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Nearest and radius queries over the coordinates of the postcodes, with a grid index.
+   The coordinates are stored in microdegrees in int32 columns, sorted by grid cell (row-major), so the postcodes
+   of consecutive cells of a grid row are consecutive in the columns: a query reads one range of the columns for
+   each grid row it covers, found with two binary searches over the sorted ids of the non empty cells.
+   The columns are written to a binary file and memory mapped read-only, like the PostcodeIndex.
+
+   File layout: HEADER, then the columns
+   cells: uint32 ids of the non empty cells, sorted
+   starts: uint32 position of the first postcode of each cell, plus the number of postcodes
+   latitudes, longitudes: int32 coordinates of the postcodes, in microdegrees
+   order: uint32 positions of the postcodes sorted by key, to find a postcode
+   keys: the 5 bytes keys of the postcodes, see webapp.index
+"""
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from webapp.index import KEY_SIZE, pack_postcode, unpack_postcode
+
+# Header of the spatial index file: magic, number of postcodes, number of non empty cells,
+# latitude and longitude of the grid origin, height and width of a cell (microdegrees), rows and columns of the grid
+MAGIC = b'PCGRID01'
+HEADER = struct.Struct('<8sQQiiiiII')
+
+# Default size of a cell in microdegrees, about 220m by 200m in the UK
+CELL_LAT = 2000
+CELL_LON = 3000
+
+# Metres in a microdegree of latitude, on the mean Earth radius
+METRES_PER_MICRODEGREE = 6371008.8 * math.pi / 180 / 1e6
+
+# Cells around the query point searched at most by nearest, about 55km
+MAX_SEARCH_CELLS = 256
+
+
+def build_spatial(rows, path: str, cell_lat: int = CELL_LAT, cell_lon: int = CELL_LON) -> int:
+    """Write the spatial index of the postcodes to a file, the rows without valid coordinates are skipped
+
+       Arguments
+       rows: iterable of (postcode, latitude, longitude), the coordinates in degrees as numbers or strings
+       path: the spatial index file
+       cell_lat, cell_lon: size of a cell of the grid, in microdegrees
+
+       Return:
+       the number of postcodes in the index
+    """
+    points = {}
+    for postcode, latitude, longitude in rows:
+        key = pack_postcode(postcode)
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            continue
+        # The ONS Postcode Directory uses 99.999999 for the postcodes without a location
+        if key is None or key in points or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            continue
+        points[key] = (round(latitude * 1e6), round(longitude * 1e6))
+
+    lat_min = min((lat for lat, lon in points.values()), default=0)
+    lon_min = min((lon for lat, lon in points.values()), default=0)
+    nrows = (max((lat for lat, lon in points.values()), default=0) - lat_min) // cell_lat + 1
+    ncols = (max((lon for lat, lon in points.values()), default=0) - lon_min) // cell_lon + 1
+
+    # (cell, key, latitude, longitude) sorted by cell, then by key
+    points = sorted(((lat - lat_min) // cell_lat * ncols + (lon - lon_min) // cell_lon, key, lat, lon)
+                    for key, (lat, lon) in points.items())
+
+    cells, starts = array('I'), array('I')
+    for i, (cell_id, key, lat, lon) in enumerate(points):
+        if not cells or cells[-1] != cell_id:
+            cells.append(cell_id)
+            starts.append(i)
+    starts.append(len(points))
+    latitudes = array('i', [point[2] for point in points])
+    longitudes = array('i', [point[3] for point in points])
+    keys = [point[1] for point in points]
+    order = array('I', sorted(range(len(keys)), key=keys.__getitem__))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, len(keys), len(cells), lat_min, lon_min, cell_lat, cell_lon, nrows, ncols))
+        for column in (cells, starts, latitudes, longitudes, order):
+            if sys.byteorder != 'little':
+                column.byteswap()
+            fp.write(column.tobytes())
+        fp.write(b"".join(keys))
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+class SpatialIndex(object):
+    """ Class SpatialIndex answers nearest and radius queries over the coordinates of the postcodes
+        Attributes:
+            path: the spatial index file
+            count: number of postcodes in the index
+    """
+
+    def __init__(self, path: str):
+        """SpatialIndex Constructor"""
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (magic, self.count, ncells, self.lat_min, self.lon_min, self.cell_lat, self.cell_lon,
+             self.nrows, self.ncols) = HEADER.unpack_from(self._mm)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or len(self._mm) != HEADER.size + (2 * ncells + 1) * 4 + self.count * (12 + KEY_SIZE):
+            self._mm.close()
+            raise ValueError(f"Not a spatial index: {path}")
+
+        view = memoryview(self._mm)
+        offset = HEADER.size
+        columns = []
+        for typecode, length in (('I', ncells), ('I', ncells + 1), ('i', self.count), ('i', self.count),
+                                 ('I', self.count)):
+            if sys.byteorder == 'little':
+                columns.append(view[offset:offset + length * 4].cast(typecode))
+            else:
+                column = array(typecode, view[offset:offset + length * 4])
+                column.byteswap()
+                columns.append(column)
+            offset += length * 4
+        self._cells, self._starts, self._latitudes, self._longitudes, self._order = columns
+        self._keys_offset = offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def preload(self):
+        """Ask the OS to read the whole file in its cache, the pages are shared by all the processes mapping it"""
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self._mm.madvise(mmap.MADV_WILLNEED)
+
+    def close(self):
+        for column in (self._cells, self._starts, self._latitudes, self._longitudes, self._order):
+            if isinstance(column, memoryview):
+                column.release()
+        self._mm.close()
+
+    def key(self, i: int) -> bytes:
+        start = self._keys_offset + i * KEY_SIZE
+        return self._mm[start:start + KEY_SIZE]
+
+    def postcode(self, i: int) -> str:
+        """Return the formatted postcode at position i"""
+        return unpack_postcode(self.key(i))
+
+    def location(self, i: int) -> tuple:
+        """Return the latitude and longitude in degrees of the postcode at position i"""
+        return self._latitudes[i] / 1e6, self._longitudes[i] / 1e6
+
+    def locate(self, postcode: str):
+        """Return the position of a postcode, in any case and spacing, None if it's not in the index"""
+        key = pack_postcode(postcode)
+        if key is None:
+            return None
+        order = self._order
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.key(order[lo]) == key:
+            return order[lo]
+        return None
+
+    def _scan(self, lat: int, lon: int, cells: int, max_distance2: float = math.inf) -> list:
+        """Return (squared distance in square metres, position) of the postcodes in the square of cells
+           around the cell of the point
+
+           Arguments
+           lat, lon: the point in microdegrees
+           cells: number of cells searched on each side of the cell of the point
+           max_distance2: only the postcodes with a squared distance up to this are returned
+        """
+        row = (lat - self.lat_min) // self.cell_lat
+        col = (lon - self.lon_min) // self.cell_lon
+        row0, row1 = max(row - cells, 0), min(row + cells, self.nrows - 1)
+        col0, col1 = max(col - cells, 0), min(col + cells, self.ncols - 1)
+        if row0 > row1 or col0 > col1:
+            return []
+
+        ky = METRES_PER_MICRODEGREE
+        kx = METRES_PER_MICRODEGREE * math.cos(math.radians(lat / 1e6))
+        cell_ids, starts = self._cells, self._starts
+        latitudes, longitudes = self._latitudes, self._longitudes
+        ncols = self.ncols
+
+        found = []
+        append = found.append
+        for grid_row in range(row0, row1 + 1):
+            base = grid_row * ncols
+            first = bisect_left(cell_ids, base + col0)
+            last = bisect_right(cell_ids, base + col1)
+            if first == last:
+                continue
+            start, stop = starts[first], starts[last]
+            for i, point_lat, point_lon in zip(range(start, stop), latitudes[start:stop], longitudes[start:stop]):
+                dy = (point_lat - lat) * ky
+                dx = (point_lon - lon) * kx
+                distance2 = dx * dx + dy * dy
+                if distance2 <= max_distance2:
+                    append((distance2, i))
+        return found
+
+    def nearest(self, latitude: float, longitude: float, limit: int = 1) -> list:
+        """Return the limit postcodes nearest to a point, as (position, distance in metres), the nearest first
+
+           The square of cells searched grows until the limit-th postcode is nearer than any postcode out of it.
+        """
+        if limit <= 0:
+            return []
+        lat, lon = round(latitude * 1e6), round(longitude * 1e6)
+        # Distance covered by a cell on the narrowest side
+        cell_metres = METRES_PER_MICRODEGREE * min(self.cell_lat,
+                                                   self.cell_lon * math.cos(math.radians(latitude)))
+        cells = 1
+        while True:
+            found = self._scan(lat, lon, cells)
+            if len(found) >= limit:
+                found.sort()
+                # The postcodes out of the square are at least cells cells away from the point
+                if found[limit - 1][0] <= (cells * cell_metres) ** 2 or cells >= MAX_SEARCH_CELLS:
+                    break
+            elif cells >= MAX_SEARCH_CELLS:
+                found.sort()
+                break
+            cells *= 2
+        return [(i, math.sqrt(d2)) for d2, i in found[:limit]]
+
+    def within(self, latitude: float, longitude: float, radius: float, limit: int = None) -> list:
+        """Return the postcodes within radius metres of a point, as (position, distance in metres),
+           the nearest first, at most limit of them
+        """
+        lat, lon = round(latitude * 1e6), round(longitude * 1e6)
+        cell_metres = METRES_PER_MICRODEGREE * min(self.cell_lat,
+                                                   self.cell_lon * math.cos(math.radians(latitude)))
+        cells = int(radius // cell_metres) + 1
+        found = sorted(self._scan(lat, lon, cells, radius * radius))
+        if limit is not None:
+            found = found[:limit]
+        return [(i, math.sqrt(d2)) for d2, i in found]
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode suggest module
+
+   Requirements: No dependencies needed.
+   Compatibility = python3
+
+   Suggest corrections for the invalid postcodes, most of them are OCR or keyboard slips.
+   The candidates are generated in rounds of increasing cost:
+   0. the special characters removed or replaced, when there are any
+   1. one confusable character replaced (O/0, I/1, S/5...), two adjacent characters swapped
+   2. two confusable characters replaced
+   3. one character replaced, removed or added, only with the characters allowed at its position
+   Each candidate is checked with the compiled validation rules, then in the index of the known postcodes when
+   there is one. The generation stops at the first round with a valid candidate, so the common slips cost
+   a few dozens of validations.
+"""
+from webapp.postcode import Postcode, STATUS_VALID, make_validator
+from webapp.rules import get_rule_table
+
+# Characters mistaken for each other, by OCR or on a keyboard
+CONFUSABLES = {
+    'O': '0D', '0': 'OD', 'D': '0O', 'Q': '0O',
+    'I': '1L', 'L': '1I', '1': 'IL',
+    'S': '5', '5': 'S',
+    'Z': '2', '2': 'Z',
+    'B': '8', '8': 'B',
+    'G': '6', '6': 'G',
+    'T': '7', '7': 'T',
+    'A': '4', '4': 'A',
+    'U': 'V', 'V': 'U',
+}
+
+# Characters allowed by the regex at each position of the inward code
+INWARD_DIGITS = '0123456789'
+INWARD_LETTERS = 'ABDEFGHJLNPQRSTUWXYZ'
+
+# Characters that can be added or replaced in the outward code
+OUTWARD_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+class PostcodeSuggester(object):
+    """ Class PostcodeSuggester suggests corrections for the invalid postcodes
+        Attributes:
+            index: an optional PostcodeIndex, only the known postcodes are suggested
+            limit: maximum number of suggestions for a postcode
+            rules: the rules class the candidates are validated with
+    """
+
+    def __init__(self, index=None, limit: int = 3, rules=Postcode):
+        """PostcodeSuggester Constructor"""
+        self.index = index
+        self.limit = limit
+        self.rules = rules
+        self._table = None
+        self._validate = None
+
+    def validator(self):
+        """Return the validator of the rules, built again if the rules have changed"""
+        table = get_rule_table(self.rules)
+        if table is not self._table:
+            self._validate = make_validator(self.rules)
+            self._table = table
+        return self._validate
+
+    def suggest(self, postcode: str) -> list:
+        """Return up to limit valid postcodes close to the given one, the likeliest first
+
+           Arguments
+           postcode: string
+        """
+        if not postcode or not postcode.isascii():
+            return []
+        text = postcode.upper().replace(" ", "")
+        if len(text) > 12:
+            return []
+
+        validate = self.validator()
+        exists = self.index.exists if self.index is not None else None
+        limit = self.limit
+        seen = set()
+        found = []
+
+        def check(candidates):
+            for candidate in candidates:
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if len(candidate) < 5 or len(candidate) > 7:
+                    continue
+                row = validate(candidate)
+                if row[-1] == STATUS_VALID and (exists is None or exists(row[0])):
+                    found.append(row[0])
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        seen.add(text)
+        if not text.isalnum():
+            # The special characters are dropped or replaced, then the other fixes apply to what is left
+            if check(_special_edits(text)) or found:
+                return found
+            text = "".join(c for c in text if c.isalnum())
+
+        for edits in ROUNDS:
+            for edit in edits:
+                if check(edit(text)):
+                    return found
+            if found:
+                return found
+        return found
+
+    def suggest_many(self, postcodes, is_valid) -> list:
+        """Return the suggestions for a list of postcodes, an empty list for the valid ones
+
+           Arguments
+           postcodes: list of strings
+           is_valid: list of flags, the valid postcodes get no suggestions
+        """
+        known = {}
+        result = []
+        append = result.append
+        for postcode, valid in zip(postcodes, is_valid):
+            if valid:
+                append([])
+                continue
+            suggestions = known.get(postcode)
+            if suggestions is None:
+                suggestions = known[postcode] = self.suggest(postcode)
+            append(suggestions)
+        return result
+
+
+def _special_edits(text: str):
+    """Yield text without its special characters, then with each special character replaced"""
+    yield "".join(c for c in text if c.isalnum())
+    length = len(text)
+    for i, c in enumerate(text):
+        if not c.isalnum():
+            for replacement in _position_chars(i, length):
+                yield text[:i] + replacement + text[i + 1:]
+
+
+def _confusable_edits(text: str):
+    """Yield text with one character replaced by a confusable one"""
+    for i, c in enumerate(text):
+        for replacement in CONFUSABLES.get(c, ''):
+            yield text[:i] + replacement + text[i + 1:]
+
+
+def _double_confusable_edits(text: str):
+    """Yield text with two characters replaced by confusable ones"""
+    for i, c in enumerate(text):
+        for replacement in CONFUSABLES.get(c, ''):
+            head = text[:i] + replacement
+            tail = text[i + 1:]
+            for j, d in enumerate(tail):
+                for other in CONFUSABLES.get(d, ''):
+                    yield head + tail[:j] + other + tail[j + 1:]
+
+
+def _swaps(text: str):
+    """Yield text with two adjacent characters swapped"""
+    for i in range(len(text) - 1):
+        if text[i] != text[i + 1]:
+            yield text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def _position_chars(position: int, length: int) -> str:
+    """Return the characters worth trying at a position of a postcode of the given length: the inward code,
+       the last 3 characters, is a digit followed by two letters
+    """
+    inward = position - (length - 3)
+    if inward == 0:
+        return INWARD_DIGITS
+    if inward > 0:
+        return INWARD_LETTERS
+    return OUTWARD_CHARS
+
+
+def _replacements(text: str):
+    """Yield text with one character replaced by any other allowed at its position"""
+    length = len(text)
+    if length < 5 or length > 7:
+        return
+    for i, c in enumerate(text):
+        for replacement in _position_chars(i, length):
+            if replacement != c:
+                yield text[:i] + replacement + text[i + 1:]
+
+
+def _deletions(text: str):
+    """Yield text with one character removed"""
+    if len(text) <= 5 or len(text) > 8:
+        return
+    for i in range(len(text)):
+        yield text[:i] + text[i + 1:]
+
+
+def _insertions(text: str):
+    """Yield text with one character added, allowed at its position"""
+    length = len(text) + 1
+    if length < 5 or length > 7:
+        return
+    for i in range(length):
+        for c in _position_chars(i, length):
+            yield text[:i] + c + text[i:]
+
+
+# Rounds of edits, by increasing cost
+ROUNDS = (
+    (_confusable_edits, _swaps),
+    (_double_confusable_edits,),
+    (_replacements, _deletions, _insertions),
+)
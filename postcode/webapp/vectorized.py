@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+"""Postcode vectorized module
+
+   Requirements: numpy, which the rest of the library does not need: pip install numpy
+   Compatibility = python3
+
+   Validate, format and split a NumPy array of postcodes with array operations instead of a call for each postcode,
+   for the postcodes held in NumPy or pandas columns. The answers are the ones of Postcode.split_validate.
+
+   The postcodes are viewed as a matrix of character codes, one row for each postcode. The spaces are squeezed out
+   and the other characters packed to the left, then the length, the characters allowed and the uppercase are masks
+   and arithmetic over the columns of the matrix. The character classes of POSTCODE_REGEX are checked the same way,
+   position by position for each length of outward code. The special cases depend on the outward code alone and
+   there are only a few thousands of them: each distinct outward code is checked once by RuleTable.split_outward and
+   the verdicts are spread back to the rows.
+
+   The masks are written for the POSTCODE_REGEX of the code; rules loaded with another regex are matched with it,
+   on the formatted postcodes only. The rare postcodes with characters out of ASCII, where the Unicode rules of
+   isalnum and upper apply, or with NUL characters inside them, are validated one by one by make_validator.
+"""
+import numpy as np
+
+from webapp.postcode import Postcode, MESSAGES, STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, \
+    STATUS_SPECIAL_CHARS, make_validator
+from webapp.rules import get_rule_table
+
+# The POSTCODE_REGEX the masks of _match_regex are written for
+REGEX = r"^(GIR ?0AA|[A-PR-UWYZ]([0-9]{1,2}|([A-HK-Y][0-9]([0-9ABEHMNPRV-Y])?)"\
+        r"|[0-9][A-HJKPS-UW]) ?[0-9][ABD-HJLNP-UW-Z]{2})$"
+
+# Characters after the spaces are squeezed out: at most 7 in a postcode, one more to tell the longer ones
+WIDTH = 8
+
+# The string columns of the results, in the order of the rows of make_validator
+STRING_COLUMNS = ('fmt_postcode', 'outward_code', 'inward_code', 'postcode_area', 'postcode_district',
+                  'postcode_sector', 'postcode_unit')
+
+SPACE = np.uint8(ord(' '))
+
+# Marks the characters out of ASCII in the 8 bits codes, and DEL: their rows are validated one by one
+NOT_ASCII = 127
+
+# Outward codes are keyed by their 4 characters in base 37: no character, 0-9 and A-Z
+KEY_ALPHABET = '\0' + '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+KEY_SPACE = len(KEY_ALPHABET) ** 4
+
+
+def _char_class(chars: str):
+    """Return a lookup table of 128 flags, True for the codes of chars"""
+    table = np.zeros(128, dtype=bool)
+    table[[ord(c) for c in chars]] = True
+    return table
+
+
+def _letters(excluded: str = '') -> str:
+    return "".join(c for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' if c not in excluded)
+
+
+# The uppercase of the characters allowed by Postcode.format and of the end of the string, NOT_ALNUM for the others
+NOT_ALNUM = 255
+UPPER = np.array([ord(chr(code).upper()) if chr(code).isalnum() or not code else NOT_ALNUM for code in range(128)],
+                 dtype=np.uint8)
+# The digit of the codes in the outward keys
+KEY_DIGIT = np.zeros(128, dtype=np.int32)
+KEY_DIGIT[[ord(c) for c in KEY_ALPHABET]] = np.arange(len(KEY_ALPHABET))
+
+# The character classes of REGEX
+DIGIT = _char_class('0123456789')
+FIRST = _char_class(_letters('QVX'))
+SECOND = _char_class(_letters('IJZ'))
+THIRD = _char_class('ABCDEFGHJKPSTUW')
+FOURTH = _char_class('0123456789ABEHMNPRVWXY')
+UNIT = _char_class(_letters('CIKMOV'))
+
+
+class PostcodeArrays(object):
+    """ Class PostcodeArrays holds the results of validate_array by column, as NumPy arrays
+        Attributes:
+            in_postcode: the input array
+            fmt_postcode, outward_code, inward_code, postcode_area, postcode_district, postcode_sector,
+            postcode_unit: arrays of strings, with the same meaning of the Postcode attributes
+            is_valid: array of booleans
+            status: array of status codes (STATUS_VALID, STATUS_INVALID, STATUS_BAD_LENGTH, STATUS_SPECIAL_CHARS)
+    """
+
+    COLUMNS = ('in_postcode', 'fmt_postcode', 'outward_code', 'inward_code', 'postcode_area', 'postcode_district',
+               'postcode_sector', 'postcode_unit', 'is_valid')
+
+    def __init__(self, in_postcode, columns: dict, status):
+        """PostcodeArrays Constructor
+
+           Arguments
+           in_postcode: the input array
+           columns: the arrays of strings, by name
+           status: the array of status codes
+        """
+        self.in_postcode = in_postcode
+        self.fmt_postcode = columns['fmt_postcode']
+        self.outward_code = columns['outward_code']
+        self.inward_code = columns['inward_code']
+        self.postcode_area = columns['postcode_area']
+        self.postcode_district = columns['postcode_district']
+        self.postcode_sector = columns['postcode_sector']
+        self.postcode_unit = columns['postcode_unit']
+        self.status = status
+        self.is_valid = status == STATUS_VALID
+
+    def __len__(self) -> int:
+        return self.status.size
+
+    @property
+    def messages(self):
+        """The message strings, as Postcode.split_validate would set them"""
+        return np.array(MESSAGES)[self.status]
+
+    def to_dict(self) -> dict:
+        """Return the columns by name, with the messages, e.g. to build a pandas DataFrame"""
+        result = {column: getattr(self, column) for column in self.COLUMNS}
+        result['message'] = self.messages
+        return result
+
+
+def validate_array(postcodes, rules=Postcode) -> PostcodeArrays:
+    """Validate, format and split an array of postcodes with array operations
+
+       Arguments
+       postcodes: a NumPy array or a sequence of strings (dtype U) or of fixed-width bytes (dtype S), read as
+                  latin-1, or an array of objects: the values that are not strings, None or the NaN of pandas,
+                  are missing postcodes, with the status of None
+       rules: a class with the Postcode regex and special cases lists
+
+       Return:
+       a PostcodeArrays with the shape of postcodes, the columns have the values Postcode.split_validate sets for
+       each postcode
+    """
+    # The regex and the special cases of the same table, even if the rules are swapped meanwhile
+    table = get_rule_table(rules)
+    in_postcode = np.asarray(postcodes)
+    values = in_postcode.reshape(-1)
+    missing = None
+    if values.dtype.kind == 'O':
+        missing = np.fromiter((not isinstance(value, str) for value in values.tolist()), dtype=bool,
+                              count=len(values))
+        values = np.where(missing, '', values).astype(str)
+    elif not len(values):
+        values = values.astype('U1')
+    elif values.dtype.kind not in 'US':
+        raise TypeError(f"Not an array of strings: {values.dtype}")
+
+    # One array for each position of the characters, the codes out of ASCII are NOT_ASCII
+    codes = _char_codes(values)
+    size = codes.shape[1]
+
+    # The rows with characters out of ASCII, where the Unicode rules of isalnum and upper apply, and the rows with
+    # NUL characters inside the string, are validated one by one
+    fallback = (codes == NOT_ASCII).any(axis=0) | ((codes[:-1] == 0) & (codes[1:] != 0)).any(axis=0)
+
+    # Squeeze out the spaces: each character is moved left by the number of spaces before it, only the first WIDTH
+    # characters are kept
+    chars = np.zeros((WIDTH, size), dtype=np.uint8)
+    flat = chars.reshape(-1)
+    length = np.zeros(size, dtype=np.intp)
+    for column in codes:
+        kept = (column != 0) & (column != SPACE)
+        moved = np.flatnonzero(kept & (length < WIDTH))
+        flat[length[moved] * size + moved] = column[moved]
+        length += kept
+
+    # Status of the format: the length, then the characters
+    bad_length = ~fallback & ((length < 5) | (length > 7))
+    if missing is not None:
+        bad_length |= missing
+    chars = UPPER[chars]
+    special = ~bad_length & ~fallback & (chars == NOT_ALNUM).any(axis=0)
+    formatted = ~bad_length & ~special & ~fallback
+    status = np.full(size, STATUS_INVALID, dtype=np.uint8)
+    status[bad_length] = STATUS_BAD_LENGTH
+    status[special] = STATUS_SPECIAL_CHARS
+
+    # The outward code is all but the last 3 characters: 2, 3 or 4 of them. The rows not formatted are all zeros
+    # and have none of the three lengths, their codes stay zeros.
+    chars[:, ~formatted] = 0
+    outward_length = np.where(formatted, length - 3, 0)
+    short, middle, long = outward_length == 2, outward_length == 3, outward_length == 4
+    outward = np.stack([chars[0], chars[1], np.where(short, 0, chars[2]), np.where(long, chars[3], 0)])
+    inward = np.stack([np.where(short, chars[2 + i], np.where(middle, chars[3 + i], chars[4 + i])) for i in range(3)])
+    # Formatted postcode: the outward code, a space and the inward code, the characters after the space are moved
+    # right by one
+    fmt = np.empty((8, size), dtype=np.uint8)
+    fmt[:2] = chars[:2]
+    fmt[2] = np.where(short, SPACE, chars[2])
+    fmt[3] = np.where(short, chars[2], np.where(middle, SPACE, chars[3]))
+    fmt[4] = np.where(long, SPACE, chars[3])
+    fmt[5:] = chars[4:7]
+
+    if table.regex.pattern == REGEX:
+        matched = formatted & _match_regex(outward, outward_length, inward)
+    else:
+        matched = formatted.copy()
+        match = table.regex.match
+        candidates = np.flatnonzero(formatted)
+        matched[candidates] = [match(postcode) is not None for postcode in _strings(fmt[:, candidates]).tolist()]
+
+    # The special cases of each distinct outward code: the outward codes are keyed in a dense table when there are
+    # many postcodes, sorted out otherwise
+    keys = KEY_DIGIT[outward[0]]
+    for i in range(1, 4):
+        keys = keys * len(KEY_ALPHABET) + KEY_DIGIT[outward[i]]
+    keys = keys[matched]
+    if len(keys) * 16 > KEY_SPACE:
+        seen = np.zeros(KEY_SPACE, dtype=bool)
+        seen[keys] = True
+        distinct = np.flatnonzero(seen)
+        inverse = np.zeros(KEY_SPACE, dtype=np.intp)
+        inverse[distinct] = np.arange(len(distinct))
+        inverse = inverse[keys]
+    else:
+        distinct, inverse = np.unique(keys, return_inverse=True)
+    verdicts = list(map(table.split_outward, _unpack_outwards(distinct).tolist()))
+    areas = np.array([verdict[0] for verdict in verdicts], dtype='U4')
+    districts = np.array([verdict[1] for verdict in verdicts], dtype='U4')
+    valid_outward = np.array([verdict[2] for verdict in verdicts], dtype=bool)
+
+    valid = np.zeros(size, dtype=bool)
+    valid[matched] = valid_outward[inverse]
+    status[valid] = STATUS_VALID
+    inverse = inverse[valid[matched]]
+    valid_rows = np.flatnonzero(valid)
+
+    columns = {
+        'fmt_postcode': _strings(fmt),
+        'outward_code': _strings(outward),
+        'inward_code': _strings(inward),
+        'postcode_area': np.zeros(size, dtype='U4'),
+        'postcode_district': np.zeros(size, dtype='U4'),
+        'postcode_sector': _strings(np.where(valid, inward[:1], 0)),
+        'postcode_unit': _strings(np.where(valid, inward[1:], 0)),
+    }
+    columns['postcode_area'][valid_rows] = areas[inverse]
+    columns['postcode_district'][valid_rows] = districts[inverse]
+
+    if fallback.any():
+        _validate_rows(columns, status, values, np.flatnonzero(fallback), rules)
+
+    result = PostcodeArrays(in_postcode, columns, status)
+    if in_postcode.ndim != 1:
+        for column in PostcodeArrays.COLUMNS[1:] + ('status',):
+            setattr(result, column, getattr(result, column).reshape(in_postcode.shape))
+    return result
+
+
+def _validate_rows(columns: dict, status, values, positions, rules):
+    """Validate the postcodes at positions one by one, with make_validator, and set their results in the columns"""
+    validate = make_validator(rules)
+    rows = [validate(_decode(value)) for value in values[positions].tolist()]
+    for j, name in enumerate(STRING_COLUMNS):
+        strings = [row[j] for row in rows]
+        # The uppercase of some characters is longer, e.g. ß is SS
+        width = max(map(len, strings))
+        if width > columns[name].dtype.itemsize // 4:
+            columns[name] = columns[name].astype(f'U{width}')
+        columns[name][positions] = strings
+    status[positions] = [row[8] for row in rows]
+
+
+def _char_codes(values):
+    """Return the codes of the characters of an array of strings or bytes, as 8 bits codes: one array for each
+       position, the codes out of ASCII are NOT_ASCII
+    """
+    if not values.dtype.itemsize:
+        values = values.astype(values.dtype.kind + '1')
+    values = np.ascontiguousarray(values)
+    if values.dtype.kind == 'U':
+        codes = values.view(np.uint32).reshape(len(values), values.dtype.itemsize // 4)
+        codes = np.minimum(codes, NOT_ASCII).astype(np.uint8)
+    else:
+        codes = np.minimum(values.view(np.uint8).reshape(len(values), values.dtype.itemsize), NOT_ASCII)
+    return np.ascontiguousarray(codes.T)
+
+
+def _strings(codes):
+    """Return the array of the strings of the codes of their characters, one array for each position: the zero
+       codes end the strings
+    """
+    width, size = codes.shape
+    return np.ascontiguousarray(codes.T, dtype=np.uint32).view(f'U{width}').reshape(size)
+
+
+def _decode(value) -> str:
+    return value.decode('latin-1') if isinstance(value, bytes) else str(value)
+
+
+def _unpack_outwards(keys):
+    """Return the array of the outward codes of their keys"""
+    codes = np.array([ord(c) for c in KEY_ALPHABET], dtype=np.uint8)
+    base = len(KEY_ALPHABET)
+    return _strings(np.stack([codes[keys // base ** (3 - i) % base] for i in range(4)]))
+
+
+def _match_regex(outward, outward_length, inward):
+    """Return the flags of the formatted postcodes matching REGEX, by the character classes of each position
+
+       Arguments
+       outward: the codes of the 4 characters of the outward codes, uppercase
+       outward_length: the lengths of the outward codes
+       inward: the codes of the 3 characters of the inward codes, uppercase
+    """
+    c0, c1, c2, c3 = outward
+    # A9 | A99 | AA9 | A9A | AA99 | AA9A
+    outward_matched = FIRST[c0] & np.select(
+        [outward_length == 2, outward_length == 3, outward_length == 4],
+        [DIGIT[c1],
+         (DIGIT[c1] & DIGIT[c2]) | (SECOND[c1] & DIGIT[c2]) | (DIGIT[c1] & THIRD[c2]),
+         SECOND[c1] & DIGIT[c2] & FOURTH[c3]],
+        False)
+    i0, i1, i2 = inward
+    inward_matched = DIGIT[i0] & UNIT[i1] & UNIT[i2]
+
+    # GIR 0AA, the only postcode out of the pattern
+    gir = (outward_length == 3) & (c0 == ord('G')) & (c1 == ord('I')) & (c2 == ord('R')) & \
+          (i0 == ord('0')) & (i1 == ord('A')) & (i2 == ord('A'))
+    return (outward_matched & inward_matched) | gir